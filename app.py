@@ -8,9 +8,12 @@ from werkzeug.serving import run_simple
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import the Flask apps from each service
+from microservices.api_gateway import app as api_gateway
 from microservices.api_gateway.app import app as api_gateway_app
 from microservices.user_service.app import app as user_service_app
 from microservices.post_service.app import app as post_service_app
+from microservices.engagement_service.app import app as engagement_service_app
+from microservices.message_service.app import app as message_service_app
 
 # Create the main Flask app
 app = Flask(__name__)
@@ -19,9 +22,17 @@ app = Flask(__name__)
 application = DispatcherMiddleware(app, {
     '/api': api_gateway_app,
     '/user': user_service_app,
-    '/post': post_service_app
+    '/post': post_service_app,
+    '/engagement': engagement_service_app,
+    '/message': message_service_app
 })
 
+# The gateway calls the services mounted here directly rather than through Consul and HTTP
+for service_name, service_app in [('user-service', user_service_app), ('post-service', post_service_app),
+                                  ('engagement-service', engagement_service_app),
+                                  ('message-service', message_service_app)]:
+    api_gateway.local_services.mount(service_name, service_app)
+
 if __name__ == '__main__':
     # Run the application
     run_simple('localhost', 5000, application, use_reloader=True, use_debugger=True, use_evalex=True)
\ No newline at end of file
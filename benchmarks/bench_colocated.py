@@ -0,0 +1,125 @@
+"""Compare in-process dispatch to a co-located service with the loopback HTTP hop.
+
+The gateway proxies GETs and POSTs to a stub Flask service. The service
+answers at once, so the timings are the cost of the hop itself. In
+``http`` mode the stub is served by werkzeug on a local port and found
+through LocalConsul, as in a split deployment. In ``local`` mode it is
+mounted as app.py mounts the services, and the gateway calls its WSGI app
+directly. Requests go through the gateway's Flask test client one at a
+time, so client-side HTTP does not blur the difference. JWT checks and
+the circuit breaker run in both modes. Rate limiting and event publishing
+are off.
+
+    python benchmarks/bench_colocated.py --requests 2000 --body-size 65536
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request
+from flask_jwt_extended import create_access_token
+from werkzeug.serving import make_server
+
+from microservices.api_gateway import app as gateway
+from microservices.api_gateway.discovery import LocalConsul, ServiceRegistry
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_werkzeug(app, port):
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_service(body_size):
+    app = Flask('stub_service')
+    payload = b'x' * body_size
+
+    @app.route('/item/<int:item_id>')
+    def get_item(item_id):
+        return payload, 200, {'Content-Type': 'application/octet-stream'}
+
+    @app.route('/item', methods=['POST'])
+    def add_item():
+        return {'received': len(request.get_data())}, 201
+
+    return app
+
+
+class NullPublisher:
+    def publish(self, message):
+        return True
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(client, method, path, headers, body, requests):
+    latencies = []
+    errors = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.open(path, method=method, headers=headers, data=body)
+        response.get_data()
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    latencies.sort()
+    return percentile(latencies, 50), percentile(latencies, 95), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help="requests per route and mode")
+    parser.add_argument('--body-size', type=int, default=16 * 1024, help="bytes in each request and response body")
+    args = parser.parse_args()
+    for name in ('werkzeug', 'microservices.api_gateway.app'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    service = stub_service(args.body_size)
+    port = free_port()
+    serve_werkzeug(service, port)
+    gateway.service_registry = ServiceRegistry(LocalConsul({'stub-service': [('127.0.0.1', port)]}))
+    gateway.limiter.enabled = False
+    gateway.event_publisher = NullPublisher()
+    with gateway.app.app_context():
+        headers = {'Authorization': f"Bearer {create_access_token(identity='bench')}",
+                   'Content-Type': 'application/octet-stream'}
+    client = gateway.app.test_client()
+    routes = [('GET', '/api/v1/stub-service/item/1', None),
+              ('POST', '/api/v1/stub-service/item', b'y' * args.body_size)]
+
+    print(f"{args.requests} sequential requests per row, {args.body_size} byte bodies")
+    print(f"{'route':<8}{'mode':<8}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}{'p50 saved':>11}")
+    for method, path, body in routes:
+        results = {}
+        for mode in ('http', 'local'):
+            if mode == 'local':
+                gateway.local_services.mount('stub-service', service)
+            else:
+                gateway.local_services.unmount('stub-service')
+            measure(client, method, path, headers, body, min(args.requests, 200))  # warm up
+            results[mode] = measure(client, method, path, headers, body, args.requests)
+        for mode, (p50, p95, errors) in results.items():
+            saved = f"{(results['http'][0] - p50) * 1000:.3f}" if mode == 'local' else ''
+            print(f"{method:<8}{mode:<8}{p50 * 1000:>9.3f}{p95 * 1000:>9.3f}{errors:>8}{saved:>11}")
+    gateway.local_services.unmount('stub-service')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Compare the threaded Flask gateway with the asyncio/ASGI gateway.
+
+Both gateways proxy to the same stub upstream, which answers every request
+after a fixed delay to stand in for a slow service. Rate limiting and event
+publishing are disabled and service discovery is served by LocalConsul, so
+the numbers reflect only how each gateway holds concurrent upstream calls.
+Everything runs in one process, so compare the two rows rather than
+reading the absolute figures as production capacity.
+
+Note that the sync gateway wraps upstream calls in pybreaker's
+CircuitBreaker, whose call() holds a lock while the call runs. The sync
+path therefore issues one upstream request at a time per process however
+many threads serve it, which dominates its numbers whenever upstreams are
+slow.
+
+    python benchmarks/bench_gateway_async.py --requests 2000 --concurrency 200 --delay 0.05
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+from flask_jwt_extended import create_access_token
+from werkzeug.serving import make_server
+
+from microservices.api_gateway import app as sync_gateway
+from microservices.api_gateway.asgi import AsyncGateway
+from microservices.api_gateway.discovery import LocalConsul, ServiceRegistry
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def stub_upstream(delay):
+    body = b'{"id": 1, "username": "testuser"}'
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        await asyncio.sleep(delay)
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    return app
+
+
+def serve_uvicorn(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='error',
+                                           backlog=4096, lifespan='off'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def serve_werkzeug(app, port):
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class NullPublisher:
+    def publish(self, message):
+        return True
+
+
+async def run_load(url, headers, total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url, headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'throughput': total / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': errors,
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.05, help="seconds the stub upstream waits per request")
+    args = parser.parse_args()
+    for name in ('httpx', 'werkzeug', 'microservices.api_gateway.app'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    upstream_port = free_port()
+    serve_uvicorn(stub_upstream(args.delay), upstream_port)
+    consul = LocalConsul({'user-service': [('127.0.0.1', upstream_port)]})
+
+    sync_gateway.limiter.enabled = False
+    sync_gateway.service_registry = ServiceRegistry(consul)
+    sync_gateway.event_publisher = NullPublisher()
+    sync_port = free_port()
+    serve_werkzeug(sync_gateway.app, sync_port)
+
+    async_gateway = AsyncGateway(sync_gateway.app, ServiceRegistry(consul), limits=None,
+                                 max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async_port = free_port()
+    serve_uvicorn(async_gateway, async_port)
+
+    with sync_gateway.app.app_context():
+        headers = {'Authorization': f"Bearer {create_access_token(identity='bench')}"}
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, upstream delay {args.delay * 1000:.0f}ms")
+    print(f"{'gateway':<8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, port in (('sync', sync_port), ('async', async_port)):
+        url = f"http://127.0.0.1:{port}/api/v1/user-service/api/v1/user/1"
+        asyncio.run(run_load(url, headers, min(args.requests, args.concurrency), args.concurrency))  # warm up
+        result = asyncio.run(run_load(url, headers, args.requests, args.concurrency))
+        print(f"{name:<8} {result['throughput']:>9.1f} {result['p50'] * 1000:>8.1f} "
+              f"{result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
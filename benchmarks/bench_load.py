@@ -0,0 +1,338 @@
+"""End-to-end load test of the composed app under scripted workloads.
+
+Clients call the gateway mounted in app.py. By default the gateway calls
+the services app.py mounts beside it in process. With ``--dispatch
+http`` it proxies to the user, post and engagement services it finds
+through service discovery instead. Each service's Flask app is served on
+its own local port for that, as in a split deployment.
+
+In-process stand-ins replace the other infrastructure:
+
+- LocalConsul serves discovery.
+- LocalBroker stands in for RabbitMQ.
+- fakeredis stands in for Redis.
+
+They are installed before the services are imported, so everything runs
+in one process with no network. MySQL is still the server configured in
+db/config.py. Load it with db/generate_data.py first; the workloads draw
+user and post ids from its rows. The gateway's rate limiter is off so a
+run measures the request path rather than 429s.
+
+Workloads:
+    feed    read-heavy: home feeds, plus post and user lookups
+    writes  bursts of new posts, follows and unfollows, separated by idle gaps
+    viral   every client reads, comments on and likes the most-liked post
+
+Each run reports the following per route:
+
+- requests and throughput;
+- p50, p95 and p99 latency;
+- errors: 5xx responses and transport failures.
+
+``--save`` writes the results as JSON. ``--baseline`` compares p95
+against a saved run, and exits with status 1 if any route slowed by more
+than ``--tolerance``. Clients and servers share one interpreter, so
+compare runs made on the same machine rather than reading the figures as
+production capacity.
+
+    python db/generate_data.py --users 20000 --truncate
+    python benchmarks/bench_load.py --duration 20 --save benchmarks/baseline.json
+    python benchmarks/bench_load.py --duration 20 --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+import httpx
+import pika
+import redis
+from flask_jwt_extended import create_access_token
+from werkzeug.serving import make_server
+
+from microservices.api_gateway.discovery import LocalConsul, ServiceRegistry
+from microservices.common.publisher import LocalBroker
+
+
+def install_fakes():
+    """Point new Redis and RabbitMQ connections at in-process stand-ins; run before importing the services."""
+    redis.Redis = functools.partial(fakeredis.FakeRedis, server=fakeredis.FakeServer())
+    broker = LocalBroker()
+    pika.BlockingConnection = broker.connect
+    return broker
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_werkzeug(app, port):
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Dataset:
+    """Id ranges of the loaded data, read once from MySQL."""
+
+    def __init__(self, pool):
+        cnx = pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("SELECT (SELECT MAX(id) FROM User), (SELECT MAX(id) FROM Post)")
+            self.max_user, self.max_post = cursor.fetchone()
+            cursor.execute("SELECT id FROM Post ORDER BY like_count DESC, id DESC LIMIT 1")
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            cnx.close()
+        if not self.max_user or not row:
+            raise RuntimeError("No users or posts found; load a dataset with db/generate_data.py first")
+        self.viral_post = row[0]
+
+    def user(self, rng):
+        return rng.randint(1, self.max_user)
+
+    def post(self, rng):
+        # Mostly recent posts, as feeds and links surface them
+        return max(1, self.max_post + 1 - int(rng.paretovariate(1.2)))
+
+
+class FeedWorkload:
+    name = 'feed'
+    burst = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def next_request(self, rng):
+        roll = rng.random()
+        if roll < 0.8:
+            return 'GET feed', 'GET', f"post-service/feed/{self.data.user(rng)}", None
+        if roll < 0.9:
+            return 'GET post', 'GET', f"post-service/post/{self.data.post(rng)}", None
+        return 'GET user', 'GET', f"user-service/api/v1/user/{self.data.user(rng)}", None
+
+
+class WriteWorkload:
+    name = 'writes'
+    burst = (2.0, 1.0)  # seconds of full-rate writes, then seconds idle
+
+    def __init__(self, data):
+        self.data = data
+        self.followed = deque()
+
+    def next_request(self, rng):
+        roll = rng.random()
+        if roll < 0.6:
+            content = f"load test post {rng.randint(1, 10 ** 9)} #loadtest{rng.randint(1, 20)}"
+            return 'POST post', 'POST', 'post-service/post', {'user_id': self.data.user(rng), 'content': content}
+        if roll < 0.8 or not self.followed:
+            pair = {'follower_id': self.data.user(rng), 'followee_id': self.data.user(rng)}
+            self.followed.append(pair)
+            return 'POST follow', 'POST', 'post-service/follow', pair
+        return 'DELETE follow', 'DELETE', 'post-service/follow', self.followed.popleft()
+
+
+class ViralWorkload:
+    name = 'viral'
+    burst = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def next_request(self, rng):
+        post_id = self.data.viral_post
+        roll = rng.random()
+        if roll < 0.6:
+            return 'GET post', 'GET', f"post-service/post/{post_id}", None
+        if roll < 0.8:
+            return 'GET comments', 'GET', f"post-service/post/{post_id}/comments", None
+        if roll < 0.9:
+            return 'POST like', 'POST', f"engagement-service/post/{post_id}/like", {'user_id': self.data.user(rng)}
+        return ('POST comment', 'POST', f"engagement-service/post/{post_id}/comments",
+                {'user_id': self.data.user(rng), 'content': 'load test comment'})
+
+
+WORKLOADS = {workload.name: workload for workload in (FeedWorkload, WriteWorkload, ViralWorkload)}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_workload(base_url, headers, workload, duration, concurrency, seed):
+    latencies = {}
+    errors = Counter()
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        async def worker():
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    return
+                if workload.burst:
+                    active, idle = workload.burst
+                    phase = (now - started) % (active + idle)
+                    if phase >= active:
+                        await asyncio.sleep(min(active + idle - phase, deadline - now))
+                        continue
+                route, method, path, body = workload.next_request(rng)
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    failed = response.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                latencies.setdefault(route, []).append(time.perf_counter() - start)
+                if failed:
+                    errors[route] += 1
+
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {}
+    for route, values in sorted(latencies.items()):
+        values.sort()
+        results[route] = {
+            'requests': len(values),
+            'throughput': len(values) / elapsed,
+            'p50': percentile(values, 50) * 1000,
+            'p95': percentile(values, 95) * 1000,
+            'p99': percentile(values, 99) * 1000,
+            'errors': errors[route],
+        }
+    return results
+
+
+def print_results(name, results, baseline=None):
+    print(f"\n{name}")
+    print(f"{'route':<16}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'p95 vs baseline':>17}")
+    for route, stats in results.items():
+        before = (baseline or {}).get(route)
+        change = f"{stats['p95'] / before['p95'] - 1:+.0%}" if before and before['p95'] else ''
+        print(f"{route:<16}{stats['requests']:>10}{stats['throughput']:>9.1f}{stats['p50']:>9.1f}"
+              f"{stats['p95']:>9.1f}{stats['p99']:>9.1f}{stats['errors']:>8}{change:>17}")
+
+
+def regressions(results, baseline, tolerance):
+    slower = []
+    for workload, routes in results.items():
+        for route, stats in routes.items():
+            before = baseline.get(workload, {}).get(route)
+            if before and before['p95'] and stats['p95'] > before['p95'] * (1 + tolerance):
+                slower.append(f"{workload} {route}: p95 {before['p95']:.1f}ms -> {stats['p95']:.1f}ms")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help="comma-separated subset of workloads")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per workload")
+    parser.add_argument('--warmup', type=float, default=2, help="seconds per workload before measuring")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    parser.add_argument('--dispatch', choices=('local', 'http'), default='local',
+                        help="call co-located services in process, or over HTTP through discovery")
+    args = parser.parse_args()
+    names = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+
+    broker = install_fakes()
+    # Imported only once the fakes are in place, since the services connect at import time
+    import app as composed
+    from db.pool import get_pool
+    from microservices.api_gateway import app as gateway
+    from microservices.engagement_service import app as engagement_service
+    from microservices.post_service import app as post_service
+    from microservices.user_service import app as user_service
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ('httpx', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    try:
+        data = Dataset(get_pool())
+    except Exception as e:
+        print(f"Could not read the dataset from MySQL: {e}")
+        sys.exit(2)
+
+    instances = {}
+    for name, service in (('user-service', user_service), ('post-service', post_service),
+                          ('engagement-service', engagement_service)):
+        port = free_port()
+        serve_werkzeug(service.app, port)
+        instances[name] = [('127.0.0.1', port)]
+    gateway.service_registry = ServiceRegistry(LocalConsul(instances), strategy=gateway.LOAD_BALANCING_STRATEGY)
+    gateway.limiter.enabled = False
+    gateway.COLOCATED_DISPATCH = args.dispatch == 'local'
+    port = free_port()
+    serve_werkzeug(composed.application, port)
+    base_url = f"http://127.0.0.1:{port}/api/api/v1/"
+    with gateway.app.app_context():
+        headers = {'Authorization': f"Bearer {create_access_token(identity='bench')}"}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings']['concurrency'] != args.concurrency:
+            print(f"Warning: the baseline ran at concurrency {baseline['settings']['concurrency']}")
+        if baseline['settings'].get('dispatch', 'http') != args.dispatch:
+            print(f"Warning: the baseline used {baseline['settings'].get('dispatch', 'http')} dispatch")
+
+    print(f"{data.max_user} users, {data.max_post} posts, concurrency {args.concurrency}, "
+          f"{args.duration:.0f}s per workload, {args.dispatch} dispatch")
+    results = {}
+    for name in names:
+        workload = WORKLOADS[name](data)
+        if args.warmup:
+            asyncio.run(run_workload(base_url, headers, workload, args.warmup, args.concurrency, args.seed))
+        results[name] = asyncio.run(run_workload(base_url, headers, workload, args.duration, args.concurrency,
+                                                 args.seed))
+        print_results(name, results[name], baseline['workloads'].get(name) if baseline else None)
+    print(f"\nEvents published: {sum(broker.published.values())}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'settings': {'concurrency': args.concurrency, 'duration': args.duration, 'dispatch': args.dispatch,
+                             'users': data.max_user, 'posts': data.max_post},
+                'workloads': results
+            }, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if baseline:
+        slower = regressions(results, baseline['workloads'], args.tolerance)
+        for line in slower:
+            print(f"Regression: {line}")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Measure the per-call overhead of stage timing and trace context.
+
+Times a no-op wrapped in Metrics.timed(), start_trace() on a valid
+traceparent, and rendering a registry with one histogram per stage. The
+figures are per call on this machine; a span is expected to cost a few
+microseconds.
+
+    python benchmarks/bench_metrics.py --calls 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from microservices.common.metrics import Metrics, Registry, start_trace
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def per_call(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--stages', type=int, default=20, help="histograms in the rendered registry")
+    args = parser.parse_args()
+
+    metrics = Metrics('bench', Registry())
+    noop = lambda: None
+    timed = metrics.timed('noop')(noop)
+    for stage in range(args.stages):
+        metrics.timed(f"stage_{stage}")(noop)()
+
+    baseline = per_call(noop, args.calls)
+    print(f"{args.calls} calls")
+    print(f"{'operation':<16}{'us/call':>10}")
+    print(f"{'timed span':<16}{(per_call(timed, args.calls) - baseline) * 1e6:>10.2f}")
+    print(f"{'start_trace':<16}{per_call(lambda: start_trace(TRACEPARENT), args.calls) * 1e6:>10.2f}")
+    print(f"{'render':<16}{per_call(metrics.render, max(1, args.calls // 1000)) * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
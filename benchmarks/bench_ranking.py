@@ -0,0 +1,108 @@
+"""Benchmark engagement ranking of feed candidates.
+
+Times the per-request work of the ?ranking=engagement feed mode once the
+candidate rows are loaded. That covers building the feature arrays from
+rows, computing author affinity, scoring and selecting a page. A
+per-post Python loop computing the same scores runs alongside for
+comparison.
+
+    python benchmarks/bench_ranking.py --candidates 5000 --runs 500
+"""
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from microservices.post_service import ranking
+
+
+def candidate_rows(count, authors, now, rng):
+    # Shaped like fetch_ranking_candidates rows:
+    # id, user_id, content, created_at, likes, comments, shares, created_at in epoch seconds
+    rows = []
+    for post_id in range(1, count + 1):
+        likes = int(rng.paretovariate(1.2)) - 1
+        created_at = now - timedelta(seconds=int(rng.random() * 3 * 86400))
+        rows.append((post_id, rng.randint(1, authors), "", created_at, likes, likes // 10, likes // 30,
+                     int(created_at.timestamp())))
+    return rows
+
+
+def build_candidates(rows, interactions, mutual):
+    # As in get_ranked_feed
+    columns = list(zip(*rows))
+    return ranking.Candidates(
+        post_ids=columns[0],
+        created_at=columns[7],
+        likes=columns[4],
+        comments=columns[5],
+        shares=columns[6],
+        affinity=ranking.author_affinity(columns[1], interactions, mutual)
+    )
+
+
+def rank_vectorized(rows, interactions, mutual, as_of, limit):
+    return ranking.rank(build_candidates(rows, interactions, mutual), as_of, limit)
+
+
+def rank_loop(rows, interactions, mutual, as_of, limit):
+    scored = []
+    for post_id, author_id, _, _, likes, comments, shares, created_at in rows:
+        age = min(max(as_of - created_at, 0.0), ranking.MAX_AGE)
+        engagement = math.log1p(ranking.LIKE_WEIGHT * likes + ranking.COMMENT_WEIGHT * comments
+                                + ranking.SHARE_WEIGHT * shares)
+        affinity = math.log1p(interactions.get(author_id, 0))
+        if author_id in mutual:
+            affinity += ranking.MUTUAL_FOLLOW_BONUS
+        score = -math.log(2.0) * age / ranking.RECENCY_HALF_LIFE + math.log1p(engagement) + math.log1p(affinity)
+        scored.append((int((score + ranking.RANK_OFFSET) * ranking.RANK_SCALE), post_id))
+    return heapq.nlargest(limit, scored)
+
+
+def measure(fn, runs, *args):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return result, timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', type=int, default=5000)
+    parser.add_argument('--authors', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=21)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    rows = candidate_rows(args.candidates, args.authors, now, rng)
+    interactions = {author_id: rng.randint(1, 50) for author_id in rng.sample(range(1, args.authors + 1), 100)}
+    mutual = set(rng.sample(range(1, args.authors + 1), 30))
+    as_of = int(now.timestamp())
+
+    vectorized, vec_p50, vec_p99 = measure(rank_vectorized, args.runs, rows, interactions, mutual, as_of, args.limit)
+    candidates = build_candidates(rows, interactions, mutual)
+    _, score_p50, score_p99 = measure(ranking.rank, args.runs, candidates, as_of, args.limit)
+    looped, loop_p50, loop_p99 = measure(rank_loop, args.runs, rows, interactions, mutual, as_of, args.limit)
+    assert [post_id for _, post_id in vectorized] == [post_id for _, post_id in looped]
+
+    print(f"{args.candidates} candidates, page of {args.limit}, {args.runs} runs")
+    print(f"{'implementation':<28}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'numpy, rows to page':<28}{vec_p50:>10.3f}{vec_p99:>10.3f}")
+    print(f"{'numpy, scoring and top-k':<28}{score_p50:>10.3f}{score_p99:>10.3f}")
+    print(f"{'python loop, rows to page':<28}{loop_p50:>10.3f}{loop_p99:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark the post search index over a synthetic corpus.
+
+Posts are drawn from a Zipf-distributed vocabulary, so a few terms appear
+in a large share of posts and most are rare, as in real text. The index
+is built in memory, written to a snapshot and then reopened from it, the
+way a restarted service maps its last snapshot. Query latency is measured
+on both and reported for rare, mid-frequency and common terms. Memory is
+the growth in resident set size, and the snapshot size is what the mapping
+can page in.
+
+Scoring is plain Python over each query term's posting list, so latency
+grows with how many posts contain the term. Terms that occur in a large
+share of posts are the slow case.
+
+    python benchmarks/bench_search.py --posts 1000000 --queries 200
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from microservices.post_service.search import SearchIndex
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def build_vocabulary(size, rng):
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 10))))
+    return list(words)
+
+
+def corpus(posts, vocabulary, rng, now):
+    cum_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+    for post_id in range(1, posts + 1):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 30))
+        yield post_id, ' '.join(words), now - rng.random() * 90 * 86400
+
+
+def query_sets(vocabulary, rng, queries):
+    # Vocabulary order is rank order, so slices pick terms by frequency
+    common, mid, rare = vocabulary[:50], vocabulary[500:5000], vocabulary[-20000:]
+    return {
+        'rare term': [rng.choice(rare) for _ in range(queries)],
+        'mid term': [rng.choice(mid) for _ in range(queries)],
+        'two mid terms': [f"{rng.choice(mid)} {rng.choice(mid)}" for _ in range(queries)],
+        'common term': [rng.choice(common) for _ in range(queries)],
+    }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(index, queries, limit, now):
+    rows = []
+    for name, batch in queries.items():
+        latencies = []
+        for query in batch:
+            started = time.perf_counter()
+            index.search(query, limit, now=now)
+            latencies.append((time.perf_counter() - started) * 1000)
+        rows.append((name, percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99)))
+    return rows
+
+
+def print_latencies(title, rows):
+    print(f"\n{title}")
+    print(f"{'query':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, p50, p95, p99 in rows:
+        print(f"{name:<16}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = time.time()
+    vocabulary = build_vocabulary(args.vocabulary, rng)
+    queries = query_sets(vocabulary, rng, args.queries)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.snapshot')
+        baseline = rss_bytes()
+        index = SearchIndex(path)
+        started = time.perf_counter()
+        for post_id, content, created_at in corpus(args.posts, vocabulary, rng, now):
+            index.add(post_id, content, created_at)
+        build_seconds = time.perf_counter() - started
+        stats = index.stats()
+        print(f"indexed {args.posts} posts in {build_seconds:.1f}s ({args.posts / build_seconds:,.0f} posts/s)")
+        print(f"in-memory index: {(rss_bytes() - baseline) / 2 ** 20:,.0f} MiB RSS growth, "
+              f"{stats['live_posting_bytes'] / 2 ** 20:,.0f} MiB in posting arrays, {stats['live_terms']:,} terms")
+        print_latencies("in-memory segment", measure(index, queries, args.limit, now))
+
+        started = time.perf_counter()
+        index.snapshot()
+        print(f"\nsnapshot written in {time.perf_counter() - started:.1f}s, "
+              f"{os.path.getsize(path) / 2 ** 20:,.0f} MiB on disk")
+        del index
+
+        baseline = rss_bytes()
+        started = time.perf_counter()
+        mapped = SearchIndex(path)
+        print(f"snapshot mapped in {(time.perf_counter() - started) * 1000:.1f} ms, "
+              f"{(rss_bytes() - baseline) / 2 ** 20:,.1f} MiB RSS growth before queries")
+        print_latencies("memory-mapped snapshot", measure(mapped, queries, args.limit, now))
+        print(f"RSS growth after queries: {(rss_bytes() - baseline) / 2 ** 20:,.0f} MiB "
+              f"(file-backed pages, shared and reclaimable)")
+
+
+if __name__ == '__main__':
+    main()
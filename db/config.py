@@ -4,4 +4,11 @@ config = {
     'password': 'password',
     'host': '127.0.0.1',
     'database': 'newsfeed'
-}
\ No newline at end of file
+}
+
+# Connection pool configuration (seconds for lifetimes and timeouts)
+pool_config = {
+    'size': 10,
+    'max_lifetime': 1800,
+    'checkout_timeout': 5
+}
@@ -0,0 +1,433 @@
+"""Generate a synthetic newsfeed dataset and bulk-load it into MySQL.
+
+Fills every table in schema.sql: users with profiles, a power-law Follow
+graph, posts with hashtags, likes, comments, shares, and conversations
+with their Inbox rows. A handful of accounts draw most of the follows, a
+handful of posts most of the engagement, and words and hashtags follow a
+Zipf distribution, so feeds, search and trending behave as they would on
+real data. The same seed and options always produce the same rows.
+Timestamps fall in the ``--days`` before ``--end``, so pass ``--end`` as
+well to reproduce a dataset exactly.
+
+Rows are generated in chunks with NumPy and streamed to MySQL as they are
+produced. By default each chunk goes through LOAD DATA LOCAL INFILE, which
+needs local_infile enabled on the server. ``--method insert`` uses
+multi-row INSERTs instead. For the load, foreign key and unique checks
+are off for the session. Secondary indexes are dropped and then rebuilt
+with one ALTER per table; InnoDB ignores ALTER TABLE ... DISABLE KEYS. The
+tables must be empty, or pass ``--truncate``.
+
+    python db/generate_data.py --users 200000 --seed 1
+
+The defaults draw 50 follows per user, somewhat fewer once duplicates are
+dropped, 20 posts per user and 10 likes per post. At 200000 users that is
+around 9M follows, 4M posts and 40M likes. Afterwards, flush Redis and delete the post service's search
+snapshot, so the caches and the search index are rebuilt from the new
+rows.
+"""
+import argparse
+import calendar
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import mysql.connector
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.config import config
+
+logger = logging.getLogger(__name__)
+
+# Tables in load order; with foreign key checks off the order only matters for readability
+TABLES = ['User', 'Profile', 'Follow', 'Tag', 'Post', 'PostTag', 'Like', 'Comment', 'Share', 'Message', 'Inbox']
+
+# Generation configuration
+CHUNK_SIZE = 50000
+SYLLABLES = ['ba', 'ko', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'la', 'pe', 'do', 'zu', 'fi', 'ga', 'he', 'jo']
+STREAMS = ['setup', 'users', 'follows', 'posts', 'messages']
+USER_HISTORY = 365 * 86400  # accounts are created up to a year before the first post
+POPULARITY_EXPONENT = 0.9  # who gets followed and messaged
+ACTIVITY_EXPONENT = 0.8  # who posts
+WORD_EXPONENT = 1.0
+TAG_EXPONENT = 1.1
+DEGREE_SIGMA = 1.0  # spread of the log-normal follows per user
+REACH_SHAPE = 1.5  # Pareto tail of engagement per post; below 2 it has infinite variance, so posts go viral
+ENGAGEMENT_DELAY = 6 * 3600  # mean seconds from a post to a like, comment or share
+MESSAGE_GAP = 3600  # mean seconds between messages in a conversation
+
+
+def word(index):
+    """A pronounceable word, distinct for every index."""
+    index += len(SYLLABLES)  # at least two syllables
+    syllables = []
+    while index:
+        index, digit = divmod(index, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return ''.join(reversed(syllables))
+
+
+def timestamps(seconds):
+    """MySQL datetime literals for an array of epoch seconds, read in a UTC session."""
+    return np.datetime_as_string(np.asarray(seconds, dtype='datetime64[s]')).tolist()
+
+
+def split(values, lengths):
+    """Consecutive runs of ``values``, one per length."""
+    bounds = np.concatenate(([0], np.cumsum(lengths))).tolist()
+    return [values[bounds[i]:bounds[i + 1]] for i in range(len(lengths))]
+
+
+class ZipfSampler:
+    """Draws ids 1..n, the r-th most likely with probability proportional to r ** -exponent.
+
+    Ranks are shuffled over the ids, so popularity is not tied to id order.
+    """
+
+    def __init__(self, n, exponent, rng):
+        self.cdf = np.cumsum(np.arange(1, n + 1, dtype=np.float64) ** -exponent)
+        self.cdf /= self.cdf[-1]
+        self.ids = rng.permutation(n) + 1
+
+    def sample(self, rng, size):
+        ranks = np.searchsorted(self.cdf, rng.random(size), side='right')
+        return self.ids[np.minimum(ranks, len(self.ids) - 1)]
+
+
+class Dataset:
+    """A seeded dataset; ``generate`` writes it to a sink one chunk at a time.
+
+    A sink has ``write(table, columns, rows)``, with rows as tuples in
+    ``columns`` order. Ids are assigned here, so the tables must start empty.
+    """
+
+    def __init__(self, seed=1, users=10000, follows_per_user=50, posts_per_user=20, likes_per_post=10,
+                 comments_per_post=2, shares_per_post=0.5, tags_per_post=1, conversations_per_user=4,
+                 messages_per_conversation=8, tags=5000, vocabulary=20000, days=30, end=None):
+        self.seed = seed
+        self.users = users
+        self.follows_per_user = follows_per_user
+        self.posts = int(users * posts_per_user)
+        self.likes_per_post = likes_per_post
+        self.comments_per_post = comments_per_post
+        self.shares_per_post = shares_per_post
+        self.tags_per_post = tags_per_post
+        self.conversations = int(users * conversations_per_user / 2)
+        self.messages_per_conversation = messages_per_conversation
+        self.end = int(time.time()) if end is None else int(end)
+        self.start = self.end - days * 86400
+
+        rng = self._rng('setup')
+        self.words = np.array([word(i) for i in range(vocabulary)])
+        self.tag_names = [word(i) for i in range(tags)]
+        self.popularity = ZipfSampler(users, POPULARITY_EXPONENT, rng)
+        self.activity = ZipfSampler(users, ACTIVITY_EXPONENT, rng)
+        self.word_sampler = ZipfSampler(vocabulary, WORD_EXPONENT, rng)
+        self.tag_sampler = ZipfSampler(tags, TAG_EXPONENT, rng)
+
+    def _rng(self, stream):
+        # Independent streams, so changing one table's options leaves the others' rows alone
+        return np.random.default_rng([self.seed, STREAMS.index(stream)])
+
+    def _text(self, rng, count, shortest, longest):
+        lengths = rng.integers(shortest, longest + 1, count)
+        words = self.words[self.word_sampler.sample(rng, lengths.sum()) - 1].tolist()
+        return [' '.join(run) for run in split(words, lengths)]
+
+    def _engagement(self, rng, expected, unique):
+        """(post index, user id) pairs drawn around ``expected`` per post; one per user and post if ``unique``."""
+        counts = np.minimum(rng.poisson(expected), self.users)
+        post = np.repeat(np.arange(len(expected)), counts)
+        user = rng.integers(1, self.users + 1, len(post))
+        if unique:
+            post, user = np.divmod(np.unique(post * (self.users + 1) + user), self.users + 1)
+        return post, user
+
+    def _delayed(self, rng, created_at):
+        return timestamps(np.minimum(created_at + rng.exponential(ENGAGEMENT_DELAY, len(created_at)).astype(np.int64),
+                                     self.end))
+
+    def generate(self, sink):
+        self.generate_users(sink)
+        self.generate_follows(sink)
+        self.generate_posts(sink)
+        self.generate_messages(sink)
+
+    def generate_users(self, sink):
+        rng = self._rng('users')
+        for first in range(1, self.users + 1, CHUNK_SIZE):
+            ids = list(range(first, min(first + CHUNK_SIZE, self.users + 1)))
+            created_at = timestamps(self.start - rng.integers(1, USER_HISTORY, len(ids)))
+            bios = self._text(rng, len(ids), 3, 12)
+            sink.write('User', ('id', 'username', 'email', 'password', 'created_at'),
+                       [(i, f"user{i}", f"user{i}@example.com", 'password', at) for i, at in zip(ids, created_at)])
+            sink.write('Profile', ('user_id', 'bio', 'profile_picture', 'created_at'),
+                       [(i, bio, f"avatars/{i}.jpg", at) for i, bio, at in zip(ids, bios, created_at)])
+
+    def generate_follows(self, sink):
+        if not self.follows_per_user or self.users < 2:
+            return
+        rng = self._rng('follows')
+        # Log-normal out-degree with the requested mean; followees are drawn by popularity
+        mu = np.log(self.follows_per_user) - DEGREE_SIGMA ** 2 / 2
+        for first in range(1, self.users + 1, CHUNK_SIZE):
+            followers = np.arange(first, min(first + CHUNK_SIZE, self.users + 1))
+            degrees = np.minimum(rng.lognormal(mu, DEGREE_SIGMA, len(followers)).astype(np.int64), self.users - 1)
+            follower = np.repeat(followers, degrees)
+            followee = self.popularity.sample(rng, len(follower))
+            # Distinct pairs, sorted in primary key order
+            follower, followee = np.divmod(np.unique(follower * (self.users + 1) + followee), self.users + 1)
+            keep = follower != followee
+            follower, followee = follower[keep], followee[keep]
+            created_at = timestamps(rng.integers(self.start, self.end, len(follower)))
+            sink.write('Follow', ('follower_id', 'followee_id', 'created_at'),
+                       list(zip(follower.tolist(), followee.tolist(), created_at)))
+
+    def generate_posts(self, sink):
+        sink.write('Tag', ('id', 'name'), [(i + 1, name) for i, name in enumerate(self.tag_names)])
+        rng = self._rng('posts')
+        tag_count = len(self.tag_names)
+        for first in range(1, self.posts + 1, CHUNK_SIZE):
+            ids = np.arange(first, min(first + CHUNK_SIZE, self.posts + 1))
+            n = len(ids)
+            authors = self.activity.sample(rng, n)
+            # Spread evenly over the window, so created_at grows with the id as it does on a live site
+            created_at = self.start + ((ids - 1 + rng.random(n)) * (self.end - self.start) / self.posts).astype(np.int64)
+            content = self._text(rng, n, 5, 30)
+
+            tag_post = np.repeat(np.arange(n), rng.poisson(self.tags_per_post, n))
+            tag_post, tag_id = np.divmod(np.unique(tag_post * (tag_count + 1) + self.tag_sampler.sample(rng, len(tag_post))),
+                                         tag_count + 1)
+            for post, tag in zip(tag_post.tolist(), tag_id.tolist()):
+                content[post] += ' #' + self.tag_names[tag - 1]
+
+            reach = rng.pareto(REACH_SHAPE, n) * (REACH_SHAPE - 1)  # mean 1
+            like_post, like_user = self._engagement(rng, reach * self.likes_per_post, unique=True)
+            comment_post, comment_user = self._engagement(rng, reach * self.comments_per_post, unique=False)
+            share_post, share_user = self._engagement(rng, reach * self.shares_per_post, unique=False)
+            comments = self._text(rng, len(comment_post), 3, 20)
+
+            post_created_at = timestamps(created_at)
+            sink.write('Post', ('id', 'user_id', 'content', 'created_at', 'like_count', 'share_count', 'comment_count'),
+                       list(zip(ids.tolist(), authors.tolist(), content, post_created_at,
+                                np.bincount(like_post, minlength=n).tolist(),
+                                np.bincount(share_post, minlength=n).tolist(),
+                                np.bincount(comment_post, minlength=n).tolist())))
+            sink.write('PostTag', ('post_id', 'tag_id', 'created_at'),
+                       [(first + post, tag, post_created_at[post]) for post, tag in zip(tag_post.tolist(), tag_id.tolist())])
+            sink.write('Like', ('post_id', 'user_id', 'created_at'),
+                       list(zip((like_post + first).tolist(), like_user.tolist(), self._delayed(rng, created_at[like_post]))))
+            sink.write('Comment', ('post_id', 'user_id', 'content', 'created_at'),
+                       list(zip((comment_post + first).tolist(), comment_user.tolist(), comments,
+                                self._delayed(rng, created_at[comment_post]))))
+            sink.write('Share', ('post_id', 'user_id', 'created_at'),
+                       list(zip((share_post + first).tolist(), share_user.tolist(),
+                                self._delayed(rng, created_at[share_post]))))
+
+    def generate_messages(self, sink):
+        if not self.conversations or self.users < 2:
+            return
+        rng = self._rng('messages')
+        # Distinct unordered pairs, one Inbox row each way; partners are drawn by popularity
+        a = rng.integers(1, self.users + 1, self.conversations)
+        b = self.popularity.sample(rng, self.conversations)
+        a, b = np.divmod(np.unique(np.minimum(a, b) * (self.users + 1) + np.maximum(a, b)), self.users + 1)
+        keep = a != b
+        a, b = a[keep], b[keep]
+
+        next_id = 1
+        for first in range(0, len(a), CHUNK_SIZE):
+            first_user, second_user = a[first:first + CHUNK_SIZE], b[first:first + CHUNK_SIZE]
+            n = len(first_user)
+            counts = rng.geometric(1 / self.messages_per_conversation, n)
+            total = int(counts.sum())
+            ends = np.cumsum(counts)
+            starts = ends - counts
+            conversation = np.repeat(np.arange(n), counts)
+            from_first = rng.random(total) < 0.5
+            sender = np.where(from_first, first_user[conversation], second_user[conversation])
+            receiver = np.where(from_first, second_user[conversation], first_user[conversation])
+            gaps = rng.exponential(MESSAGE_GAP, total)
+            elapsed = np.cumsum(gaps)
+            elapsed -= np.repeat(elapsed[starts] - gaps[starts], counts)
+            opened = rng.integers(self.start, self.end, n)
+            created_at = np.minimum(opened[conversation] + elapsed.astype(np.int64), self.end)
+            ids = np.arange(next_id, next_id + total)
+            next_id += total
+
+            # Unread count of the last message's receiver: the run of messages since they last replied
+            last_from_first = from_first[ends - 1]
+            replied = np.where(from_first != np.repeat(last_from_first, counts), np.arange(total),
+                               np.repeat(starts - 1, counts))
+            unread = ends - 1 - np.maximum.reduceat(replied, starts)
+            last_id, last_at = ids[ends - 1].tolist(), timestamps(created_at[ends - 1])
+
+            sink.write('Message', ('id', 'sender_id', 'receiver_id', 'content', 'created_at'),
+                       list(zip(ids.tolist(), sender.tolist(), receiver.tolist(), self._text(rng, total, 2, 15),
+                                timestamps(created_at))))
+            sink.write('Inbox', ('user_id', 'peer_id', 'last_message_id', 'last_message_at', 'unread_count'),
+                       list(zip(first_user.tolist(), second_user.tolist(), last_id, last_at,
+                                np.where(last_from_first, 0, unread).tolist())) +
+                       list(zip(second_user.tolist(), first_user.tolist(), last_id, last_at,
+                                np.where(last_from_first, unread, 0).tolist())))
+
+
+class BulkLoader:
+    """Writes generated rows to MySQL, with secondary indexes dropped until ``finish``.
+
+    ``method`` is 'infile' for LOAD DATA LOCAL INFILE from a temporary
+    tab-separated file per chunk, or 'insert' for multi-row INSERTs of
+    ``batch_size`` rows.
+    """
+
+    def __init__(self, connection, method='infile', batch_size=5000, directory=None):
+        self.connection = connection
+        self.method = method
+        self.batch_size = batch_size
+        self.directory = directory
+        self.rows = dict.fromkeys(TABLES, 0)
+        self.seconds = dict.fromkeys(TABLES, 0.0)
+        self.cursor = connection.cursor()
+        self._dropped = []  # (table, index, non_unique, column list)
+
+    def prepare(self, truncate=False):
+        self.cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0, time_zone = '+00:00'")
+        for table in TABLES:
+            if truncate:
+                self.cursor.execute(f"TRUNCATE TABLE `{table}`")
+                continue
+            self.cursor.execute(f"SELECT EXISTS (SELECT 1 FROM `{table}`)")
+            if self.cursor.fetchone()[0]:
+                raise RuntimeError(f"Table {table} is not empty; pass --truncate to clear the tables first")
+
+        self.cursor.execute("SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, "
+                            "GROUP_CONCAT(CONCAT('`', COLUMN_NAME, '`') ORDER BY SEQ_IN_INDEX) "
+                            "FROM information_schema.STATISTICS "
+                            "WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME <> 'PRIMARY' "
+                            f"AND TABLE_NAME IN ({', '.join(['%s'] * len(TABLES))}) "
+                            "GROUP BY TABLE_NAME, INDEX_NAME, NON_UNIQUE", tuple(TABLES))
+        for table, index, non_unique, columns in self.cursor.fetchall():
+            try:
+                self.cursor.execute(f"ALTER TABLE `{table}` DROP INDEX `{index}`")
+            except mysql.connector.Error as err:
+                # An index a foreign key relies on has to stay
+                logger.info(f"Keeping index {table}.{index}: {err.msg}")
+                continue
+            self._dropped.append((table, index, non_unique, columns))
+
+    def write(self, table, columns, rows):
+        if not rows:
+            return
+        started = time.perf_counter()
+        if self.method == 'infile':
+            self._load_file(table, columns, rows)
+        else:
+            self._insert(table, columns, rows)
+        self.connection.commit()
+        self.rows[table] += len(rows)
+        self.seconds[table] += time.perf_counter() - started
+
+    def _load_file(self, table, columns, rows):
+        # Generated values never contain tabs, newlines or backslashes, so they need no escaping
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', dir=self.directory,
+                                         delete=False) as f:
+            f.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+        try:
+            self.cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` CHARACTER SET utf8mb4 "
+                                f"({', '.join(columns)})", (f.name,))
+        finally:
+            os.unlink(f.name)
+
+    def _insert(self, table, columns, rows):
+        # executemany sends each batch as a single multi-row INSERT
+        query = f"INSERT INTO `{table}` ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        for i in range(0, len(rows), self.batch_size):
+            self.cursor.executemany(query, rows[i:i + self.batch_size])
+
+    def finish(self):
+        """Rebuild the dropped indexes with one ALTER per table and return the seconds it took."""
+        started = time.perf_counter()
+        clauses = {}
+        for table, index, non_unique, columns in self._dropped:
+            clauses.setdefault(table, []).append(f"ADD {'' if non_unique else 'UNIQUE '}INDEX `{index}` ({columns})")
+        for table, adds in clauses.items():
+            self.cursor.execute(f"ALTER TABLE `{table}` {', '.join(adds)}")
+        self._dropped = []
+        if any(self.rows.values()):
+            self.cursor.execute(f"ANALYZE TABLE {', '.join(f'`{table}`' for table in TABLES)}")
+            self.cursor.fetchall()
+        self.cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--follows-per-user', type=float, default=50)
+    parser.add_argument('--posts-per-user', type=float, default=20)
+    parser.add_argument('--likes-per-post', type=float, default=10)
+    parser.add_argument('--comments-per-post', type=float, default=2)
+    parser.add_argument('--shares-per-post', type=float, default=0.5)
+    parser.add_argument('--tags-per-post', type=float, default=1)
+    parser.add_argument('--conversations-per-user', type=float, default=4)
+    parser.add_argument('--messages-per-conversation', type=float, default=8)
+    parser.add_argument('--tags', type=int, default=5000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--end', type=datetime.fromisoformat, help="UTC end of the time window (default: now)")
+    parser.add_argument('--method', choices=['infile', 'insert'], default='infile')
+    parser.add_argument('--batch-size', type=int, default=5000, help="rows per INSERT with --method insert")
+    parser.add_argument('--tmp-dir', help="directory for the LOAD DATA files (default: the system temp dir)")
+    parser.add_argument('--truncate', action='store_true', help="empty the tables before loading")
+    args = parser.parse_args()
+
+    dataset = Dataset(seed=args.seed, users=args.users, follows_per_user=args.follows_per_user,
+                      posts_per_user=args.posts_per_user, likes_per_post=args.likes_per_post,
+                      comments_per_post=args.comments_per_post, shares_per_post=args.shares_per_post,
+                      tags_per_post=args.tags_per_post, conversations_per_user=args.conversations_per_user,
+                      messages_per_conversation=args.messages_per_conversation, tags=args.tags,
+                      vocabulary=args.vocabulary, days=args.days,
+                      end=calendar.timegm(args.end.timetuple()) if args.end else None)
+
+    try:
+        connection = mysql.connector.connect(
+            host=config['host'],
+            user=config['user'],
+            password=config['password'],
+            database=config['database'],
+            allow_local_infile=args.method == 'infile'
+        )
+    except mysql.connector.Error as err:
+        print(f"The error '{err}' occurred")
+        return
+
+    loader = BulkLoader(connection, args.method, args.batch_size, args.tmp_dir)
+    started = time.perf_counter()
+    try:
+        loader.prepare(args.truncate)
+        dataset.generate(loader)
+    except (mysql.connector.Error, RuntimeError) as err:
+        print(f"Load failed: {err}")
+        if args.method == 'infile' and isinstance(err, mysql.connector.Error):
+            print("If LOAD DATA LOCAL INFILE is disabled, run SET GLOBAL local_infile = 1 or use --method insert")
+    finally:
+        rebuild = loader.finish()
+        connection.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"{'table':<10}{'rows':>14}{'load s':>10}{'rows/s':>12}")
+    for table in TABLES:
+        seconds = loader.seconds[table]
+        print(f"{table:<10}{loader.rows[table]:>14,}{seconds:>10.1f}{loader.rows[table] / seconds if seconds else 0:>12,.0f}")
+    total = sum(loader.rows.values())
+    print(f"{total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s), "
+          f"of which {sum(loader.seconds.values()):.1f}s loading and {rebuild:.1f}s rebuilding indexes")
+
+
+if __name__ == '__main__':
+    main()
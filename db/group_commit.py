@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from mysql.connector import errors
+
+logger = logging.getLogger(__name__)
+
+
+def insert_many(cursor, query, rows):
+    """Insert rows with one multi-row INSERT and return their ids in order.
+
+    mysql.connector rewrites executemany() of an INSERT ... VALUES into a
+    single multi-row statement. InnoDB reserves the auto-increment values of
+    such a simple insert in one allocation, so they are consecutive from
+    lastrowid.
+    """
+    cursor.executemany(query, rows)
+    first_id = cursor.lastrowid
+    return [first_id + i for i in range(len(rows))]
+
+
+class CommitTimeout(errors.OperationalError):
+    """submit() stopped waiting for its row.
+
+    ``written`` is False when the row was withdrawn before it reached
+    MySQL, so retrying is safe. It is None when the row was already part of
+    a batch: it may still commit, and a retry could insert it twice.
+    """
+
+    def __init__(self, msg, written):
+        super().__init__(msg)
+        self.written = written
+
+
+class _PendingWrite:
+    __slots__ = ('params', 'done', 'result', 'error')
+
+    def __init__(self, params):
+        self.params = params
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """Coalesces concurrent single-row inserts into one transaction.
+
+    Writers calling submit() within ``window`` seconds of each other share a
+    multi-row INSERT and a single commit (and so a single fsync), at the cost
+    of up to ``window`` seconds of added latency. ``before_commit(cursor, rows)``
+    runs inside the transaction and ``on_commit(cursor, rows)`` after each
+    commit, both with (id, params) pairs, on the same connection.
+    If a batch fails, its rows are retried one by one so that a bad row only
+    fails its own writer. A writer that stops waiting gets CommitTimeout,
+    which says whether its row was withdrawn or may still be committed.
+    """
+
+    def __init__(self, get_connection, query, window=0.002, max_batch=100, on_commit=None, before_commit=None):
+        self._get_connection = get_connection
+        self.query = query
+        self.window = window
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self.before_commit = before_commit
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._thread = None
+
+    def submit(self, params, timeout=10):
+        pending = _PendingWrite(params)
+        with self._cond:
+            self._queue.append(pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if not pending.done.wait(timeout):
+            with self._cond:
+                try:
+                    self._queue.remove(pending)
+                except ValueError:
+                    raise CommitTimeout(f"Group commit did not complete within {timeout}s", written=None)
+            raise CommitTimeout(f"Group commit did not start within {timeout}s", written=False)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            # Give concurrent writers a chance to join this batch
+            time.sleep(self.window)
+            with self._cond:
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Group commit failed: {e}")
+                for pending in batch:
+                    pending.error = pending.error or e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _write(self, batch):
+        cnx = self._get_connection()
+        if cnx is None:
+            raise errors.OperationalError("Database connection failed")
+        try:
+            cursor = cnx.cursor()
+            try:
+                ids = insert_many(cursor, self.query, [pending.params for pending in batch])
+                if self.before_commit is not None:
+                    self.before_commit(cursor, [(row_id, pending.params) for row_id, pending in zip(ids, batch)])
+                cnx.commit()
+                committed = list(zip(ids, batch))
+            except errors.Error as e:
+                cnx.rollback()
+                if len(batch) == 1:
+                    raise
+                logger.warning(f"Group commit of {len(batch)} rows failed, retrying individually: {e}")
+                committed = []
+                for pending in batch:
+                    try:
+                        cursor.execute(self.query, pending.params)
+                        if self.before_commit is not None:
+                            self.before_commit(cursor, [(cursor.lastrowid, pending.params)])
+                        cnx.commit()
+                        committed.append((cursor.lastrowid, pending))
+                    except errors.Error as row_error:
+                        cnx.rollback()
+                        pending.error = row_error
+            for row_id, pending in committed:
+                pending.result = row_id
+            if self.on_commit is not None and committed:
+                try:
+                    self.on_commit(cursor, [(row_id, pending.params) for row_id, pending in committed])
+                except Exception as e:
+                    logger.error(f"Group commit callback failed: {e}")
+            cursor.close()
+        finally:
+            cnx.close()
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import deque
+from functools import partial
+
+import mysql.connector
+from mysql.connector import errors
+
+from db.config import config, pool_config
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """A checked-out connection.
+
+    Proxies everything to the underlying MySQL connection, except close(),
+    which hands the connection back to its pool instead of disconnecting.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise errors.OperationalError("Connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool._release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded pool of MySQL connections.
+
+    Connections are opened lazily up to ``size``, health-checked on checkout
+    and recycled once they are older than ``max_lifetime`` seconds. When every
+    slot is in use, callers wait up to ``checkout_timeout`` seconds before a
+    PoolError is raised.
+    """
+
+    def __init__(self, connect, size=10, max_lifetime=1800, checkout_timeout=5.0, health_check=True):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._open = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._checkout_failures = 0
+        self._recycled = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def get_connection(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        raw = created_at = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO keeps the most recently used connections warm
+                    raw, created_at = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._checkout_failures += 1
+                    raise errors.PoolError(
+                        f"Timed out after {self.checkout_timeout}s waiting for a free connection")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            waited = time.monotonic() - start
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            if raw is None or not self._usable(raw, created_at):
+                raw, created_at = self._connect(), time.monotonic()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._checkout_failures += 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, created_at)
+
+    def _expired(self, created_at):
+        return self.max_lifetime is not None and time.monotonic() - created_at >= self.max_lifetime
+
+    def _usable(self, raw, created_at):
+        if self._expired(created_at):
+            with self._cond:
+                self._recycled += 1
+            _close_quietly(raw)
+            return False
+        if self.health_check:
+            try:
+                if raw.is_connected():
+                    return True
+            except Exception as e:
+                logger.warning(f"Pooled connection failed health check: {e}")
+            _close_quietly(raw)
+            return False
+        return True
+
+    def _release(self, raw, created_at):
+        expired = self._expired(created_at)
+        reusable = not expired
+        if reusable:
+            try:
+                if raw.in_transaction:
+                    raw.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection after failed rollback: {e}")
+                reusable = False
+        if not reusable:
+            _close_quietly(raw)
+        with self._cond:
+            self._in_use -= 1
+            if expired:
+                self._recycled += 1
+            if reusable:
+                self._idle.append((raw, created_at))
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'checkout_failures': self._checkout_failures,
+                'recycled': self._recycled,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+            }
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._open -= len(idle)
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool built from db.config, creating it on first use."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                connect = partial(
+                    mysql.connector.connect,
+                    user=config['user'],
+                    password=config['password'],
+                    host=config['host'],
+                    database=config['database']
+                )
+                _default_pool = ConnectionPool(connect, **pool_config)
+    return _default_pool
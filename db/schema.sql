@@ -1,4 +1,5 @@
 -- Drop existing tables if they exist
+DROP TABLE IF EXISTS Inbox;
 DROP TABLE IF EXISTS Message;
 DROP TABLE IF EXISTS PostTag;
 DROP TABLE IF EXISTS Tag;
@@ -32,8 +33,11 @@ CREATE TABLE Post (
     user_id INT,
     content TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    like_count INT NOT NULL DEFAULT 0,
+    share_count INT NOT NULL DEFAULT 0,
+    comment_count INT NOT NULL DEFAULT 0,
     FOREIGN KEY (user_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
-    INDEX (user_id)
+    INDEX (user_id, created_at, id)
 );
 -- Create Comment table
 CREATE TABLE Comment (
@@ -44,7 +48,7 @@ CREATE TABLE Comment (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (post_id) REFERENCES Post(id) ON DELETE CASCADE ON UPDATE CASCADE,
     FOREIGN KEY (user_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
-    INDEX (post_id),
+    INDEX (post_id, created_at, id),
     INDEX (user_id)
 );
 -- Create Like table
@@ -55,7 +59,7 @@ CREATE TABLE `Like` (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (post_id) REFERENCES Post(id) ON DELETE CASCADE ON UPDATE CASCADE,
     FOREIGN KEY (user_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
-    INDEX (post_id),
+    UNIQUE (post_id, user_id),
     INDEX (user_id)
 );
 -- Create Share table
@@ -89,9 +93,11 @@ CREATE TABLE Tag (
 CREATE TABLE PostTag (
     post_id INT,
     tag_id INT,
+    created_at TIMESTAMP NOT NULL,
     PRIMARY KEY (post_id, tag_id),
     FOREIGN KEY (post_id) REFERENCES Post(id) ON DELETE CASCADE ON UPDATE CASCADE,
-    FOREIGN KEY (tag_id) REFERENCES Tag(id) ON DELETE CASCADE ON UPDATE CASCADE
+    FOREIGN KEY (tag_id) REFERENCES Tag(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    INDEX (tag_id, created_at, post_id)
 );
 -- Create Message table for direct user-to-user messaging
 CREATE TABLE Message (
@@ -101,5 +107,19 @@ CREATE TABLE Message (
     content TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (sender_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
-    FOREIGN KEY (receiver_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE
+    FOREIGN KEY (receiver_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    INDEX (sender_id, receiver_id, created_at, id)
+);
+-- Create Inbox table: one row per user and conversation partner, updated on every message
+CREATE TABLE Inbox (
+    user_id INT NOT NULL,
+    peer_id INT NOT NULL,
+    last_message_id INT NOT NULL,
+    last_message_at TIMESTAMP NOT NULL,
+    unread_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, peer_id),
+    FOREIGN KEY (user_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (peer_id) REFERENCES User(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (last_message_id) REFERENCES Message(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    INDEX (user_id, last_message_at, last_message_id)
 );
\ No newline at end of file
@@ -0,0 +1,110 @@
+from collections import Counter
+
+import pytest
+from mysql.connector import errors
+
+from db.generate_data import BulkLoader, Dataset
+from microservices.post_service.tags import extract_tags
+
+
+class CollectingSink:
+    def __init__(self):
+        self.rows = {}
+
+    def write(self, table, columns, rows):
+        self.rows.setdefault(table, []).extend(dict(zip(columns, row)) for row in rows)
+
+
+def generate(**kwargs):
+    sink = CollectingSink()
+    Dataset(users=400, end=1708430400, **kwargs).generate(sink)
+    return sink.rows
+
+
+@pytest.fixture(scope='module')
+def rows():
+    return generate(seed=7)
+
+
+def test_same_seed_generates_the_same_rows(rows):
+    assert generate(seed=7) == rows
+    assert generate(seed=8)['Post'] != rows['Post']
+
+
+def test_follow_graph_is_a_power_law_without_duplicates(rows):
+    pairs = [(row['follower_id'], row['followee_id']) for row in rows['Follow']]
+    assert len(set(pairs)) == len(pairs)
+    assert all(follower != followee for follower, followee in pairs)
+    followers = Counter(followee for _, followee in pairs)
+    assert max(followers.values()) > 5 * len(pairs) / len(rows['User'])
+
+
+def test_post_counters_match_engagement_rows(rows):
+    for table, column in [('Like', 'like_count'), ('Comment', 'comment_count'), ('Share', 'share_count')]:
+        counts = Counter(row['post_id'] for row in rows[table])
+        assert all(post[column] == counts[post['id']] for post in rows['Post'])
+    likes = [(row['post_id'], row['user_id']) for row in rows['Like']]
+    assert len(set(likes)) == len(likes)
+
+
+def test_post_tags_match_hashtags_in_content(rows):
+    names = {tag['id']: tag['name'] for tag in rows['Tag']}
+    linked = {}
+    for link in rows['PostTag']:
+        linked.setdefault(link['post_id'], set()).add(names[link['tag_id']])
+    assert linked
+    assert all(set(extract_tags(post['content'])) == linked.get(post['id'], set()) for post in rows['Post'])
+
+
+def test_inbox_summarizes_each_conversation(rows):
+    conversations = {}
+    for message in sorted(rows['Message'], key=lambda message: message['id']):
+        conversations.setdefault(frozenset((message['sender_id'], message['receiver_id'])), []).append(message)
+    assert len(rows['Inbox']) == 2 * len(conversations)
+    for entry in rows['Inbox']:
+        messages = conversations[frozenset((entry['user_id'], entry['peer_id']))]
+        assert entry['last_message_id'] == messages[-1]['id']
+        unread = 0
+        for message in reversed(messages):
+            if message['sender_id'] != entry['peer_id']:
+                break
+            unread += 1
+        assert entry['unread_count'] == unread
+
+
+def test_loader_rebuilds_dropped_indexes_per_table(mocker):
+    connection = mocker.Mock()
+    cursor = connection.cursor.return_value
+    cursor.fetchone.return_value = (0,)
+    cursor.fetchall.return_value = [
+        ('Follow', 'follower_id', 1, '`follower_id`'),
+        ('Follow', 'followee_id', 1, '`followee_id`'),
+        ('Profile', 'user_id', 1, '`user_id`'),
+        ('Like', 'post_id', 0, '`post_id`,`user_id`'),
+    ]
+
+    def execute(query, params=None):
+        if query == "ALTER TABLE `Profile` DROP INDEX `user_id`":
+            raise errors.DatabaseError(msg="needed in a foreign key constraint")
+    cursor.execute.side_effect = execute
+
+    loader = BulkLoader(connection, method='insert')
+    loader.prepare()
+    loader.finish()
+
+    queries = [call.args[0] for call in cursor.execute.call_args_list]
+    assert "ALTER TABLE `Follow` ADD INDEX `follower_id` (`follower_id`), ADD INDEX `followee_id` (`followee_id`)" in queries
+    assert "ALTER TABLE `Like` ADD UNIQUE INDEX `post_id` (`post_id`,`user_id`)" in queries
+    assert not any(query.startswith("ALTER TABLE `Profile` ADD") for query in queries)
+
+
+def test_loader_inserts_in_batches(mocker):
+    connection = mocker.Mock()
+    cursor = connection.cursor.return_value
+
+    loader = BulkLoader(connection, method='insert', batch_size=2)
+    loader.write('Tag', ('id', 'name'), [(1, 'a'), (2, 'b'), (3, 'c')])
+
+    assert [len(call.args[1]) for call in cursor.executemany.call_args_list] == [2, 1]
+    assert cursor.executemany.call_args.args[0] == "INSERT INTO `Tag` (id, name) VALUES (%s, %s)"
+    assert loader.rows['Tag'] == 3
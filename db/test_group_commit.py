@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from mysql.connector import errors
+
+from db.group_commit import CommitTimeout, GroupCommitter
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.lastrowid = None
+
+    def executemany(self, query, rows):
+        if any(row[0] is None for row in rows):
+            raise errors.IntegrityError("Column 'user_id' cannot be null")
+        self.lastrowid = self.db.next_id
+        self.db.next_id += len(rows)
+        self.db.statements.append(len(rows))
+
+    def execute(self, query, row):
+        self.executemany(query, [row])
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.next_id = 1
+        self.statements = []
+        self.commits = 0
+
+    def connect(self):
+        db = self
+
+        class Connection:
+            def cursor(self):
+                return FakeCursor(db)
+
+            def commit(self):
+                db.commits += 1
+
+            def rollback(self):
+                pass
+
+            def close(self):
+                pass
+
+        return Connection()
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+
+def submit_concurrently(committer, rows):
+    results = [None] * len(rows)
+
+    def worker(i):
+        try:
+            results[i] = committer.submit(rows[i])
+        except errors.Error as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(rows))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_writes_share_one_commit(db):
+    committed = []
+    committer = GroupCommitter(db.connect, "INSERT", window=0.2,
+                               on_commit=lambda cursor, rows: committed.extend(rows))
+
+    rows = [(i, "content") for i in range(1, 6)]
+    results = submit_concurrently(committer, rows)
+
+    assert sorted(results) == [1, 2, 3, 4, 5]
+    assert db.commits == 1
+    assert db.statements == [5]
+    assert sorted(committed) == sorted(zip(results, rows))
+
+
+def test_bad_row_only_fails_its_own_writer(db):
+    committer = GroupCommitter(db.connect, "INSERT", window=0.2)
+
+    results = submit_concurrently(committer, [(1, "ok"), (None, "bad"), (2, "ok")])
+
+    assert isinstance(results[1], errors.IntegrityError)
+    assert all(isinstance(result, int) for i, result in enumerate(results) if i != 1)
+
+
+def test_before_commit_runs_inside_the_transaction(db):
+    seen = []
+    committer = GroupCommitter(db.connect, "INSERT", window=0.2,
+                               before_commit=lambda cursor, rows: seen.append((db.commits, rows)))
+
+    rows = [(1, "a"), (2, "b")]
+    results = submit_concurrently(committer, rows)
+
+    assert db.commits == 1
+    assert [commits for commits, _ in seen] == [0]
+    assert sorted(seen[0][1]) == sorted(zip(results, rows))
+
+
+
+def test_timed_out_write_is_withdrawn_or_reported_unknown(db):
+    started, release = threading.Event(), threading.Event()
+
+    def hold_batch(cursor, rows):
+        started.set()
+        release.wait(5)
+
+    committer = GroupCommitter(db.connect, "INSERT", window=0, max_batch=1, before_commit=hold_batch)
+    timeouts = []
+
+    def worker():
+        try:
+            committer.submit((1, "a"), timeout=0.2)
+        except CommitTimeout as e:
+            timeouts.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert started.wait(5)
+    with pytest.raises(CommitTimeout) as queued:
+        committer.submit((2, "b"), timeout=0.1)
+    thread.join()
+    release.set()
+
+    assert [e.written for e in timeouts] == [None]
+    assert queued.value.written is False
+    assert committer.submit((3, "c")) == 2  # the withdrawn row never reached MySQL
+    assert db.statements == [1, 1]
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+from mysql.connector import errors
+
+from db.pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.connected = True
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections():
+    return []
+
+
+@pytest.fixture
+def make_pool(connections):
+    def factory(**kwargs):
+        def connect():
+            connection = FakeConnection()
+            connections.append(connection)
+            return connection
+        return ConnectionPool(connect, **kwargs)
+    return factory
+
+
+def test_connection_is_reused_after_close(make_pool, connections):
+    pool = make_pool(size=2)
+    cnx = pool.get_connection()
+    cnx.close()
+    cnx = pool.get_connection()
+    cnx.close()
+
+    assert len(connections) == 1
+    assert not connections[0].closed
+    stats = pool.stats()
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+
+
+def test_checkout_times_out_when_pool_exhausted(make_pool):
+    pool = make_pool(size=1, checkout_timeout=0.05)
+    held = pool.get_connection()
+
+    with pytest.raises(errors.PoolError):
+        pool.get_connection()
+
+    assert pool.stats()['checkout_failures'] == 1
+    held.close()
+
+
+def test_waiter_gets_released_connection(make_pool, connections):
+    pool = make_pool(size=1, checkout_timeout=2)
+    held = pool.get_connection()
+    threading.Timer(0.05, held.close).start()
+
+    cnx = pool.get_connection()
+    cnx.close()
+
+    assert len(connections) == 1
+    assert pool.stats()['wait_time_max'] > 0
+
+
+def test_unhealthy_connection_is_replaced(make_pool, connections):
+    pool = make_pool(size=1)
+    pool.get_connection().close()
+    connections[0].connected = False
+
+    pool.get_connection().close()
+
+    assert len(connections) == 2
+    assert connections[0].closed
+
+
+def test_connection_recycled_after_max_lifetime(make_pool, connections):
+    pool = make_pool(size=1, max_lifetime=0.01)
+    pool.get_connection().close()
+    time.sleep(0.02)
+
+    pool.get_connection().close()
+
+    assert connections[0].closed
+    assert pool.stats()['recycled'] >= 1
+
+
+def test_open_transaction_rolled_back_on_release(make_pool, connections):
+    pool = make_pool(size=1)
+    cnx = pool.get_connection()
+    connections[0].in_transaction = True
+    cnx.close()
+
+    assert connections[0].rollbacks == 1
@@ -1,14 +1,25 @@
-from flask import Flask, request, jsonify
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from flask import Flask, request, jsonify, Response, stream_with_context
 import requests
-import pika
-import json
 import logging
 from consul import Consul
 from pybreaker import CircuitBreaker
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from functools import wraps
+from microservices.api_gateway.upstream import UpstreamSessions, RequestBodyStream
+from microservices.api_gateway.discovery import ServiceRegistry
+from microservices.api_gateway.response_cache import ResponseCache
+from microservices.api_gateway.colocated import LocalServices, build_environ, call_wsgi
+from microservices.common.publisher import get_publisher
+from microservices.common.profiling import Profiler
+from microservices.common.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, TRACEPARENT, start_trace, current_trace
+from microservices.common.singleflight import SingleFlight
 
 app = Flask(__name__)
 jwt = JWTManager(app)
@@ -18,6 +29,16 @@ app.config['JWT_SECRET_KEY'] = 'secret-key'
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Stage latency metrics, served at /metrics
+metrics = Metrics('api_gateway')
+
+# Opt-in request profiling, read back from /admin/profiles. Set PROFILING_TOKEN to
+# allow profiling by header, which is forwarded so the upstream service profiles
+# too, or PROFILING_SAMPLE_RATE to profile a share of requests.
+app.config['PROFILING_TOKEN'] = None
+app.config['PROFILING_SAMPLE_RATE'] = 0.0
+profiler = Profiler('api_gateway', buffer_size=100)
+
 # Configure rate limiting
 if app.config.get('RATELIMIT_ENABLED', True):
     limiter = Limiter(
@@ -31,38 +52,130 @@ else:
 # Consul configuration
 consul_client = Consul(host="localhost", port=8500)
 
+# Service discovery configuration
+LOAD_BALANCING_STRATEGY = 'round_robin'  # or 'least_outstanding'
+UPSTREAM_FAILURE_STATUSES = {502, 503, 504}
+service_registry = ServiceRegistry(consul_client, strategy=LOAD_BALANCING_STRATEGY)
+
+# Co-located services, mounted by app.py, are called in process instead of over HTTP
+COLOCATED_DISPATCH = True
+local_services = LocalServices()
+
 # RabbitMQ configuration
 RABBITMQ_HOST = 'localhost'
 RABBITMQ_QUEUE = 'service_queue'
+event_publisher = get_publisher(RABBITMQ_HOST, RABBITMQ_QUEUE)
 
 # Circuit breaker configuration
 breaker = CircuitBreaker(fail_max=5, reset_timeout=30)
 
+# Upstream connection pooling configuration
+UPSTREAM_POOL_MAXSIZE = 50  # keep-alive connections per upstream host
+UPSTREAM_POOL_BLOCK = False  # wait for a free connection rather than exceed the per-host limit
+UPSTREAM_IDLE_TIMEOUT = 60  # seconds before an unused upstream's connections are closed
+upstream_sessions = UpstreamSessions(
+    maxsize=UPSTREAM_POOL_MAXSIZE,
+    block=UPSTREAM_POOL_BLOCK,
+    idle_timeout=UPSTREAM_IDLE_TIMEOUT
+)
+
+# Bodies larger than this (or of unknown length) are streamed instead of buffered
+STREAM_THRESHOLD = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailers', 'transfer-encoding', 'upgrade'}
+
+# Response cache configuration: (service, path regex, ttl seconds, per caller)
+RESPONSE_CACHE_ROUTES = [
+    ('post-service', r'post/\d+', 30, False),
+    ('post-service', r'post/\d+/comments', 10, False),
+    ('post-service', r'post/user/\d+', 10, False),
+]
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESPONSE_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+RESPONSE_CACHE_VARY_HEADERS = ('Accept',)
+# Writes to a matching path also invalidate these paths; the author's listing embeds the post
+RESPONSE_CACHE_DEPENDENTS = [
+    ('post-service', r'post/\d+', ['post/user']),
+]
+response_cache = ResponseCache(
+    RESPONSE_CACHE_ROUTES,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    vary_headers=RESPONSE_CACHE_VARY_HEADERS,
+    dependents=RESPONSE_CACHE_DEPENDENTS
+)
+upstream_flight = SingleFlight()
+
+@metrics.timed('get_service_url')
 def get_service_url(service_name):
-    _, services = consul_client.health.service(service_name, passing=True)
-    if services:
-        return f"http://{services[0]['Service']['Address']}:{services[0]['Service']['Port']}"
+    instance = service_registry.acquire(service_name)
+    if instance:
+        return instance.url
     return None
 
+@metrics.timed('publish_message')
 def publish_message(message):
+    # Only buffers the message; the shared publisher sends it from a background thread
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-        channel = connection.channel()
-        channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key=RABBITMQ_QUEUE,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        connection.close()
-        logger.info(f"Message published to queue: {message}")
+        if not event_publisher.publish(message):
+            logger.warning(f"Dropped message for queue {RABBITMQ_QUEUE}: {message}")
     except Exception as e:
         logger.error(f"Error publishing message to RabbitMQ: {str(e)}")
 
+@metrics.timed('make_request')
 @breaker
 def make_request(method, url, **kwargs):
-    return requests.request(method, url, **kwargs)
+    return upstream_sessions.session_for(url).request(method, url, **kwargs)
+
+@metrics.timed('dispatch_local')
+@breaker
+def dispatch_local(service_app, environ):
+    return call_wsgi(service_app, environ)
+
+def upstream_request_body():
+    length = request.content_length
+    if length is None:
+        if request.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return request.get_data()
+        return iter(lambda: request.stream.read(STREAM_CHUNK_SIZE), b'')
+    if length > STREAM_THRESHOLD:
+        return RequestBodyStream(request.stream, length)
+    return request.get_data()
+
+def should_stream(response):
+    if response.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        return True
+    length = response.headers.get('Content-Length')
+    return length is not None and int(length) > STREAM_THRESHOLD
+
+def stream_response(response):
+    def generate():
+        try:
+            yield from response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+        finally:
+            response.close()
+
+    headers = [(key, value) for key, value in response.headers.items()
+               if key.lower() not in HOP_BY_HOP_HEADERS]
+    return Response(stream_with_context(generate()), status=response.status_code, headers=headers)
+
+def cached_response(entry, cache_status):
+    if response_cache.not_modified(entry, request.headers.get('If-None-Match')):
+        return Response(status=304, headers={'ETag': entry.etag, 'X-Cache': cache_status})
+    return entry.body, entry.status, entry.headers + [('X-Cache', cache_status)]
+
+def is_cacheable(response):
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    return (response.status_code == 200 and not should_stream(response)
+            and 'no-store' not in cache_control and 'private' not in cache_control)
+
+@app.before_request
+def begin_trace():
+    start_trace(request.headers.get(TRACEPARENT))
+
+# Registered after begin_trace so profiles carry the trace id
+profiler.install(app)
 
 def jwt_required_with_args():
     def wrapper(fn):
@@ -73,24 +186,87 @@ def jwt_required_with_args():
         return decorated
     return wrapper
 
-@app.route('/api/v1/<service>/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
-@jwt_required_with_args()
-def gateway(service, path):
+class ServiceNotFound(Exception):
+    pass
+
+def upstream_headers():
+    headers = {key: value for (key, value) in request.headers
+               if key != 'Host' and key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != TRACEPARENT}
+    headers[TRACEPARENT] = current_trace().traceparent()
+    return headers
+
+def send_upstream(service, path):
+    service_app = local_services.get(service) if COLOCATED_DISPATCH else None
+    if service_app is not None:
+        # The service reads the body straight from the client's stream
+        headers = upstream_headers()
+        headers['Host'] = request.host
+        return dispatch_local(service_app, build_environ(request.environ, path, request.query_string, headers))
+
     service_url = get_service_url(service)
     if not service_url:
-        return jsonify({"error": "Service not found"}), 404
+        raise ServiceNotFound(service)
 
     url = f"{service_url}/{path}"
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    headers = upstream_headers()
+    upstream_ok = True
     try:
         response = make_request(
             method=request.method,
             url=url,
-            headers={key: value for (key, value) in request.headers if key != 'Host'},
-            data=request.get_data(),
+            headers=headers,
+            data=upstream_request_body(),
             cookies=request.cookies,
             allow_redirects=False,
-            timeout=5
+            timeout=5,
+            stream=True
         )
+        upstream_ok = response.status_code not in UPSTREAM_FAILURE_STATUSES
+        return response
+    except (requests.Timeout, requests.ConnectionError):
+        upstream_ok = False
+        raise
+    finally:
+        service_registry.release(service_url, upstream_ok)
+
+def fetch_cacheable(service, path, cache_key, cache_ttl):
+    # Runs once per cache key at a time; identical requests that miss meanwhile wait and share the result
+    generation = response_cache.generation(service, path)
+    response = send_upstream(service, path)
+    entry = None
+    if is_cacheable(response):
+        headers = [(key, value) for key, value in response.headers.items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS]
+        # A PUT or DELETE that landed during the fetch may have made this body stale; put() then skips it
+        entry = response_cache.put(cache_key, cache_ttl, response.status_code, headers, response.content,
+                                   generation)
+    response.content  # buffer the body so every waiting request can read it
+    return response, entry
+
+@app.route('/api/v1/<service>/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@jwt_required_with_args()
+def gateway(service, path):
+    cache_key = None
+    if request.method == 'GET':
+        route = response_cache.route_for(service, path)
+        if route:
+            cache_key = response_cache.key(route, service, path, request.query_string, request.headers,
+                                           get_jwt_identity())
+            entry = response_cache.get(cache_key)
+            if entry:
+                return cached_response(entry, 'HIT')
+            cache_ttl = route.ttl
+
+    try:
+        if cache_key:
+            (response, entry), _ = upstream_flight.do(
+                cache_key, lambda: fetch_cacheable(service, path, cache_key, cache_ttl))
+        else:
+            response, entry = send_upstream(service, path), None
+        if request.method in ('PUT', 'DELETE'):
+            response_cache.invalidate(service, path)
 
         publish_message({
             'service': service,
@@ -99,11 +275,19 @@ def gateway(service, path):
             'status_code': response.status_code
         })
 
+        if entry:
+            return cached_response(entry, 'MISS')
+
+        if not cache_key and should_stream(response):
+            return stream_response(response)
+
         return (
             response.content,
             response.status_code,
             response.headers.items()
         )
+    except ServiceNotFound:
+        return jsonify({"error": "Service not found"}), 404
     except requests.Timeout:
         logger.error(f"Request to {service} timed out")
         return jsonify({"error": "Service timeout"}), 504
@@ -128,6 +312,17 @@ def login():
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+if limiter:
+    limiter.exempt(metrics_endpoint)  # scraped every few seconds, so it would use up the default limits
+
+@app.route('/health/cache')
+def cache_health():
+    return jsonify({**response_cache.stats(), 'coalesced': upstream_flight.stats()['shared']}), 200
+
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""Asyncio/ASGI mode of the API gateway.
+
+Serves the same routes as the Flask gateway (/api/v1/<service>/<path>,
+/login, /health and /metrics) with the same JWT checks, circuit breaker
+semantics, default rate limits, stage metrics and trace propagation. Upstream calls go through one httpx.AsyncClient on an
+event loop, so a single process can hold thousands of proxied requests in
+flight instead of one per worker thread.
+
+Run with:
+
+    uvicorn microservices.api_gateway.asgi:app --port 5000
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import httpx
+from flask_jwt_extended import create_access_token, decode_token
+from jwt import ExpiredSignatureError
+from limits import parse_many
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from pybreaker import CircuitBreakerError
+
+from microservices.api_gateway import app as sync_gateway
+from microservices.common.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, TRACEPARENT, start_trace, current_trace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = "200 per day; 50 per hour"
+
+
+class AsyncCircuitBreaker:
+    """Event-loop counterpart of the gateway's pybreaker.CircuitBreaker.
+
+    Opens after ``fail_max`` consecutive failures and rejects calls with
+    CircuitBreakerError until ``reset_timeout`` seconds have passed. Then a
+    single trial call decides whether it closes again. Unlike pybreaker's
+    call(), which holds a lock for the duration of the wrapped call, state
+    is only touched between awaits, so calls through it run concurrently.
+    """
+
+    def __init__(self, fail_max=5, reset_timeout=30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def current_state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    async def call(self, func, *args, **kwargs):
+        state = self.current_state
+        if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+            raise CircuitBreakerError("Failures threshold reached, circuit breaker opened")
+        trial = state == 'half-open'
+        self._trial_in_flight = trial
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            self._failures += 1
+            if trial or self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+            raise
+        finally:
+            if trial:
+                self._trial_in_flight = False
+        self._failures = 0
+        self._opened_at = None
+        return result
+
+
+class AsyncGateway:
+    """ASGI application proxying /api/v1/<service>/<path> to discovered services."""
+
+    def __init__(self, flask_app, registry, publisher=None, limits=DEFAULT_LIMITS, breaker=None,
+                 timeout=5, max_connections=1000, max_keepalive_connections=100, keepalive_expiry=60,
+                 transport=None, metrics=None):
+        self.flask_app = flask_app
+        self.registry = registry
+        self.publisher = publisher
+        self.breaker = breaker or AsyncCircuitBreaker(fail_max=5, reset_timeout=30)
+        self.limits = parse_many(limits) if limits else []
+        self.metrics = metrics or Metrics('api_gateway')
+        # Same stages as the sync gateway, so either mode fills the same histograms
+        self._service_url = self.metrics.timed('get_service_url')(self._service_url)
+        self._make_request = self.metrics.timed('make_request')(self.breaker.call)
+        self._publish = self.metrics.timed('publish_message')(self._publish)
+        self.rate_limiter = FixedWindowRateLimiter(MemoryStorage())
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections,
+                                keepalive_expiry=keepalive_expiry),
+            transport=transport
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path']
+        method = scope['method']
+        start_trace(_headers(scope).get(TRACEPARENT))
+        if path == '/metrics':
+            # Not rate limited: scraped every few seconds, it would use up the default limits
+            body = self.metrics.render().encode()
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', METRICS_CONTENT_TYPE.encode()),
+                                    (b'content-length', str(len(body)).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        if path.startswith('/api/v1/') and path.count('/') >= 4:
+            endpoint = 'gateway'
+        elif path == '/login':
+            endpoint = 'login'
+        elif path == '/health':
+            endpoint = 'health_check'
+        else:
+            await self._json(send, 404, {"error": "Not Found"})
+            return
+
+        if not await self._within_limits(scope, endpoint, method):
+            await self._json(send, 429, {"error": "Too Many Requests"})
+            return
+
+        if endpoint == 'health_check':
+            await self._json(send, 200, {"status": "healthy"})
+        elif endpoint == 'login':
+            if method != 'POST':
+                await self._json(send, 405, {"error": "Method Not Allowed"})
+                return
+            await self._login(receive, send)
+        else:
+            if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+                await self._json(send, 405, {"error": "Method Not Allowed"})
+                return
+            auth_error = self._authenticate(_headers(scope))
+            if auth_error:
+                await self._json(send, *auth_error)
+                return
+            service, _, upstream_path = path[len('/api/v1/'):].partition('/')
+            await self._proxy(scope, receive, send, service, upstream_path)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _within_limits(self, scope, endpoint, method):
+        client = scope.get('client')
+        key = client[0] if client else '127.0.0.1'
+        for limit in sorted(self.limits):
+            if not await self.rate_limiter.hit(limit, key, f"{endpoint}:{method}"):
+                return False
+        return True
+
+    def _authenticate(self, headers):
+        # Mirrors flask_jwt_extended's responses for the Flask gateway's @jwt_required()
+        header = headers.get('authorization')
+        if not header:
+            return 401, {"msg": "Missing Authorization Header"}
+        scheme, _, token = header.partition(' ')
+        if scheme != 'Bearer' or not token:
+            return 422, {"msg": "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"}
+        try:
+            with self.flask_app.app_context():
+                claims = decode_token(token)
+        except ExpiredSignatureError:
+            return 401, {"msg": "Token has expired"}
+        except Exception as e:
+            return 422, {"msg": str(e)}
+        if claims.get('type') != 'access':
+            return 422, {"msg": "Only non-refresh tokens are allowed"}
+        return None
+
+    async def _login(self, receive, send):
+        try:
+            credentials = json.loads(await _read_body(receive) or b'{}')
+        except ValueError:
+            await self._json(send, 400, {"error": "Invalid JSON"})
+            return
+        if credentials.get('username') == 'admin' and credentials.get('password') == 'password':
+            with self.flask_app.app_context():
+                access_token = create_access_token(identity=credentials['username'])
+            await self._json(send, 200, {"access_token": access_token})
+        else:
+            await self._json(send, 401, {"error": "Bad username or password"})
+
+    async def _service_url(self, service):
+        if self.registry.is_resolved(service):
+            instance = self.registry.acquire(service)
+        else:
+            # The first lookup of a service may block on Consul, so keep it off the event loop
+            instance = await asyncio.to_thread(self.registry.acquire, service)
+        return instance.url if instance else None
+
+    async def _proxy(self, scope, receive, send, service, path):
+        service_url = await self._service_url(service)
+        if not service_url:
+            await self._json(send, 404, {"error": "Service not found"})
+            return
+
+        url = f"{service_url}/{path}"
+        if scope.get('query_string'):
+            url += '?' + scope['query_string'].decode('latin-1')
+        headers = [(key, value) for key, value in scope['headers']
+                   if key.decode('latin-1').lower() not in sync_gateway.HOP_BY_HOP_HEADERS | {'host', TRACEPARENT}]
+        headers.append((TRACEPARENT.encode(), current_trace().traceparent().encode()))
+        upstream_ok = True
+        response = None
+        try:
+            request = self.client.build_request(scope['method'], url, headers=headers,
+                                                content=await _request_content(scope, receive))
+            response = await self._make_request(self.client.send, request, stream=True)
+            upstream_ok = response.status_code not in sync_gateway.UPSTREAM_FAILURE_STATUSES
+        except httpx.TimeoutException:
+            upstream_ok = False
+            logger.error(f"Request to {service} timed out")
+            await self._json(send, 504, {"error": "Service timeout"})
+            return
+        except httpx.TransportError:
+            upstream_ok = False
+            logger.error(f"Connection error to {service}")
+            await self._json(send, 503, {"error": "Service unavailable"})
+            return
+        except Exception as e:
+            logger.error(f"Unexpected error in gateway: {str(e)}")
+            await self._json(send, 500, {"error": "Internal server error"})
+            return
+        finally:
+            self.registry.release(service_url, upstream_ok)
+
+        self._publish({
+            'service': service,
+            'path': path,
+            'method': scope['method'],
+            'status_code': response.status_code
+        })
+
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': [(key, value) for key, value in response.headers.raw
+                            if key.decode('latin-1').lower() not in sync_gateway.HOP_BY_HOP_HEADERS],
+            })
+            async for chunk in response.aiter_raw(sync_gateway.STREAM_CHUNK_SIZE):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            await response.aclose()
+
+    def _publish(self, message):
+        if self.publisher is None:
+            return
+        try:
+            self.publisher.publish(message)
+        except Exception as e:
+            logger.error(f"Error publishing message to RabbitMQ: {str(e)}")
+
+    async def _json(self, send, status, payload):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def _headers(scope):
+    return {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _request_content(scope, receive):
+    # Same choice as the sync gateway's upstream_request_body(): only large or chunked bodies are streamed
+    headers = _headers(scope)
+    length = headers.get('content-length')
+    if length is None:
+        if headers.get('transfer-encoding', '').lower() != 'chunked':
+            return await _read_body(receive)
+    elif int(length) <= sync_gateway.STREAM_THRESHOLD:
+        return await _read_body(receive)
+
+    async def stream():
+        while True:
+            message = await receive()
+            if message.get('body'):
+                yield message['body']
+            if not message.get('more_body'):
+                return
+
+    return stream()
+
+
+app = AsyncGateway(sync_gateway.app, sync_gateway.service_registry, publisher=sync_gateway.event_publisher)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5000)
@@ -0,0 +1,113 @@
+"""Direct dispatch to services mounted in the gateway's own process.
+
+app.py serves the gateway and the services from one process. For a
+service registered here, the gateway calls its WSGI app directly. This
+skips service discovery, the loopback connection and the HTTP
+serialization in both directions. The upstream app reads the request body
+from the client's own input stream, and its response iterable is handed
+back unchanged. LocalResponse exposes the small part of
+requests.Response that the gateway uses, so the gateway's caching,
+streaming and event publishing work the same either way.
+"""
+import contextvars
+import threading
+
+from werkzeug.datastructures import Headers
+
+WSGI_HEADER_KEYS = {'CONTENT_TYPE': 'Content-Type', 'CONTENT_LENGTH': 'Content-Length'}
+
+
+class LocalServices:
+    """WSGI apps of co-located services, by the name the gateway routes to."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._apps = {}
+
+    def mount(self, service, app):
+        with self._lock:
+            self._apps[service] = app
+
+    def unmount(self, service):
+        with self._lock:
+            self._apps.pop(service, None)
+
+    def get(self, service):
+        return self._apps.get(service)
+
+    def __contains__(self, service):
+        return service in self._apps
+
+
+def build_environ(environ, path, query_string, headers):
+    """A WSGI environ for ``path`` on a co-located app, reusing the incoming request's body stream.
+
+    ``headers`` replaces the incoming request headers, as it would on the
+    HTTP hop.
+    """
+    local = {key: value for key, value in environ.items()
+             if not key.startswith('HTTP_') and key not in WSGI_HEADER_KEYS}
+    local['SCRIPT_NAME'] = ''
+    local['PATH_INFO'] = '/' + path
+    local['QUERY_STRING'] = query_string.decode('latin-1')
+    for key, value in headers.items():
+        name = key.upper().replace('-', '_')
+        local[name if name in WSGI_HEADER_KEYS else 'HTTP_' + name] = value
+    return local
+
+
+def call_wsgi(app, environ):
+    """Run ``app`` on ``environ``, returning a LocalResponse.
+
+    The app runs in a copy of the current context. Per-request context
+    variables, such as the trace and any active profile, then stay
+    separate for the gateway and the service, as they would in two
+    processes.
+    """
+    captured = []
+
+    def start_response(status, headers, exc_info=None):
+        captured[:] = [status, headers]
+        return lambda data: captured.append(data)
+
+    context = contextvars.copy_context()
+    body = context.run(app, environ, start_response)
+    written = captured[2:]
+    if written:
+        # A write() callable app; rare, but cheap to support
+        body = written + list(body)
+    return LocalResponse(int(captured[0].split(None, 1)[0]), Headers(captured[1]), body)
+
+
+class LocalResponse:
+    """The response of a co-located app, as much of requests.Response as the gateway needs."""
+
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self._body = body
+        self._content = None
+        self.raw = self
+
+    @property
+    def content(self):
+        if self._content is None:
+            try:
+                chunks = list(self._body)
+            finally:
+                self.close()
+            self._content = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        return self._content
+
+    def stream(self, amt=None, decode_content=False):
+        # Chunks are passed on as the app produced them; ``amt`` is only a hint on the HTTP path
+        try:
+            yield from self._body
+        finally:
+            self.close()
+
+    def close(self):
+        close = getattr(self._body, 'close', None)
+        if close is not None:
+            self._body = ()
+            close()
@@ -0,0 +1,215 @@
+"""In-process service discovery cache fed by Consul blocking queries."""
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+
+class Instance:
+    __slots__ = ('address', 'port', 'url', 'outstanding', 'failures', 'ejected_until')
+
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.url = f"http://{address}:{port}"
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+
+class _Service:
+    def __init__(self, name):
+        self.name = name
+        self.instances = []
+        self.index = None
+        self.counter = itertools.count()
+        self.watcher = None
+        self.expires_at = None
+
+
+class ServiceRegistry:
+    """Serves service lookups from memory and balances load across instances.
+
+    The first lookup of a service queries Consul directly. After that, a
+    background thread keeps the instance list current with index-based
+    blocking queries, so lookups never wait on Consul. Instances that fail
+    ``eject_after`` times in a row are skipped for ``eject_for`` seconds. If
+    every instance is ejected, they are all used again rather than failing.
+    Services with no healthy instances are re-queried after ``negative_ttl``
+    seconds instead of being watched.
+    """
+
+    def __init__(self, consul_client, strategy=ROUND_ROBIN, wait='30s', eject_after=3, eject_for=30,
+                 negative_ttl=5, retry_interval=1):
+        if strategy not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+        self.consul_client = consul_client
+        self.strategy = strategy
+        self.wait = wait
+        self.eject_after = eject_after
+        self.eject_for = eject_for
+        self.negative_ttl = negative_ttl
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._services = {}
+        self._by_url = {}
+
+    def _query(self, name, index=None):
+        return self.consul_client.health.service(name, passing=True, index=index,
+                                                 wait=self.wait if index is not None else None)
+
+    def _update(self, service, nodes, index):
+        with self._lock:
+            existing = {(instance.address, instance.port): instance for instance in service.instances}
+            instances = []
+            for node in nodes:
+                key = (node['Service']['Address'], node['Service']['Port'])
+                instances.append(existing.pop(key, None) or Instance(*key))
+            for instance in existing.values():
+                self._by_url.pop(instance.url, None)
+            for instance in instances:
+                self._by_url[instance.url] = instance
+            service.instances = instances
+            service.index = index
+
+    def _cached(self, name):
+        service = self._services.get(name)
+        if service is not None and (service.expires_at is None or service.expires_at > time.monotonic()):
+            return service
+        return None
+
+    def is_resolved(self, name):
+        """Whether acquire() can answer from memory without querying Consul."""
+        with self._lock:
+            return self._cached(name) is not None
+
+    def _resolve(self, name):
+        with self._lock:
+            service = self._cached(name)
+            if service is not None:
+                return service
+        index, nodes = self._query(name)
+        with self._lock:
+            service = self._services.setdefault(name, _Service(name))
+        self._update(service, nodes or [], index)
+        with self._lock:
+            if service.instances:
+                service.expires_at = None
+                if service.watcher is None:
+                    service.watcher = threading.Thread(target=self._watch, args=(service,),
+                                                       name=f"consul-watch-{name}", daemon=True)
+                    service.watcher.start()
+            else:
+                service.expires_at = time.monotonic() + self.negative_ttl
+        return service
+
+    def _watch(self, service):
+        delay = self.retry_interval
+        while True:
+            try:
+                index, nodes = self._query(service.name, service.index)
+                if service.index is not None and index is not None and int(index) < int(service.index):
+                    # Consul's index went backwards (e.g. a restart); start the watch over
+                    index = None
+                self._update(service, nodes or [], index)
+                delay = self.retry_interval
+            except Exception as e:
+                # Keep serving the last known instances while Consul is unreachable
+                logger.warning(f"Consul watch for {service.name} failed: {e}")
+                time.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 30)
+
+    def acquire(self, name):
+        """Pick an instance for one request; pair every call with release()."""
+        service = self._resolve(name)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [instance for instance in service.instances if instance.available(now)]
+            candidates = candidates or service.instances
+            if not candidates:
+                return None
+            if self.strategy == LEAST_OUTSTANDING:
+                start = next(service.counter) % len(candidates)
+                rotated = candidates[start:] + candidates[:start]
+                instance = min(rotated, key=lambda candidate: candidate.outstanding)
+            else:
+                instance = candidates[next(service.counter) % len(candidates)]
+            instance.outstanding += 1
+            return instance
+
+    def release(self, url, ok=True):
+        with self._lock:
+            instance = self._by_url.get(url)
+            if instance is None:
+                return
+            instance.outstanding = max(0, instance.outstanding - 1)
+            if ok:
+                instance.failures = 0
+                return
+            instance.failures += 1
+            if instance.failures >= self.eject_after:
+                instance.ejected_until = time.monotonic() + self.eject_for
+                instance.failures = 0
+                logger.warning(f"Ejecting {instance.url} for {self.eject_for}s after repeated failures")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: [{
+                    'url': instance.url,
+                    'outstanding': instance.outstanding,
+                    'ejected': not instance.available(now)
+                } for instance in service.instances]
+                for name, service in self._services.items()
+            }
+
+
+class LocalConsul:
+    """Stand-in for consul.Consul that answers health.service() from memory.
+
+    Supports blocking queries, so a ServiceRegistry can be exercised in tests
+    and benchmarks without a Consul agent.
+    """
+
+    def __init__(self, services=None):
+        self._cond = threading.Condition()
+        self._index = 1
+        self._services = {}
+        self.health = self
+        for name, instances in (services or {}).items():
+            self.set_instances(name, instances)
+
+    def set_instances(self, name, instances):
+        with self._cond:
+            self._index += 1
+            self._services[name] = [{'Service': {'Address': address, 'Port': port}} for address, port in instances]
+            self._cond.notify_all()
+
+    def service(self, service, index=None, wait=None, passing=None, **kwargs):
+        timeout = _parse_wait(wait)
+        with self._cond:
+            if index is not None:
+                self._cond.wait_for(lambda: self._index > int(index), timeout=timeout)
+            return str(self._index), list(self._services.get(service, []))
+
+
+def _parse_wait(wait):
+    if wait is None:
+        return None
+    if wait.endswith('ms'):
+        return float(wait[:-2]) / 1000
+    if wait.endswith('s'):
+        return float(wait[:-1])
+    if wait.endswith('m'):
+        return float(wait[:-1]) * 60
+    return float(wait)
@@ -0,0 +1,200 @@
+"""In-memory cache of upstream GET responses with ETag validation."""
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+Route = namedtuple('Route', ['service', 'pattern', 'ttl', 'per_caller'])
+GENERATION_SLOTS = 4096  # invalidation counters, shared by the resources that hash to the same slot
+
+
+class CachedResponse:
+    __slots__ = ('status', 'headers', 'body', 'etag', 'expires_at', 'size', 'resource')
+
+    def __init__(self, status, headers, body, etag, expires_at, resource):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.size = len(body) + sum(len(key) + len(value) for key, value in headers)
+        self.resource = resource
+
+
+class ResponseCache:
+    """Size-bounded LRU of upstream GET responses for opted-in routes.
+
+    ``routes`` lists ``(service, path regex, ttl seconds, per_caller)``. The
+    first route whose regex fully matches a service and path decides its TTL.
+    Routes with ``per_caller`` set also key on the caller's JWT identity.
+    Entries are keyed on service, path, query string and ``vary_headers``.
+    ``bytes_saved`` counts upstream bytes served from the cache instead, and
+    ``bytes_not_sent`` counts bodies replaced by a 304 to the client.
+    The least recently used entries are evicted once the stored bytes
+    exceed ``max_bytes``. Responses larger than ``max_entry_bytes`` are
+    never stored.
+
+    ``dependents`` lists ``(service, path regex, paths)``: invalidating a
+    matching path also invalidates those paths, for listings that embed
+    the resource. Each invalidation bumps a generation counter, so a
+    response fetched before it is not stored after it.
+    """
+
+    def __init__(self, routes, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+                 vary_headers=('Accept',), dependents=()):
+        self.routes = [Route(service, re.compile(pattern), ttl, per_caller)
+                       for service, pattern, ttl, per_caller in routes]
+        self.dependents = [(service, re.compile(pattern), tuple(paths)) for service, pattern, paths in dependents]
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.vary_headers = vary_headers
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_resource = {}
+        self._bytes = 0
+        self._generations = [0] * GENERATION_SLOTS
+
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._bytes_saved = 0
+        self._bytes_not_sent = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def route_for(self, service, path):
+        for route in self.routes:
+            if route.service == service and route.pattern.fullmatch(path):
+                return route
+        return None
+
+    def key(self, route, service, path, query_string, headers, identity=None):
+        varies = tuple(headers.get(name, '') for name in self.vary_headers)
+        return (service, path, query_string, varies, identity if route.per_caller else None)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._bytes_saved += len(entry.body)
+            return entry
+
+    def generation(self, service, path):
+        """Invalidation generation of a resource; read it before fetching a response to ``put``."""
+        with self._lock:
+            return self._generation(service, path)
+
+    def _generation(self, service, path):
+        # Invalidating a path also covers the paths nested under it, so count its ancestors' bumps too
+        parts = path.split('/')
+        return sum(self._generations[_slot(service, '/'.join(parts[:i]))] for i in range(1, len(parts) + 1))
+
+    def put(self, key, ttl, status, headers, body, generation=None):
+        """Store a response and return it with its ETag.
+
+        Returns None if it is too large to cache, or if the resource was
+        invalidated since ``generation`` was read.
+        """
+        etag = next((value for name, value in headers if name.lower() == 'etag'), None)
+        if etag is None:
+            etag = make_etag(body)
+            headers = headers + [('ETag', etag)]
+        entry = CachedResponse(status, headers, body, etag, time.monotonic() + ttl, key[:2])
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry.size > self.max_entry_bytes:
+                return None
+            if generation is not None and self._generation(*entry.resource) != generation:
+                return None
+            self._entries[key] = entry
+            self._by_resource.setdefault(entry.resource, set()).add(key)
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        keys = self._by_resource[entry.resource]
+        keys.discard(key)
+        if not keys:
+            del self._by_resource[entry.resource]
+
+    def invalidate(self, service, path):
+        """Drop cached responses for a resource, the resources nested under it and its dependents."""
+        paths = [path.rstrip('/')]
+        for dependent_service, pattern, dependent_paths in self.dependents:
+            if dependent_service == service and pattern.fullmatch(path):
+                paths.extend(dependent_paths)
+        with self._lock:
+            keys = set()
+            for path in paths:
+                self._generations[_slot(service, path)] += 1
+                prefix = path + '/'
+                keys.update(key for resource, resource_keys in self._by_resource.items()
+                            if resource[0] == service and (resource[1] == path or resource[1].startswith(prefix))
+                            for key in resource_keys)
+            for key in keys:
+                self._remove(key)
+            self._invalidations += len(keys)
+        return len(keys)
+
+    def not_modified(self, entry, if_none_match):
+        """Whether a request's If-None-Match already names this entry's ETag."""
+        if not if_none_match or not etag_matches(entry.etag, if_none_match):
+            return False
+        with self._lock:
+            self._not_modified += 1
+            self._bytes_not_sent += len(entry.body)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_resource.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+                'not_modified': self._not_modified,
+                'bytes_saved': self._bytes_saved,
+                'bytes_not_sent': self._bytes_not_sent,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+
+def _slot(service, path):
+    return zlib.crc32(f"{service}/{path}".encode()) % GENERATION_SLOTS
+
+
+def make_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(etag, if_none_match):
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    if if_none_match.strip() == '*':
+        return True
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag.removeprefix('W/') in candidates
@@ -1,12 +1,21 @@
 import pytest
-from app import app, limiter
+from app import app, limiter, response_cache, upstream_flight, local_services
 from flask_jwt_extended import create_access_token
 from unittest.mock import patch
 import requests
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import time
-from flask import current_app
+import threading
+import asyncio
+import json
+import httpx
+from pybreaker import CircuitBreakerError
+from flask import Flask, current_app, jsonify, request
+from microservices.api_gateway.upstream import UpstreamSessions
+from microservices.api_gateway.discovery import ServiceRegistry, LocalConsul
+from microservices.api_gateway.response_cache import ResponseCache
+from microservices.common.metrics import Metrics, Registry
 
 
 @pytest.fixture
@@ -157,3 +166,431 @@ def test_unauthorized_access(client, mock_consul):
     assert "Missing Authorization Header" in response.json["msg"]
 
 
+
+
+@pytest.fixture
+def auth_headers():
+    with app.app_context():
+        limiter.reset()
+        access_token = create_access_token(identity="test")
+    return {"Authorization": f"Bearer {access_token}"}
+
+def test_gateway_streams_large_upstream_response(client, mock_consul, mock_requests, auth_headers, monkeypatch):
+    monkeypatch.setattr('app.STREAM_THRESHOLD', 4)
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.headers = {'Content-Length': '10', 'Content-Type': 'application/octet-stream',
+                                          'Connection': 'keep-alive'}
+    mock_requests.return_value.raw.stream.return_value = iter([b'01234', b'56789'])
+
+    response = client.get('/api/v1/post-service/export', headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.get_data() == b'0123456789'
+    assert 'Connection' not in response.headers
+    mock_requests.return_value.close.assert_called_once()
+
+def test_gateway_streams_large_request_body(client, mock_consul, mock_requests, auth_headers, monkeypatch):
+    monkeypatch.setattr('app.STREAM_THRESHOLD', 4)
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 201
+    mock_requests.return_value.content = b'{}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    response = client.post('/api/v1/post-service/post/batch', headers=auth_headers, data=b'x' * 10)
+
+    assert response.status_code == 201
+    body = mock_requests.call_args.kwargs['data']
+    assert len(body) == 10
+    assert body.read() == b'x' * 10
+    assert mock_requests.call_args.kwargs['stream'] is True
+
+def test_upstream_sessions_are_reused_per_host_and_evicted_when_idle():
+    sessions = UpstreamSessions(idle_timeout=0.05)
+    first = sessions.session_for("http://user-service:5001/api/v1/user/1")
+
+    assert sessions.session_for("http://user-service:5001/api/v1/user/2") is first
+    assert sessions.session_for("http://post-service:5002/post/1") is not first
+
+    time.sleep(0.06)
+    assert sessions.evict_idle() == 2
+    assert sessions.session_for("http://user-service:5001/api/v1/user/1") is not first
+
+def test_service_registry_round_robins_across_instances():
+    consul = LocalConsul({"user-service": [("10.0.0.1", 5001), ("10.0.0.2", 5001)]})
+    registry = ServiceRegistry(consul)
+
+    urls = []
+    for _ in range(4):
+        instance = registry.acquire("user-service")
+        urls.append(instance.url)
+        registry.release(instance.url)
+
+    assert urls == ["http://10.0.0.1:5001", "http://10.0.0.2:5001"] * 2
+
+def test_service_registry_prefers_least_outstanding_instance():
+    consul = LocalConsul({"user-service": [("10.0.0.1", 5001), ("10.0.0.2", 5001)]})
+    registry = ServiceRegistry(consul, strategy='least_outstanding')
+
+    busy = registry.acquire("user-service")
+    for _ in range(3):
+        instance = registry.acquire("user-service")
+        assert instance.url != busy.url
+        registry.release(instance.url)
+
+def test_service_registry_ejects_failing_instance():
+    consul = LocalConsul({"user-service": [("10.0.0.1", 5001), ("10.0.0.2", 5001)]})
+    registry = ServiceRegistry(consul, eject_after=2)
+
+    for _ in range(4):
+        instance = registry.acquire("user-service")
+        registry.release(instance.url, ok=instance.address != "10.0.0.1")
+
+    assert {registry.acquire("user-service").url for _ in range(4)} == {"http://10.0.0.2:5001"}
+
+def test_service_registry_follows_consul_changes_without_querying_per_lookup():
+    consul = LocalConsul({"post-service": [("10.0.0.1", 5002)]})
+    registry = ServiceRegistry(consul, wait='1s')
+    assert registry.acquire("post-service").url == "http://10.0.0.1:5002"
+
+    consul.set_instances("post-service", [("10.0.0.9", 5002)])
+    deadline = time.monotonic() + 2
+    while registry.acquire("post-service").url != "http://10.0.0.9:5002":
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_service_registry_unknown_service_returns_none():
+    registry = ServiceRegistry(LocalConsul())
+    assert registry.acquire("nonexistent_service") is None
+
+def test_gateway_forwards_query_string(client, mock_consul, mock_requests, auth_headers):
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"posts": []}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    client.get('/api/v1/post-service/feed/1?limit=5&cursor=abc', headers=auth_headers)
+
+    assert mock_requests.call_args.kwargs['url'] == "http://post-service:5002/feed/1?limit=5&cursor=abc"
+
+
+@pytest.fixture
+def empty_cache():
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+def test_gateway_caches_get_and_answers_if_none_match(client, mock_consul, mock_requests, auth_headers, empty_cache):
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"id": 1, "content": "hello"}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    first = client.get('/api/v1/post-service/post/1', headers=auth_headers)
+    second = client.get('/api/v1/post-service/post/1', headers=auth_headers)
+    revalidated = client.get('/api/v1/post-service/post/1',
+                             headers={**auth_headers, 'If-None-Match': first.headers['ETag']})
+
+    assert mock_requests.call_count == 1
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.json == {"id": 1, "content": "hello"}
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+
+    stats = client.get('/health/cache').json
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['not_modified'] == 1
+    assert stats['bytes_saved'] == 2 * len(b'{"id": 1, "content": "hello"}')
+
+def test_gateway_invalidates_cached_resource_on_put(client, mock_consul, mock_requests, auth_headers, empty_cache):
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"id": 1}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    client.get('/api/v1/post-service/post/1', headers=auth_headers)
+    client.get('/api/v1/post-service/post/1/comments', headers=auth_headers)
+    client.get('/api/v1/post-service/post/2', headers=auth_headers)
+    client.get('/api/v1/post-service/post/user/7', headers=auth_headers)
+    client.put('/api/v1/post-service/post/1', headers=auth_headers, json={"content": "edited"})
+    client.get('/api/v1/post-service/post/1', headers=auth_headers)
+    client.get('/api/v1/post-service/post/2', headers=auth_headers)
+    client.get('/api/v1/post-service/post/user/7', headers=auth_headers)
+
+    assert mock_requests.call_count == 7
+    assert response_cache.stats()['invalidations'] == 3
+
+def test_gateway_does_not_cache_unlisted_routes_or_no_store(client, mock_consul, mock_requests, auth_headers,
+                                                            empty_cache):
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"posts": []}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    client.get('/api/v1/post-service/feed/1', headers=auth_headers)
+    client.get('/api/v1/post-service/feed/1', headers=auth_headers)
+    mock_requests.return_value.headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-store'}
+    client.get('/api/v1/post-service/post/1', headers=auth_headers)
+    client.get('/api/v1/post-service/post/1', headers=auth_headers)
+
+    assert mock_requests.call_count == 4
+    assert response_cache.stats()['entries'] == 0
+
+def test_gateway_coalesces_concurrent_identical_misses(mock_consul, mock_requests, auth_headers, empty_cache):
+    mock_consul.return_value = "http://post-service:5002"
+    followers = upstream_flight.stats()['shared'] + 3
+
+    def slow_upstream(**kwargs):
+        # Hold the leader's request until the other three have joined it
+        deadline = time.monotonic() + 2
+        while upstream_flight.stats()['shared'] < followers and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return mock_requests.return_value
+
+    mock_requests.side_effect = slow_upstream
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"id": 1}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+
+    results = []
+
+    def fetch():
+        with app.test_client() as client:
+            response = client.get('/api/v1/post-service/post/1', headers=auth_headers)
+            results.append((response.status_code, response.get_data()))
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mock_requests.call_count == 1
+    assert results == [(200, b'{"id": 1}')] * 4
+
+def test_response_cache_evicts_least_recently_used_by_bytes():
+    cache = ResponseCache([('post-service', r'post/\d+', 60, True)], max_bytes=300, max_entry_bytes=200)
+    route = cache.route_for('post-service', 'post/1')
+    keys = [cache.key(route, 'post-service', f'post/{n}', b'', {}, identity='alice') for n in range(3)]
+
+    for key in keys[:2]:
+        assert cache.put(key, route.ttl, 200, [], b'x' * 100)
+    cache.get(keys[0])
+    cache.put(keys[2], route.ttl, 200, [], b'x' * 100)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] <= 300
+    assert cache.put(keys[0], route.ttl, 200, [], b'x' * 500) is None
+    assert cache.key(route, 'post-service', 'post/1', b'', {}, identity='bob') != keys[1]
+
+def test_response_cache_skips_responses_fetched_before_an_invalidation():
+    cache = ResponseCache([('post-service', r'post/.+', 60, False)],
+                          dependents=[('post-service', r'post/\d+', ['post/user'])])
+    route = cache.route_for('post-service', 'post/1')
+    paths = ['post/1', 'post/1/comments', 'post/user/7', 'post/2']
+    keys = {path: cache.key(route, 'post-service', path, b'', {}) for path in paths}
+    generations = {path: cache.generation('post-service', path) for path in paths}
+
+    cache.invalidate('post-service', 'post/1')
+    stored = {path: cache.put(keys[path], route.ttl, 200, [], b'{}', generations[path]) is not None
+              for path in paths}
+    assert stored == {'post/1': False, 'post/1/comments': False, 'post/user/7': False, 'post/2': True}
+    assert cache.put(keys['post/1'], route.ttl, 200, [], b'{}', cache.generation('post-service', 'post/1'))
+
+class UpstreamBody(httpx.AsyncByteStream):
+    # Unlike content=/json=, a stream leaves the response unread, as a real upstream's would be
+    def __init__(self, payload):
+        self.payload = json.dumps(payload).encode()
+
+    async def __aiter__(self):
+        yield self.payload
+
+def upstream_response(status_code, payload):
+    return httpx.Response(status_code, headers={'Content-Type': 'application/json'}, stream=UpstreamBody(payload))
+
+def make_async_gateway(handler, limits=None):
+    from asgi import AsyncGateway
+    consul = LocalConsul({"user-service": [("10.0.0.1", 5001)]})
+    return AsyncGateway(app, ServiceRegistry(consul), limits=limits, transport=httpx.MockTransport(handler))
+
+def call_async_gateway(gateway, method, url, **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway),
+                                     base_url="http://gateway") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(run())
+
+def test_async_gateway_proxies_to_discovered_service(auth_headers):
+    seen = []
+
+    def handler(request):
+        seen.append(str(request.url))
+        return upstream_response(200, {"id": 1, "username": "testuser"})
+
+    gateway = make_async_gateway(handler)
+    response = call_async_gateway(gateway, "GET", "/api/v1/user-service/api/v1/user/1?fields=id",
+                                  headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json() == {"id": 1, "username": "testuser"}
+    assert seen == ["http://10.0.0.1:5001/api/v1/user/1?fields=id"]
+
+def test_async_gateway_sends_bodiless_requests_without_chunking(auth_headers):
+    seen = []
+
+    def handler(request):
+        seen.append((request.method, request.headers.get('transfer-encoding'), request.content))
+        return upstream_response(200, {})
+
+    gateway = make_async_gateway(handler)
+    for method in ("GET", "DELETE"):
+        call_async_gateway(gateway, method, "/api/v1/user-service/api/v1/user/1", headers=auth_headers)
+
+    assert seen == [("GET", None, b''), ("DELETE", None, b'')]
+
+def test_async_gateway_requires_token():
+    gateway = make_async_gateway(lambda request: httpx.Response(200))
+    response = call_async_gateway(gateway, "GET", "/api/v1/user-service/api/v1/user/1")
+
+    assert response.status_code == 401
+    assert "Missing Authorization Header" in response.json()["msg"]
+
+def test_async_gateway_login_issues_usable_token():
+    gateway = make_async_gateway(lambda request: upstream_response(200, {}))
+    login = call_async_gateway(gateway, "POST", "/login", json={"username": "admin", "password": "password"})
+    assert login.status_code == 200
+
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    assert call_async_gateway(gateway, "GET", "/api/v1/user-service/health", headers=headers).status_code == 200
+    assert call_async_gateway(gateway, "POST", "/login",
+                              json={"username": "wrong", "password": "wrong"}).status_code == 401
+
+def test_async_gateway_maps_upstream_errors(auth_headers):
+    def timeout(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    def refused(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    response = call_async_gateway(make_async_gateway(timeout), "GET", "/api/v1/user-service/x", headers=auth_headers)
+    assert response.status_code == 504
+    assert response.json() == {"error": "Service timeout"}
+
+    response = call_async_gateway(make_async_gateway(refused), "GET", "/api/v1/user-service/x", headers=auth_headers)
+    assert response.status_code == 503
+    assert response.json() == {"error": "Service unavailable"}
+
+    response = call_async_gateway(make_async_gateway(refused), "GET", "/api/v1/nonexistent_service/x",
+                                  headers=auth_headers)
+    assert response.status_code == 404
+
+def test_async_gateway_rate_limits():
+    gateway = make_async_gateway(lambda request: httpx.Response(200), limits="2 per hour")
+    statuses = [call_async_gateway(gateway, "GET", "/health").status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+
+def test_async_circuit_breaker_opens_after_repeated_failures():
+    from asgi import AsyncCircuitBreaker
+    breaker = AsyncCircuitBreaker(fail_max=2, reset_timeout=30)
+
+    async def fail():
+        raise httpx.ConnectError("refused")
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await breaker.call(fail)
+        with pytest.raises(CircuitBreakerError):
+            await breaker.call(fail)
+
+    asyncio.run(run())
+    assert breaker.current_state == 'open'
+
+def test_gateway_continues_trace_to_upstream_and_serves_metrics(client, mock_consul, mock_requests, auth_headers):
+    mock_consul.return_value = "http://post-service:5002"
+    mock_requests.return_value.status_code = 200
+    mock_requests.return_value.content = b'{"posts": []}'
+    mock_requests.return_value.headers = {'Content-Type': 'application/json'}
+    incoming = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+    client.get('/api/v1/post-service/feed/1', headers={**auth_headers, 'traceparent': incoming})
+
+    forwarded = mock_requests.call_args.kwargs['headers']
+    assert [key for key in forwarded if key.lower() == 'traceparent'] == ['traceparent']
+    version, trace_id, parent_id, flags = forwarded['traceparent'].split('-')
+    assert (version, trace_id, flags) == ('00', '4bf92f3577b34da6a3ce929d0e0e4736', '01')
+    assert parent_id != '00f067aa0ba902b7'
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    assert 'stage_duration_seconds_count{service="api_gateway",stage="publish_message"}' in response.get_data(as_text=True)
+
+
+@pytest.fixture
+def colocated_service():
+    service = Flask('colocated')
+    seen = []
+
+    @service.route('/feed/<int:user_id>', methods=['GET', 'POST'])
+    def feed(user_id):
+        seen.append({'path': request.full_path, 'body': request.get_data(),
+                     'traceparent': request.headers.get('traceparent'),
+                     'authorization': request.headers.get('Authorization')})
+        return jsonify({'user_id': user_id}), 201, {'X-Service': 'colocated'}
+
+    local_services.mount('post-service', service)
+    yield seen
+    local_services.unmount('post-service')
+
+def test_gateway_dispatches_to_colocated_service_in_process(client, mock_consul, mock_requests, auth_headers,
+                                                           colocated_service):
+    incoming = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    response = client.post('/api/v1/post-service/feed/7?limit=5', data=b'{"x": 1}',
+                           headers={**auth_headers, 'traceparent': incoming, 'Content-Type': 'application/json'})
+
+    assert response.status_code == 201
+    assert response.json == {'user_id': 7}
+    assert response.headers['X-Service'] == 'colocated'
+    assert not mock_consul.called and not mock_requests.called
+    [seen] = colocated_service
+    assert seen['path'] == '/feed/7?limit=5'
+    assert seen['body'] == b'{"x": 1}'
+    assert seen['authorization'] == auth_headers['Authorization']
+    assert seen['traceparent'].split('-')[1] == '4bf92f3577b34da6a3ce929d0e0e4736'
+
+def test_colocated_dispatch_still_requires_a_token(client, colocated_service):
+    response = client.get('/api/v1/post-service/feed/7')
+
+    assert response.status_code == 401
+    assert colocated_service == []
+
+def test_async_gateway_continues_trace_and_serves_metrics(auth_headers):
+    from asgi import AsyncGateway
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get_list('traceparent'))
+        return upstream_response(200, {})
+
+    gateway = AsyncGateway(app, ServiceRegistry(LocalConsul({"user-service": [("10.0.0.1", 5001)]})), limits=None,
+                           transport=httpx.MockTransport(handler), metrics=Metrics('async_gateway', Registry()))
+    incoming = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    call_async_gateway(gateway, "GET", "/api/v1/user-service/health", headers={**auth_headers, 'traceparent': incoming})
+
+    [[forwarded]] = seen
+    version, trace_id, parent_id, flags = forwarded.split('-')
+    assert (version, trace_id, flags) == ('00', '4bf92f3577b34da6a3ce929d0e0e4736', '01')
+    assert parent_id != '00f067aa0ba902b7'
+
+    response = call_async_gateway(gateway, "GET", "/metrics")
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    for stage in ('get_service_url', 'make_request'):
+        assert f'stage_duration_seconds_count{{service="async_gateway",stage="{stage}"}} 1' in response.text
@@ -0,0 +1,88 @@
+"""Keep-alive HTTP sessions to upstream services, one pool per upstream host."""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamSessions:
+    """Hands out a pooled requests.Session per upstream scheme://host:port.
+
+    Each session keeps up to ``maxsize`` keep-alive connections to its host.
+    With ``block`` set, callers wait for a free connection instead of opening
+    one beyond that limit. Sessions unused for ``idle_timeout`` seconds are
+    closed so their sockets do not linger.
+    """
+
+    def __init__(self, maxsize=50, block=False, idle_timeout=60):
+        self.maxsize = maxsize
+        self.block = block
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._next_eviction = time.monotonic() + idle_timeout
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maxsize,
+                              pool_block=self.block, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, url):
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = self._sessions[key] = [self._new_session(), now]
+            entry[1] = now
+            idle = self._pop_idle(now) if now >= self._next_eviction else []
+        for session in idle:
+            session.close()
+        return entry[0]
+
+    def _pop_idle(self, now):
+        self._next_eviction = now + self.idle_timeout
+        idle_keys = [key for key, (_, last_used) in self._sessions.items()
+                     if now - last_used >= self.idle_timeout]
+        return [self._sessions.pop(key)[0] for key in idle_keys]
+
+    def evict_idle(self):
+        with self._lock:
+            idle = self._pop_idle(time.monotonic())
+        for session in idle:
+            session.close()
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            return {'upstreams': len(self._sessions)}
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session, _ in sessions.values():
+            session.close()
+
+
+class RequestBodyStream:
+    """File-like view of an incoming body of known length.
+
+    Exposing __len__ lets requests send it with its Content-Length while
+    reading it from the client in blocks instead of buffering it whole.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
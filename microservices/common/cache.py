@@ -0,0 +1,312 @@
+"""Two-tier cache: a per-process LRU in front of Redis, holding serialized payloads.
+
+Values are the bytes a handler would send, typically an encoded JSON
+response, so a hit in either tier is returned without decoding or
+re-encoding. Writes and deletes publish the key on a Redis channel, and
+every other process drops its local copy.
+
+Keys that must not go stale can be paired with a version counter in
+Redis. Writers bump it, and readers filling the cache after a miss only
+write if it has not moved since they started, so a slow read cannot put
+back content that a concurrent update replaced.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class TwoTierCache:
+    """Serves keys from process memory first, then Redis.
+
+    Local entries live for at most ``local_ttl`` seconds, and never past the
+    Redis expiry they were read with. Past ``local_max_entries`` entries or
+    ``local_max_bytes`` of payload, the least recently used are evicted.
+    Invalidations from other processes arrive on ``channel``. While that
+    subscription is down the local tier is bypassed, so a missed
+    invalidation cannot serve stale data.
+    """
+
+    def __init__(self, redis_client, channel, local_ttl=5, local_max_entries=10000,
+                 local_max_bytes=16 * 1024 * 1024, retry_interval=1):
+        self.redis = redis_client
+        self.channel = channel
+        self.local_ttl = local_ttl
+        self.local_max_entries = local_max_entries
+        self.local_max_bytes = local_max_bytes
+        self.retry_interval = retry_interval
+        self.instance_id = uuid.uuid4().hex
+
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._subscriber = None
+        self._subscribed = False
+
+        self._local_hits = 0
+        self._remote_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def _ensure_subscriber(self):
+        if self._subscriber is None:
+            with self._lock:
+                if self._subscriber is None:
+                    self._subscriber = threading.Thread(target=self._listen, name=f"cache-invalidate-{self.channel}",
+                                                        daemon=True)
+                    self._subscriber.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                with self._lock:
+                    # Anything published while we were not listening is lost, so start empty
+                    self._clear_local()
+                    self._subscribed = True
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._on_invalidation(message['data'])
+            except Exception as e:
+                logger.warning(f"Cache invalidation subscription to {self.channel} failed: {e}")
+            with self._lock:
+                self._subscribed = False
+                self._clear_local()
+            time.sleep(self.retry_interval)
+
+    def _on_invalidation(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        sender, _, key = data.partition(':')
+        if sender == self.instance_id:
+            return
+        with self._lock:
+            if self._local_pop(key):
+                self._invalidations += 1
+
+    def _local_get(self, key, now):
+        if not self._subscribed:
+            return None
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            self._local_pop(key)
+            return None
+        self._local.move_to_end(key)
+        return entry[0]
+
+    def _local_put(self, key, value, ttl, now):
+        if not self._subscribed:
+            return
+        lifetime = self.local_ttl if ttl is None else min(self.local_ttl, ttl)
+        if lifetime <= 0 or len(value) > self.local_max_bytes:
+            return
+        self._local_pop(key)
+        self._local[key] = (value, now + lifetime)
+        self._local_bytes += len(value)
+        while len(self._local) > self.local_max_entries or self._local_bytes > self.local_max_bytes:
+            _, (evicted, _) = self._local.popitem(last=False)
+            self._local_bytes -= len(evicted)
+            self._evictions += 1
+
+    def _local_pop(self, key):
+        entry = self._local.pop(key, None)
+        if entry is not None:
+            self._local_bytes -= len(entry[0])
+        return entry
+
+    def _clear_local(self):
+        self._local.clear()
+        self._local_bytes = 0
+
+    def get(self, key):
+        self._ensure_subscriber()
+        now = time.monotonic()
+        with self._lock:
+            value = self._local_get(key, now)
+            if value is not None:
+                self._local_hits += 1
+                return value
+
+        value = self.redis.get(key)
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._remote_hits += 1
+                self._local_put(key, value, None, now)
+        return value
+
+    def get_with_ttl(self, key):
+        """Return ``(value, seconds until the Redis copy expires)``.
+
+        The TTL is None for local hits and for keys without an expiry.
+        """
+        self._ensure_subscriber()
+        now = time.monotonic()
+        with self._lock:
+            value = self._local_get(key, now)
+            if value is not None:
+                self._local_hits += 1
+                return value, None
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        value, ttl_ms = pipe.execute()
+        ttl = ttl_ms / 1000 if ttl_ms is not None and ttl_ms >= 0 else None
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._remote_hits += 1
+                self._local_put(key, value, ttl, now)
+        return value, ttl
+
+    def get_many(self, keys):
+        """Return values for ``keys`` in order, with None for misses, using one MGET for the remote tier."""
+        self._ensure_subscriber()
+        now = time.monotonic()
+        values = [None] * len(keys)
+        remote = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                values[i] = self._local_get(key, now)
+                if values[i] is None:
+                    remote.append(i)
+            self._local_hits += len(keys) - len(remote)
+
+        if remote:
+            fetched = self.redis.mget([keys[i] for i in remote])
+            with self._lock:
+                for i, value in zip(remote, fetched):
+                    values[i] = value
+                    if value is None:
+                        self._misses += 1
+                    else:
+                        self._remote_hits += 1
+                        # The remote TTL is unknown here; the local TTL still bounds staleness
+                        self._local_put(keys[i], value, None, now)
+        return values
+
+    def set(self, key, value, ttl):
+        self.set_many([(key, value, ttl)])
+
+    def set_many(self, items):
+        """Write ``(key, value, ttl)`` items to Redis in one round trip and tell other processes."""
+        if not items:
+            return
+        self._ensure_subscriber()
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value, ttl in items:
+            pipe.setex(key, ttl, value)
+            pipe.publish(self.channel, f"{self.instance_id}:{key}")
+        pipe.execute()
+        now = time.monotonic()
+        with self._lock:
+            for key, value, ttl in items:
+                self._local_put(key, value if isinstance(value, bytes) else value.encode(), ttl, now)
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(*keys)
+        for key in keys:
+            pipe.publish(self.channel, f"{self.instance_id}:{key}")
+        pipe.execute()
+        with self._lock:
+            for key in keys:
+                self._local_pop(key)
+
+    def version(self, version_key):
+        """Current value of a version counter; read it before loading the source of a cache fill."""
+        value = self.redis.get(version_key)
+        return int(value) if value is not None else 0
+
+    def bump_version(self, version_key, version_ttl, evict=()):
+        """Increment a version counter, dropping ``evict`` keys in the same transaction; returns the new version.
+
+        Writers call this before committing, while they hold the row lock, so
+        versions follow commit order and in-flight fills are rejected.
+        """
+        pipe = self.redis.pipeline()
+        pipe.incr(version_key)
+        pipe.expire(version_key, version_ttl)
+        if evict:
+            pipe.delete(*evict)
+        for key in evict:
+            pipe.publish(self.channel, f"{self.instance_id}:{key}")
+        version = pipe.execute()[0]
+        with self._lock:
+            for key in evict:
+                self._local_pop(key)
+        return version
+
+    def set_if_version(self, key, value, ttl, version_key, version, bump=False, version_ttl=None):
+        """Write ``key`` only while ``version_key`` still equals ``version``; returns whether it was written.
+
+        With ``bump`` the version is incremented in the same transaction, so
+        readers that loaded the source before this write cannot overwrite it.
+        """
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(version_key)
+                current = pipe.get(version_key)
+                if (int(current) if current is not None else 0) != version:
+                    return False
+                pipe.multi()
+                pipe.setex(key, ttl, value)
+                if bump:
+                    pipe.incr(version_key)
+                    pipe.expire(version_key, version_ttl)
+                pipe.publish(self.channel, f"{self.instance_id}:{key}")
+                pipe.execute()
+            except redis.WatchError:
+                return False
+        with self._lock:
+            self._local_put(key, value if isinstance(value, bytes) else value.encode(), ttl, time.monotonic())
+        return True
+
+    def set_many_versioned(self, items, version_ttl):
+        """Write ``(key, value, ttl, version_key)`` items, bumping each version in one transaction."""
+        if not items:
+            return
+        pipe = self.redis.pipeline()
+        for key, value, ttl, version_key in items:
+            pipe.incr(version_key)
+            pipe.expire(version_key, version_ttl)
+            pipe.setex(key, ttl, value)
+            pipe.publish(self.channel, f"{self.instance_id}:{key}")
+        pipe.execute()
+        now = time.monotonic()
+        with self._lock:
+            for key, value, ttl, _ in items:
+                self._local_put(key, value if isinstance(value, bytes) else value.encode(), ttl, now)
+
+    def clear_local(self):
+        with self._lock:
+            self._clear_local()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._local_hits + self._remote_hits + self._misses
+            return {
+                'local_entries': len(self._local),
+                'local_bytes': self._local_bytes,
+                'local_hits': self._local_hits,
+                'remote_hits': self._remote_hits,
+                'misses': self._misses,
+                'hit_ratio': (self._local_hits + self._remote_hits) / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'subscribed': self._subscribed,
+            }
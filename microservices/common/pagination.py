@@ -0,0 +1,59 @@
+"""Opaque keyset cursors over (created_at, id) pairs, and over (rank, id) for ranked results."""
+import base64
+from datetime import datetime
+
+from flask import request
+
+# Pagination configuration
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at, item_id):
+    raw = f"{int(created_at)}:{int(item_id)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor, raising ValueError if it is malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created_at, item_id = base64.urlsafe_b64decode(padded).decode().split(':')
+        created_at, item_id = int(created_at), int(item_id)
+        datetime.fromtimestamp(created_at)  # keyset_condition() converts it; reject what it cannot
+        return created_at, item_id
+    except (ValueError, OverflowError, OSError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def encode_rank_cursor(as_of, rank, item_id):
+    """Cursor for ranked results: the time ranks were computed at, and the last (rank, id) returned."""
+    raw = f"{int(as_of)}:{int(rank)}:{int(item_id)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_rank_cursor(cursor):
+    """Return (as_of, rank, id) from a ranked cursor, raising ValueError if it is malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        as_of, rank, item_id = base64.urlsafe_b64decode(padded).decode().split(':')
+        return int(as_of), int(rank), int(item_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def get_page_args():
+    """Return (limit, decoded cursor or None) from the current request's query string."""
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def keyset_condition(before, created_at_column='created_at', id_column='id'):
+    """SQL condition and parameters selecting rows that sort after the ``before`` cursor position."""
+    # Expanded rather than a row comparison so MySQL can range-scan the (..., created_at, id) index
+    if before is None:
+        return "", ()
+    created_at = datetime.fromtimestamp(before[0])
+    return (f" AND ({created_at_column} < %s OR ({created_at_column} = %s AND {id_column} < %s))",
+            (created_at, created_at, before[1]))
@@ -0,0 +1,356 @@
+"""On-demand request profiling and slow-query capture.
+
+Two things select a request for profiling. One is an ``X-Profile-Token``
+header matching the app's PROFILING_TOKEN config; the gateway forwards
+the header, so the upstream service profiles its side of the same
+request too. The other is random sampling at PROFILING_SAMPLE_RATE.
+
+While a profiled request runs, a shared background thread samples its
+stack every few milliseconds. The samples are kept as folded stacks, the
+input format of flamegraph.pl and speedscope. Every SQL statement the
+request runs through an instrumented connection is recorded with its
+duration.
+
+Any statement slower than the slow-query threshold also gets its EXPLAIN
+plan, profiled or not. The plan is run on the same connection just before
+it goes back to the pool, once the request has read its results. A slow
+statement outside a profiled request is kept as an entry of its own.
+
+Profiles and slow queries go to a bounded ring buffer. Read it from
+/admin/profiles with the same token.
+"""
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+import contextvars
+
+from flask import Response, current_app, jsonify, request
+
+from microservices.common.metrics import current_trace
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile-Token'
+EXPLAINABLE = ('select', 'with', '(', 'update', 'delete', 'insert', 'replace')
+MAX_STACK_DEPTH = 128
+MAX_STATEMENTS = 1000  # per profile, so a runaway loop cannot fill memory
+
+_active_profile = contextvars.ContextVar('profile', default=None)
+_ids = itertools.count(1)
+
+
+class RequestProfile:
+    def __init__(self, service, method, path, reason):
+        trace = current_trace()
+        self.id = next(_ids)
+        self.service = service
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.trace_id = trace.trace_id if trace else None
+        self.started_at = time.time()
+        self.duration = None
+        self.status = None
+        self.stacks = Counter()
+        self.statements = []
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'kind': 'request',
+            'service': self.service,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'trace_id': self.trace_id,
+            'started_at': self.started_at,
+            'duration_ms': self.duration * 1000 if self.duration is not None else None,
+            'status': self.status,
+            'samples': sum(self.stacks.values()),
+            'statements': len(self.statements),
+        }
+
+    def to_dict(self):
+        return {**self.summary(), 'statements': self.statements}
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SlowQuery:
+    def __init__(self, service, record):
+        trace = current_trace()
+        self.id = next(_ids)
+        self.service = service
+        self.trace_id = trace.trace_id if trace else None
+        self.started_at = time.time()
+        self.record = record
+
+    def summary(self):
+        return {'id': self.id, 'kind': 'slow_query', 'service': self.service, 'trace_id': self.trace_id,
+                'started_at': self.started_at, 'duration_ms': self.record['duration_ms'],
+                'sql': self.record['sql']}
+
+    def to_dict(self):
+        return {**self.summary(), 'statement': self.record}
+
+
+class _Sampler:
+    """One thread sampling the stacks of every thread with an active profile."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._active = {}  # thread id -> profiles; a co-located service nests its profile in the gateway's
+        self._thread = None
+
+    def add(self, thread_id, profile):
+        with self._cond:
+            self._active.setdefault(thread_id, []).append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def remove(self, thread_id, profile):
+        with self._cond:
+            profiles = self._active.get(thread_id, [])
+            if profile in profiles:
+                profiles.remove(profile)
+            if not profiles:
+                self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._active)
+                active = [(thread_id, list(profiles)) for thread_id, profiles in self._active.items()]
+            frames = sys._current_frames()
+            for thread_id, profiles in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = _fold(frame)
+                    for profile in profiles:
+                        profile.stacks[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _fold(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler(interval=0.005):
+    """Return the process-wide sampler; ``interval`` only applies when it is created."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _Sampler(interval)
+        return _sampler
+
+
+class Profiler:
+    """Profiles selected requests of one Flask app and keeps the newest ``buffer_size`` results.
+
+    The app's config supplies PROFILING_TOKEN (header-triggered profiling
+    and the admin endpoints are off while it is unset) and
+    PROFILING_SAMPLE_RATE. Statements slower than
+    ``slow_query_threshold`` seconds are explained.
+    """
+
+    def __init__(self, service, slow_query_threshold=0.1, buffer_size=100, sample_interval=0.005):
+        self.service = service
+        self.slow_query_threshold = slow_query_threshold
+        self.sampler = get_sampler(sample_interval)
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=buffer_size)
+
+    def install(self, app):
+        """Hook the profiler into ``app`` and add its /admin/profiles endpoints."""
+        app.config.setdefault('PROFILING_TOKEN', None)
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0)
+        app.before_request(self._begin)
+        app.after_request(self._record_status)
+        app.teardown_request(self._end)
+        app.add_url_rule('/admin/profiles', 'list_profiles', self._list)
+        app.add_url_rule('/admin/profiles/<int:profile_id>', 'get_profile', self._get)
+        app.add_url_rule('/admin/profiles/<int:profile_id>/flamegraph', 'get_flamegraph', self._flamegraph)
+
+    def _authorized(self):
+        token = current_app.config['PROFILING_TOKEN']
+        given = request.headers.get(PROFILE_HEADER)
+        return bool(token) and given is not None and hmac.compare_digest(given.encode(), token.encode())
+
+    def _begin(self):
+        if request.path.startswith('/admin/profiles'):
+            return
+        if request.headers.get(PROFILE_HEADER) is not None and self._authorized():
+            reason = 'header'
+        elif random.random() < current_app.config['PROFILING_SAMPLE_RATE']:
+            reason = 'sampled'
+        else:
+            return
+        profile = RequestProfile(self.service, request.method, request.full_path.rstrip('?'), reason)
+        profile._started = time.perf_counter()
+        _active_profile.set(profile)
+        self.sampler.add(threading.get_ident(), profile)
+
+    def _record_status(self, response):
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.status = response.status_code
+        return response
+
+    def _end(self, exc):
+        profile = _active_profile.get()
+        if profile is None:
+            return
+        _active_profile.set(None)
+        self.sampler.remove(threading.get_ident(), profile)
+        profile.duration = time.perf_counter() - profile._started
+        self._keep(profile)
+
+    def _keep(self, entry):
+        with self._lock:
+            self._buffer.append(entry)
+
+    def entries(self):
+        with self._lock:
+            return list(self._buffer)
+
+    def _find(self, profile_id):
+        return next((entry for entry in self.entries() if entry.id == profile_id), None)
+
+    def _list(self):
+        if not self._authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        return jsonify({'profiles': [entry.summary() for entry in reversed(self.entries())]}), 200
+
+    def _get(self, profile_id):
+        if not self._authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        entry = self._find(profile_id)
+        if entry is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        return jsonify(entry.to_dict()), 200
+
+    def _flamegraph(self, profile_id):
+        if not self._authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        entry = self._find(profile_id)
+        if not isinstance(entry, RequestProfile):
+            return jsonify({'error': 'Profile not found'}), 404
+        return Response(entry.folded(), mimetype='text/plain')
+
+    def instrument_connection(self, connection):
+        """Wrap a MySQL connection so its statements are recorded and slow ones explained."""
+        if connection is None:
+            return None
+        return _ProfiledConnection(connection, self)
+
+    def _statement(self, connection, operation, params, elapsed, many):
+        profile = _active_profile.get()
+        slow = elapsed >= self.slow_query_threshold
+        if profile is None and not slow:
+            return
+        record = {'sql': operation, 'duration_ms': elapsed * 1000}
+        if many:
+            record['executemany'] = True
+        if profile is not None and len(profile.statements) < MAX_STATEMENTS:
+            profile.statements.append(record)
+        if slow:
+            explainable = not many and operation.lstrip().lower().startswith(EXPLAINABLE)
+            connection._slow.append((record, operation if explainable else None, params,
+                                     None if profile is not None else SlowQuery(self.service, record)))
+
+    def _explain(self, connection, slow):
+        for record, operation, params, entry in slow:
+            if operation is not None:
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute("EXPLAIN " + operation, params)
+                    columns = cursor.column_names
+                    record['explain'] = [{column: _plain(value) for column, value in zip(columns, row)}
+                                         for row in cursor.fetchall()]
+                    cursor.close()
+                except Exception as e:
+                    record['explain_error'] = str(e)
+            if entry is not None:
+                logger.warning(f"Slow query ({record['duration_ms']:.1f}ms) in {self.service}: {record['sql'][:200]}")
+                self._keep(entry)
+
+
+def _plain(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(errors='replace')
+    return str(value)
+
+
+class _ProfiledConnection:
+    def __init__(self, connection, profiler):
+        self._connection = connection
+        self._profiler = profiler
+        self._slow = []
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return _ProfiledCursor(self._connection.cursor(*args, **kwargs), self)
+
+    def close(self):
+        slow, self._slow = self._slow, []
+        if slow:
+            self._profiler._explain(self._connection, slow)
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _ProfiledCursor:
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._connection._profiler._statement(self._connection, operation, params,
+                                                  time.perf_counter() - started, False)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._connection._profiler._statement(self._connection, operation, seq_params,
+                                                  time.perf_counter() - started, True)
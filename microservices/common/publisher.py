@@ -0,0 +1,262 @@
+"""Non-blocking RabbitMQ event publisher shared by the services.
+
+publish() only appends to a bounded in-memory buffer. A background thread
+drains it in batches over one long-lived connection with publisher confirms
+enabled, reconnecting with backoff when the broker goes away. Between
+batches it services the idle connection, so heartbeats keep flowing.
+Request latency no longer depends on broker latency.
+"""
+import atexit
+import json
+import logging
+import threading
+from collections import deque
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class EventPublisher:
+    """Buffers messages and publishes them to a durable queue from a background thread.
+
+    When the buffer is full, ``overflow`` decides what happens. DROP_NEWEST
+    rejects the new message and DROP_OLDEST evicts the oldest buffered one.
+    BLOCK waits up to ``block_timeout`` seconds for space before dropping.
+    Messages the broker did not confirm go back to the front of the buffer
+    and are retried after reconnecting.
+    """
+
+    def __init__(self, host, queue, buffer_size=10000, batch_size=100, flush_interval=0.05,
+                 overflow=DROP_NEWEST, block_timeout=0.1, max_backoff=30, connection_factory=None):
+        if overflow not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.host = host
+        self.queue = queue
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.max_backoff = max_backoff
+        self._connection_factory = connection_factory or (
+            lambda: pika.BlockingConnection(pika.ConnectionParameters(host=host)))
+
+        self._cond = threading.Condition()
+        self._buffer = deque()
+        self._thread = None
+        self._closing = False
+        self._flush_requested = False
+        self._in_flight = 0
+        self._connection = None
+        self._channel = None
+
+        self._published = 0
+        self._dropped = 0
+        self._failures = 0
+
+    def publish(self, message):
+        """Queue a message for publishing; returns False if it was dropped."""
+        body = json.dumps(message)
+        with self._cond:
+            if self._thread is None:
+                self._start()
+            if len(self._buffer) >= self.buffer_size:
+                if self.overflow == DROP_OLDEST:
+                    self._buffer.popleft()
+                    self._dropped += 1
+                elif self.overflow == BLOCK:
+                    self._cond.wait_for(lambda: len(self._buffer) < self.buffer_size, self.block_timeout)
+                if len(self._buffer) >= self.buffer_size:
+                    self._dropped += 1
+                    return False
+            self._buffer.append(body)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"publisher-{self.queue}", daemon=True)
+        self._thread.start()
+
+    def _next_batch(self):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: len(self._buffer) >= self.batch_size or self._closing or self._flush_requested,
+                self.flush_interval)
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not self._buffer:
+                self._flush_requested = False
+            self._in_flight = len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def _requeue(self, bodies):
+        with self._cond:
+            self._buffer.extendleft(reversed(bodies))
+            while len(self._buffer) > self.buffer_size:
+                self._buffer.pop()
+                self._dropped += 1
+            self._in_flight = 0
+            self._cond.notify_all()
+
+    def _run(self):
+        backoff = 0.1
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                with self._cond:
+                    if self._closing:
+                        return
+                self._service_connection()
+                continue
+            sent = 0
+            try:
+                channel = self._ensure_channel()
+                for body in batch:
+                    # With confirms enabled this returns once the broker has acked the message
+                    channel.basic_publish(
+                        exchange='',
+                        routing_key=self.queue,
+                        body=body,
+                        properties=pika.BasicProperties(delivery_mode=2)
+                    )
+                    sent += 1
+                with self._cond:
+                    self._published += sent
+                    self._in_flight = 0
+                    self._cond.notify_all()
+                backoff = 0.1
+            except Exception as e:
+                logger.error(f"Error publishing to RabbitMQ, retrying {len(batch) - sent} messages: {e}")
+                with self._cond:
+                    self._published += sent
+                    self._failures += 1
+                self._reset_connection()
+                self._requeue(batch[sent:])
+                with self._cond:
+                    if self._closing or self._cond.wait_for(lambda: self._closing, backoff):
+                        return
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _ensure_channel(self):
+        if self._channel is None or not self._channel.is_open:
+            self._reset_connection()
+            self._connection = self._connection_factory()
+            channel = self._connection.channel()
+            channel.queue_declare(queue=self.queue, durable=True)
+            channel.confirm_delivery()
+            self._channel = channel
+        return self._channel
+
+    def _service_connection(self):
+        # A BlockingConnection only answers heartbeats while it processes I/O; without this an idle
+        # publisher is dropped by the broker after the heartbeat timeout
+        if self._connection is None:
+            return
+        try:
+            self._connection.process_data_events(time_limit=0)
+        except Exception as e:
+            logger.warning(f"RabbitMQ connection lost while idle: {e}")
+            self._reset_connection()
+
+    def _reset_connection(self):
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def flush(self, timeout=5):
+        """Wait until everything buffered so far has been published or the timeout passes."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._buffer and not self._in_flight, timeout)
+
+    def close(self, timeout=2):
+        with self._cond:
+            if self._thread is None:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._reset_connection()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'buffered': len(self._buffer),
+                'published': self._published,
+                'dropped': self._dropped,
+                'failures': self._failures,
+            }
+
+
+class LocalBroker:
+    """Stand-in for a RabbitMQ broker that keeps published messages in memory.
+
+    ``connect`` takes the place of pika.BlockingConnection, so publishers can
+    be exercised in benchmarks without a broker. Each queue keeps its newest
+    ``max_messages`` bodies plus a count of everything published to it.
+    """
+
+    def __init__(self, max_messages=10000):
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self.queues = {}
+        self.published = {}
+
+    def connect(self, parameters=None):
+        return _LocalConnection(self)
+
+    def _publish(self, queue, body):
+        with self._lock:
+            if queue not in self.queues:
+                self.queues[queue] = deque(maxlen=self.max_messages)
+                self.published[queue] = 0
+            self.queues[queue].append(body)
+            self.published[queue] += 1
+
+
+class _LocalConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self):
+        return self
+
+    def queue_declare(self, queue, durable=False):
+        pass
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.broker._publish(routing_key, body)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(host, queue, **options):
+    """Return the process-wide publisher for a host and queue, creating it on first use."""
+    with _publishers_lock:
+        publisher = _publishers.get((host, queue))
+        if publisher is None:
+            publisher = _publishers[(host, queue)] = EventPublisher(host, queue, **options)
+            atexit.register(publisher.close)
+        return publisher
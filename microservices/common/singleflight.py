@@ -0,0 +1,127 @@
+"""Request coalescing helpers for cache rebuilds.
+
+SingleFlight collapses identical concurrent calls inside one process.
+RedisLease does the same across processes for a shared Redis cache.
+EarlyRefresh decides when a hot key should be rebuilt before it expires
+(the XFetch scheme), so readers do not all miss at the same moment.
+"""
+import math
+import random
+import threading
+import uuid
+
+import redis
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time and hands its outcome to concurrent callers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._leaders = 0
+        self._shared = 0
+
+    def do(self, key, fn):
+        """Call ``fn`` unless a call for ``key`` is in flight; returns ``(result, shared)``.
+
+        Callers that joined an in-flight call get its result, or its
+        exception re-raised, once it finishes.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._leaders += 1
+                leader = True
+            else:
+                self._shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'leaders': self._leaders, 'shared': self._shared}
+
+
+class RedisLease:
+    """Redis lock with an expiry, so a crashed holder cannot block a key forever.
+
+    Only the holder's token can release the lease. The check and delete run in
+    a WATCH/MULTI transaction, so a lease that expired and was taken by
+    another process is left alone.
+    """
+
+    def __init__(self, redis_client, key, timeout):
+        self.redis = redis_client
+        self.key = key
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.held = False
+
+    def acquire(self):
+        self.held = bool(self.redis.set(self.key, self.token, nx=True, px=int(self.timeout * 1000)))
+        return self.held
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                if pipe.get(self.key) in (self.token, self.token.encode()):
+                    pipe.multi()
+                    pipe.delete(self.key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+
+
+class EarlyRefresh:
+    """Probabilistic early expiration (XFetch) driven by observed rebuild times.
+
+    A reader holding a value with ``ttl`` seconds left rebuilds it early when
+    ``-delta * beta * ln(random()) >= ttl``, where ``delta`` is a moving
+    average of how long rebuilds take. The chance rises sharply as expiry
+    nears, so usually a single reader refreshes a hot key before it expires.
+    """
+
+    def __init__(self, beta=1.0, initial_delta=0.05, smoothing=0.2):
+        self.beta = beta
+        self.delta = initial_delta
+        self.smoothing = smoothing
+
+    def record(self, duration):
+        self.delta += self.smoothing * (duration - self.delta)
+
+    def should_refresh(self, ttl):
+        if ttl is None or ttl < 0:
+            # Missing or persistent keys are handled by the caller
+            return False
+        return -self.delta * self.beta * math.log(1.0 - random.random()) >= ttl
@@ -0,0 +1,84 @@
+import queue
+import time
+from unittest.mock import MagicMock
+
+from microservices.common.cache import TwoTierCache
+
+
+def make_cache(**options):
+    redis_client = MagicMock()
+    messages = queue.Queue()
+
+    def listen():
+        while True:
+            yield messages.get()
+
+    redis_client.pubsub.return_value.listen.side_effect = listen
+    cache = TwoTierCache(redis_client, channel='cache-invalidate:test', **options)
+    cache.get_many([])  # start the subscriber
+    deadline = time.monotonic() + 2
+    while not cache.stats()['subscribed']:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    return cache, redis_client, messages
+
+
+def test_two_tier_cache_serves_repeat_reads_from_process_memory():
+    cache, redis_client, _ = make_cache()
+    redis_client.pipeline.return_value.execute.return_value = [b'{"id": 1}', 60000]
+
+    assert cache.get_with_ttl('user:1') == (b'{"id": 1}', 60.0)
+    assert cache.get_with_ttl('user:1') == (b'{"id": 1}', None)
+    assert cache.get_many(['user:1']) == [b'{"id": 1}']
+
+    assert redis_client.pipeline.return_value.execute.call_count == 1
+    redis_client.mget.assert_not_called()
+    assert cache.stats()['local_hits'] == 2
+
+
+def test_two_tier_cache_bypasses_local_tier_while_unsubscribed():
+    cache, redis_client, messages = make_cache(retry_interval=60)
+    redis_client.pipeline.return_value.execute.return_value = [b'{"id": 1}', 60000]
+    cache.get_with_ttl('user:1')
+
+    messages.put({'type': 'message'})  # malformed, so the subscription fails
+    deadline = time.monotonic() + 2
+    while cache.stats()['subscribed']:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+    assert cache.get_with_ttl('user:1') == (b'{"id": 1}', 60.0)
+    assert redis_client.pipeline.return_value.execute.call_count == 2
+    assert cache.stats()['local_entries'] == 0
+
+
+def test_two_tier_cache_evicts_by_bytes_and_entries():
+    cache, redis_client, _ = make_cache(local_max_entries=2, local_max_bytes=10)
+    redis_client.mget.return_value = [b'aaaa', b'bbbb', b'cccc']
+
+    cache.get_many(['a', 'b', 'c'])
+
+    assert cache.stats()['local_entries'] == 2
+    redis_client.mget.return_value = [b'aaaa']
+    cache.get_many(['a', 'b', 'c'])
+    redis_client.mget.assert_called_with(['a'])
+
+
+def test_two_tier_cache_drops_local_copy_on_invalidation_from_another_process():
+    cache, redis_client, messages = make_cache()
+    cache.set('user:1', b'{"id": 1}', 60)
+    redis_client.pipeline.return_value.publish.assert_called_with(
+        'cache-invalidate:test', f"{cache.instance_id}:user:1")
+    assert cache.get('user:1') == b'{"id": 1}'
+    redis_client.get.assert_not_called()
+
+    # Our own invalidations are ignored; another worker's evict the entry
+    messages.put({'type': 'message', 'data': f"{cache.instance_id}:user:1".encode()})
+    messages.put({'type': 'message', 'data': b"otherworker:user:1"})
+    deadline = time.monotonic() + 2
+    while cache.stats()['invalidations'] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+    redis_client.get.return_value = b'{"id": 1, "username": "renamed"}'
+    assert cache.get('user:1') == b'{"id": 1, "username": "renamed"}'
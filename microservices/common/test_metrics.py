@@ -0,0 +1,68 @@
+import pytest
+
+from microservices.common.metrics import Metrics, Registry, parse_traceparent, start_trace, current_trace
+
+
+@pytest.fixture
+def metrics():
+    return Metrics('test_service', Registry(buckets=(0.001, 0.01)))
+
+
+def test_timed_records_duration_and_errors(metrics):
+    @metrics.timed('query')
+    def query(fail=False):
+        if fail:
+            raise ValueError("boom")
+        return 42
+
+    assert query() == 42
+    with pytest.raises(ValueError):
+        query(fail=True)
+
+    counts, total, errors = metrics.registry.histogram('test_service', 'query').snapshot()
+    assert sum(counts) == 2 and errors == 1 and total >= 0
+
+
+def test_render_uses_prometheus_text_format(metrics):
+    histogram = metrics.registry.histogram('test_service', 'redis')
+    histogram.observe(0.0005)
+    histogram.observe(0.005)
+    histogram.observe(2.0, error=True)
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE stage_duration_seconds histogram" in lines
+    assert 'stage_duration_seconds_bucket{service="test_service",stage="redis",le="0.001"} 1' in lines
+    assert 'stage_duration_seconds_bucket{service="test_service",stage="redis",le="0.01"} 2' in lines
+    assert 'stage_duration_seconds_bucket{service="test_service",stage="redis",le="+Inf"} 3' in lines
+    assert 'stage_duration_seconds_count{service="test_service",stage="redis"} 3' in lines
+    assert 'stage_errors_total{service="test_service",stage="redis"} 1' in lines
+
+
+def test_instrumented_connection_times_cursor_execute(metrics, mocker):
+    connection = mocker.Mock()
+    connection.cursor.return_value.fetchall.return_value = [(1,)]
+
+    cursor = metrics.instrument_connection(connection).cursor(dictionary=True)
+    cursor.execute("SELECT 1")
+    cursor.executemany("INSERT INTO t VALUES (%s)", [(1,), (2,)])
+
+    assert cursor.fetchall() == [(1,)]
+    connection.cursor.assert_called_once_with(dictionary=True)
+    counts, _, _ = metrics.registry.histogram('test_service', 'cursor_execute').snapshot()
+    assert sum(counts) == 2
+
+
+def test_trace_is_continued_from_a_valid_traceparent():
+    parent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    assert parse_traceparent(parent) == ('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', True)
+
+    trace = start_trace(parent)
+    assert current_trace() is trace
+    assert trace.trace_id == '4bf92f3577b34da6a3ce929d0e0e4736' and trace.parent_id == '00f067aa0ba902b7'
+    assert trace.traceparent() == f"00-4bf92f3577b34da6a3ce929d0e0e4736-{trace.span_id}-01"
+
+    for invalid in (None, "garbage", "00-00000000000000000000000000000000-00f067aa0ba902b7-01",
+                    "00-4bf92f3577b34da6a3ce929d0e0e473g-00f067aa0ba902b7-01"):
+        assert parse_traceparent(invalid) is None
+        assert start_trace(invalid).parent_id is None
+
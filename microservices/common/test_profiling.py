@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from microservices.common.profiling import PROFILE_HEADER, Profiler
+
+
+@pytest.fixture
+def profiler():
+    return Profiler('test_service', slow_query_threshold=0.05, buffer_size=3, sample_interval=0.001)
+
+
+@pytest.fixture
+def client(profiler):
+    app = Flask(__name__)
+    app.config['PROFILING_TOKEN'] = 'token'
+    profiler.install(app)
+
+    @app.route('/work')
+    def work():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return jsonify({'ok': True}), 200
+
+    return app.test_client()
+
+
+def test_header_with_token_profiles_the_request(client, profiler):
+    assert client.get('/work').status_code == 200
+    assert client.get('/work', headers={PROFILE_HEADER: 'wrong'}).status_code == 200
+    assert profiler.entries() == []
+
+    client.get('/work?x=1', headers={PROFILE_HEADER: 'token'})
+    [profile] = profiler.entries()
+    assert (profile.path, profile.status, profile.reason) == ('/work?x=1', 200, 'header')
+    assert profile.duration >= 0.05
+    folded = client.get(f'/admin/profiles/{profile.id}/flamegraph', headers={PROFILE_HEADER: 'token'})
+    assert 'work (test_profiling.py:' in folded.get_data(as_text=True)
+
+
+def test_sample_rate_profiles_without_header(client, profiler):
+    client.application.config['PROFILING_SAMPLE_RATE'] = 1.0
+    client.get('/work')
+    assert [profile.reason for profile in profiler.entries()] == ['sampled']
+
+
+def test_admin_endpoints_require_the_token(client, profiler):
+    assert client.get('/admin/profiles').status_code == 403
+    client.application.config['PROFILING_TOKEN'] = None
+    assert client.get('/admin/profiles', headers={PROFILE_HEADER: ''}).status_code == 403
+
+
+def test_ring_buffer_keeps_the_newest_profiles(client, profiler):
+    for _ in range(5):
+        client.get('/work', headers={PROFILE_HEADER: 'token'})
+
+    response = client.get('/admin/profiles', headers={PROFILE_HEADER: 'token'})
+    ids = [profile['id'] for profile in response.get_json()['profiles']]
+    assert len(ids) == 3 and ids == sorted(ids, reverse=True)
+    assert client.get(f'/admin/profiles/{ids[-1] - 1}', headers={PROFILE_HEADER: 'token'}).status_code == 404
+
+
+def test_slow_statement_is_explained_when_the_connection_closes(profiler, mocker):
+    connection = mocker.Mock()
+    cursor = connection.cursor.return_value
+    cursor.execute.side_effect = lambda operation, params=None: time.sleep(0.06 if 'Post' in operation else 0)
+    cursor.column_names = ('id', 'type', 'key')
+    cursor.fetchall.return_value = [(1, 'ALL', None)]
+
+    cnx = profiler.instrument_connection(connection)
+    query = cnx.cursor(dictionary=True)
+    query.execute("SELECT * FROM Post WHERE user_id = %s", (7,))
+    query.execute("SELECT 1")
+    assert profiler.entries() == []
+    cnx.close()
+
+    [slow] = profiler.entries()
+    record = slow.to_dict()['statement']
+    assert record['sql'] == "SELECT * FROM Post WHERE user_id = %s"
+    assert record['explain'] == [{'id': 1, 'type': 'ALL', 'key': None}]
+    cursor.execute.assert_any_call("EXPLAIN SELECT * FROM Post WHERE user_id = %s", (7,))
+    connection.close.assert_called_once()
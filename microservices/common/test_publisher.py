@@ -0,0 +1,122 @@
+import json
+import threading
+
+import pika
+import pytest
+
+from microservices.common.publisher import EventPublisher, LocalBroker, DROP_NEWEST, DROP_OLDEST
+
+
+class FakeChannel:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def queue_declare(self, queue, durable):
+        pass
+
+    def confirm_delivery(self):
+        self.broker.confirms = True
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        if self.broker.fail_next:
+            self.broker.fail_next -= 1
+            self.is_open = False
+            raise pika.exceptions.AMQPConnectionError("connection lost")
+        self.broker.messages.append(json.loads(body))
+
+
+class FakeBroker:
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self.confirms = False
+        self.gate = threading.Event()
+        self.gate.set()
+        self.serviced = threading.Event()
+
+    def connect(self):
+        self.gate.wait()
+        self.connections += 1
+        broker = self
+
+        class Connection:
+            def channel(self):
+                return FakeChannel(broker)
+
+            def process_data_events(self, time_limit=None):
+                assert time_limit == 0
+                broker.serviced.set()
+
+            def close(self):
+                pass
+
+        return Connection()
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker()
+
+
+def test_messages_are_published_over_one_connection_with_confirms(broker):
+    publisher = EventPublisher('localhost', 'service_queue', batch_size=10, connection_factory=broker.connect)
+    for i in range(25):
+        assert publisher.publish({"n": i})
+
+    assert publisher.flush(timeout=2)
+    assert [message["n"] for message in broker.messages] == list(range(25))
+    assert broker.connections == 1
+    assert broker.confirms
+    publisher.close()
+
+
+def test_unconfirmed_messages_are_retried_after_reconnect(broker):
+    broker.fail_next = 1
+    publisher = EventPublisher('localhost', 'service_queue', connection_factory=broker.connect)
+    publisher.publish({"n": 1})
+    publisher.publish({"n": 2})
+
+    assert publisher.flush(timeout=2)
+    assert [message["n"] for message in broker.messages] == [1, 2]
+    assert broker.connections == 2
+    assert publisher.stats()['failures'] == 1
+    publisher.close()
+
+
+@pytest.mark.parametrize("overflow, expected", [(DROP_NEWEST, [0, 1]), (DROP_OLDEST, [2, 3])])
+def test_full_buffer_applies_overflow_policy(broker, overflow, expected):
+    broker.gate.clear()
+    publisher = EventPublisher('localhost', 'service_queue', buffer_size=2, batch_size=100,
+                               flush_interval=5, overflow=overflow, connection_factory=broker.connect)
+    results = [publisher.publish({"n": i}) for i in range(4)]
+    broker.gate.set()
+
+    assert publisher.flush(timeout=2)
+    assert [message["n"] for message in broker.messages] == expected
+    assert publisher.stats()['dropped'] == 2
+    assert results == ([True, True, False, False] if overflow == DROP_NEWEST else [True] * 4)
+    publisher.close()
+
+
+def test_local_broker_keeps_newest_messages_per_queue():
+    local = LocalBroker(max_messages=3)
+    publisher = EventPublisher('localhost', 'service_queue', connection_factory=local.connect)
+    for i in range(5):
+        publisher.publish({"n": i})
+
+    assert publisher.flush(timeout=2)
+    assert [json.loads(body)["n"] for body in local.queues['service_queue']] == [2, 3, 4]
+    assert local.published == {'service_queue': 5}
+    publisher.close()
+
+
+def test_idle_connection_keeps_processing_heartbeats(broker):
+    publisher = EventPublisher('localhost', 'service_queue', flush_interval=0.01, connection_factory=broker.connect)
+    publisher.publish({'n': 1})
+    assert publisher.flush()
+
+    broker.serviced.clear()
+    assert broker.serviced.wait(1)
+    publisher.close()
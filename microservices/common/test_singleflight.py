@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from microservices.common.singleflight import SingleFlight, EarlyRefresh
+
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def load():
+        calls.append(1)
+        release.wait(2)
+        return "value"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("user:1", load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 2
+    while flight.stats()['shared'] < 4 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("value", False)] + [("value", True)] * 4
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_propagates_errors_and_forgets_the_call():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do("user:1", fail)
+    assert flight.do("user:1", lambda: "retried") == ("retried", False)
+
+
+def test_early_refresh_probability_rises_as_expiry_nears():
+    refresh = EarlyRefresh(beta=1.0, initial_delta=0.1)
+
+    far = sum(refresh.should_refresh(60) for _ in range(1000))
+    near = sum(refresh.should_refresh(0.01) for _ in range(1000))
+
+    assert far == 0
+    assert near > 800
+    assert not refresh.should_refresh(None)
@@ -0,0 +1,239 @@
+import sys
+import os
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from flask import Flask, request, jsonify
+import mysql.connector
+from mysql.connector import errorcode
+import logging
+import redis
+from db.pool import get_pool
+from microservices.engagement_service.counters import EngagementCounters, CounterFlusher
+
+
+app = Flask(__name__)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Database connection pool shared with the other services in this process
+db_pool = get_pool()
+
+# Redis configuration
+redis_client = redis.Redis(host='localhost', port=6379, db=0)
+
+# Counter configuration; deltas sit in Redis until the flusher adds them to Post's count columns
+COUNTER_FLUSH_INTERVAL = 1.0
+COUNTER_FLUSH_BATCH = 500
+MAX_COUNTS_BATCH = 1000
+
+def get_db_connection():
+    try:
+        connection = db_pool.get_connection()
+        return connection
+    except mysql.connector.Error as err:
+        logger.error(f"Database error: {err}")
+        return None
+
+counters = EngagementCounters(redis_client)
+counter_flusher = CounterFlusher(counters, lambda: get_db_connection(),
+                                 interval=COUNTER_FLUSH_INTERVAL, batch_size=COUNTER_FLUSH_BATCH)
+
+def record(post_id, field, amount=1):
+    # The row is already committed, so a lost increment only skews the count until it is recomputed
+    try:
+        counters.incr(post_id, field, amount)
+        counter_flusher.ensure_started()
+    except Exception as e:
+        logger.error(f"Failed to count {field} for post {post_id}: {e}")
+
+def integrity_error_response(err):
+    if err.errno == errorcode.ER_DUP_ENTRY:
+        return jsonify({'error': 'Already liked'}), 409
+    if err.errno == errorcode.ER_NO_REFERENCED_ROW_2:
+        return jsonify({'error': 'Post or user not found'}), 404
+    raise err
+
+def get_user_id():
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id', request.args.get('user_id'))
+    return int(user_id) if user_id is not None else None
+
+def parse_post_ids(value):
+    post_ids = [int(post_id) for post_id in value.split(',') if post_id.strip()]
+    if not post_ids:
+        raise ValueError('post_ids is required')
+    if len(post_ids) > MAX_COUNTS_BATCH:
+        raise ValueError(f'At most {MAX_COUNTS_BATCH} post_ids per request')
+    return list(dict.fromkeys(post_ids))
+
+@app.route('/post/<int:post_id>/like', methods=['POST'])
+def like_post(post_id):
+    try:
+        user_id = get_user_id()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid user_id'}), 400
+    if user_id is None:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        # The unique (post_id, user_id) key rejects duplicates, so there is no lookup before the insert
+        cursor.execute("INSERT INTO `Like` (post_id, user_id) VALUES (%s, %s)", (post_id, user_id))
+        cnx.commit()
+        cursor.close()
+        record(post_id, 'likes')
+        return jsonify({'message': 'Post liked'}), 201
+    except mysql.connector.IntegrityError as err:
+        cnx.rollback()
+        return integrity_error_response(err)
+    except Exception as e:
+        logger.error(f"Error liking post {post_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/post/<int:post_id>/like', methods=['DELETE'])
+def unlike_post(post_id):
+    try:
+        user_id = get_user_id()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid user_id'}), 400
+    if user_id is None:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("DELETE FROM `Like` WHERE post_id = %s AND user_id = %s", (post_id, user_id))
+        cnx.commit()
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Like not found'}), 404
+        cursor.close()
+        record(post_id, 'likes', -1)
+        return jsonify({'message': 'Post unliked'}), 200
+    except Exception as e:
+        logger.error(f"Error unliking post {post_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/post/<int:post_id>/share', methods=['POST'])
+def share_post(post_id):
+    try:
+        user_id = get_user_id()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid user_id'}), 400
+    if user_id is None:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("INSERT INTO Share (post_id, user_id) VALUES (%s, %s)", (post_id, user_id))
+        cnx.commit()
+        cursor.close()
+        record(post_id, 'shares')
+        return jsonify({'message': 'Post shared'}), 201
+    except mysql.connector.IntegrityError as err:
+        cnx.rollback()
+        return integrity_error_response(err)
+    except Exception as e:
+        logger.error(f"Error sharing post {post_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/post/<int:post_id>/comments', methods=['POST'])
+def add_comment(post_id):
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id')
+    content = data.get('content')
+    if user_id is None or not content:
+        return jsonify({'error': 'user_id and content are required'}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("INSERT INTO Comment (post_id, user_id, content, created_at) VALUES (%s, %s, %s, %s)",
+                       (post_id, user_id, content, datetime.now()))
+        comment_id = cursor.lastrowid
+        cnx.commit()
+        cursor.close()
+        record(post_id, 'comments')
+        return jsonify({'message': 'Comment added', 'id': comment_id}), 201
+    except mysql.connector.IntegrityError as err:
+        cnx.rollback()
+        return integrity_error_response(err)
+    except Exception as e:
+        logger.error(f"Error commenting on post {post_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/counts', methods=['GET'])
+def get_counts():
+    try:
+        post_ids = parse_post_ids(request.args.get('post_ids', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        placeholders = ', '.join(['%s'] * len(post_ids))
+        cursor.execute(f"SELECT id, like_count, share_count, comment_count FROM Post WHERE id IN ({placeholders})",
+                       tuple(post_ids))
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        cursor.close()
+    except Exception as e:
+        logger.error(f"Error reading counts: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+    # Add increments that have not been flushed yet, so counts reflect every acknowledged write
+    try:
+        pending = counters.pending(list(rows))
+    except Exception as e:
+        logger.error(f"Failed to read pending counts: {e}")
+        pending = {}
+
+    results = []
+    for post_id in post_ids:
+        if post_id not in rows:
+            results.append({'post_id': post_id, 'error': 'Post not found'})
+            continue
+        deltas = pending.get(post_id, {})
+        results.append({
+            'post_id': post_id,
+            'likes': rows[post_id][0] + deltas.get('likes', 0),
+            'shares': rows[post_id][1] + deltas.get('shares', 0),
+            'comments': rows[post_id][2] + deltas.get('comments', 0),
+        })
+    return jsonify({'counts': results}), 200
+
+@app.route('/health')
+def health_check():
+    return jsonify({"status": "healthy"}), 200
+
+@app.route('/health/db')
+def db_pool_stats():
+    return jsonify({"pool": db_pool.stats()}), 200
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5003)
@@ -0,0 +1,137 @@
+"""Buffered per-post engagement counters.
+
+Increments land in Redis hashes of pending deltas (HINCRBY) and mark the
+post dirty. A background flusher drains dirty posts in batches and adds
+their deltas to the denormalized count columns on Post, so MySQL sees one
+UPDATE per post per flush rather than one per like.
+"""
+import logging
+import threading
+
+from mysql.connector import errors
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('likes', 'shares', 'comments')
+DIRTY_KEY = "engagement:dirty"
+
+
+def deltas_key(post_id):
+    return f"engagement:deltas:{post_id}"
+
+
+class EngagementCounters:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def incr(self, post_id, field, amount=1):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(deltas_key(post_id), field, amount)
+        pipe.sadd(DIRTY_KEY, post_id)
+        pipe.execute()
+
+    def pending(self, post_ids):
+        """Deltas not yet flushed to MySQL, as {post_id: {field: delta}}."""
+        pipe = self.redis.pipeline(transaction=False)
+        for post_id in post_ids:
+            pipe.hgetall(deltas_key(post_id))
+        return {post_id: _parse_deltas(deltas) for post_id, deltas in zip(post_ids, pipe.execute())}
+
+    def drain(self, max_posts):
+        """Take up to ``max_posts`` dirty posts and atomically reset their deltas."""
+        post_ids = [int(post_id) for post_id in self.redis.spop(DIRTY_KEY, max_posts) or []]
+        if not post_ids:
+            return {}
+        pipe = self.redis.pipeline()
+        for post_id in post_ids:
+            pipe.hgetall(deltas_key(post_id))
+            pipe.delete(deltas_key(post_id))
+        results = pipe.execute()
+        return {post_id: _parse_deltas(deltas) for post_id, deltas in zip(post_ids, results[::2])}
+
+    def restore(self, deltas_by_post):
+        """Put drained deltas back after a failed flush so they are retried."""
+        pipe = self.redis.pipeline()
+        for post_id, deltas in deltas_by_post.items():
+            for field, delta in deltas.items():
+                pipe.hincrby(deltas_key(post_id), field, delta)
+            pipe.sadd(DIRTY_KEY, post_id)
+        pipe.execute()
+
+
+def _parse_deltas(deltas):
+    parsed = {}
+    for field, delta in (deltas or {}).items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field in FIELDS and int(delta):
+            parsed[field] = int(delta)
+    return parsed
+
+
+class CounterFlusher:
+    """Periodically applies drained deltas to Post's count columns in one transaction per batch."""
+
+    def __init__(self, counters, get_connection, interval=1.0, batch_size=500):
+        self.counters = counters
+        self._get_connection = get_connection
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='engagement-flush', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                while self.flush_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Error flushing engagement counters: {e}")
+
+    def flush_once(self):
+        """Flush one batch of dirty posts; returns how many posts were drained."""
+        deltas_by_post = self.counters.drain(self.batch_size)
+        if not deltas_by_post:
+            return 0
+        rows = [tuple(deltas.get(field, 0) for field in FIELDS) + (post_id,)
+                for post_id, deltas in deltas_by_post.items() if deltas]
+        if not rows:
+            return len(deltas_by_post)
+
+        cnx = None
+        try:
+            cnx = self._get_connection()
+            if cnx is None:
+                raise errors.OperationalError("Database connection failed")
+            cursor = cnx.cursor()
+            cursor.executemany(
+                "UPDATE Post SET like_count = like_count + %s, share_count = share_count + %s, "
+                "comment_count = comment_count + %s WHERE id = %s",
+                rows
+            )
+            cnx.commit()
+            cursor.close()
+        except Exception:
+            if cnx is not None:
+                cnx.rollback()
+            self.counters.restore(deltas_by_post)
+            raise
+        finally:
+            if cnx is not None:
+                cnx.close()
+        return len(deltas_by_post)
+
+    def stop(self, flush=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+        if flush:
+            while self.flush_once() == self.batch_size:
+                pass
@@ -0,0 +1,98 @@
+import pytest
+from app import app, counters
+import mysql.connector
+from mysql.connector import errorcode
+from microservices.engagement_service.counters import EngagementCounters, CounterFlusher, DIRTY_KEY
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def mock_db(mocker):
+    mock_connection = mocker.Mock()
+    mock_cursor = mocker.Mock()
+    mock_connection.cursor.return_value = mock_cursor
+    mocker.patch('app.get_db_connection', return_value=mock_connection)
+    return mock_cursor
+
+@pytest.fixture
+def mock_redis(mocker):
+    mock = mocker.patch('app.redis_client')
+    mocker.patch.object(counters, 'redis', mock)
+    mocker.patch('app.counter_flusher')
+    return mock
+
+def test_health_check(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json == {"status": "healthy"}
+
+def test_like_post_inserts_and_buffers_count(client, mock_db, mock_redis):
+    response = client.post('/post/1/like', json={'user_id': 2})
+    assert response.status_code == 201
+    assert mock_db.execute.call_count == 1
+    assert mock_db.execute.call_args.args[0].startswith("INSERT INTO `Like`")
+    pipe = mock_redis.pipeline.return_value
+    pipe.hincrby.assert_called_once_with("engagement:deltas:1", 'likes', 1)
+    pipe.sadd.assert_called_once_with(DIRTY_KEY, 1)
+
+def test_duplicate_like_rejected_by_unique_key(client, mock_db, mock_redis):
+    mock_db.execute.side_effect = mysql.connector.IntegrityError(errno=errorcode.ER_DUP_ENTRY)
+    response = client.post('/post/1/like', json={'user_id': 2})
+    assert response.status_code == 409
+    assert mock_db.execute.call_count == 1
+    mock_redis.pipeline.return_value.hincrby.assert_not_called()
+
+def test_unlike_missing_like_returns_404(client, mock_db, mock_redis):
+    mock_db.rowcount = 0
+    response = client.delete('/post/1/like?user_id=2')
+    assert response.status_code == 404
+    mock_redis.pipeline.return_value.hincrby.assert_not_called()
+
+def test_get_counts_adds_unflushed_deltas(client, mock_db, mock_redis):
+    mock_db.fetchall.return_value = [(3, 10, 1, 4), (1, 0, 0, 0)]
+    mock_redis.pipeline.return_value.execute.return_value = [{b'likes': b'2'}, {b'comments': b'-1'}]
+
+    response = client.get('/counts?post_ids=3,1,9')
+    assert response.status_code == 200
+    assert response.json == {"counts": [
+        {"post_id": 3, "likes": 12, "shares": 1, "comments": 4},
+        {"post_id": 1, "likes": 0, "shares": 0, "comments": -1},
+        {"post_id": 9, "error": "Post not found"},
+    ]}
+    query, params = mock_db.execute.call_args.args
+    assert "IN (%s, %s, %s)" in query and params == (3, 1, 9)
+
+def test_get_counts_rejects_bad_ids(client):
+    response = client.get('/counts?post_ids=1,abc')
+    assert response.status_code == 400
+
+def test_flusher_applies_batch_in_one_statement(mocker):
+    redis_client = mocker.Mock()
+    redis_client.spop.return_value = [b'1', b'2']
+    redis_client.pipeline.return_value.execute.return_value = [{b'likes': b'3'}, 1, {b'shares': b'1', b'comments': b'2'}, 1]
+    connection = mocker.Mock()
+    flusher = CounterFlusher(EngagementCounters(redis_client), lambda: connection, batch_size=2)
+
+    assert flusher.flush_once() == 2
+    query, rows = connection.cursor.return_value.executemany.call_args.args
+    assert query.startswith("UPDATE Post SET like_count = like_count + %s")
+    assert rows == [(3, 0, 0, 1), (0, 1, 2, 2)]
+    connection.commit.assert_called_once()
+
+def test_flusher_restores_deltas_when_update_fails(mocker):
+    redis_client = mocker.Mock()
+    redis_client.spop.return_value = [b'5']
+    redis_client.pipeline.return_value.execute.return_value = [{b'likes': b'4'}, 1]
+    connection = mocker.Mock()
+    connection.cursor.return_value.executemany.side_effect = mysql.connector.OperationalError("gone away")
+    flusher = CounterFlusher(EngagementCounters(redis_client), lambda: connection)
+
+    with pytest.raises(mysql.connector.OperationalError):
+        flusher.flush_once()
+    connection.rollback.assert_called_once()
+    redis_client.pipeline.return_value.hincrby.assert_called_once_with("engagement:deltas:5", 'likes', 4)
+    redis_client.pipeline.return_value.sadd.assert_called_once_with(DIRTY_KEY, 5)
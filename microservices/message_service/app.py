@@ -0,0 +1,192 @@
+import sys
+import os
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from flask import Flask, request, jsonify
+import mysql.connector
+import logging
+from db.pool import get_pool
+from microservices.common.pagination import encode_cursor, get_page_args, keyset_condition
+
+
+app = Flask(__name__)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Database connection pool shared with the other services in this process
+db_pool = get_pool()
+
+# Message configuration
+MAX_MESSAGE_LENGTH = 5000
+
+# Both participants' Inbox rows in one statement; only the receiver's unread count grows.
+# Concurrent sends may upsert out of order, so the newest message id wins (last_message_at is assigned first).
+UPSERT_INBOX_QUERY = ("INSERT INTO Inbox (user_id, peer_id, last_message_id, last_message_at, unread_count) "
+                      "VALUES (%s, %s, %s, %s, 0), (%s, %s, %s, %s, 1) "
+                      "ON DUPLICATE KEY UPDATE "
+                      "last_message_at = IF(VALUES(last_message_id) > last_message_id, "
+                      "VALUES(last_message_at), last_message_at), "
+                      "last_message_id = GREATEST(last_message_id, VALUES(last_message_id)), "
+                      "unread_count = unread_count + VALUES(unread_count)")
+
+def get_db_connection():
+    try:
+        connection = db_pool.get_connection()
+        return connection
+    except mysql.connector.Error as err:
+        logger.error(f"Database error: {err}")
+        return None
+
+def serialize_message(message):
+    return {
+        'id': message[0],
+        'sender_id': message[1],
+        'receiver_id': message[2],
+        'content': message[3],
+        'created_at': message[4].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+@app.route('/messages', methods=['POST'])
+def send_message():
+    data = request.get_json(silent=True) or {}
+    sender_id = data.get('sender_id')
+    receiver_id = data.get('receiver_id')
+    content = data.get('content')
+    if not isinstance(sender_id, int) or not isinstance(receiver_id, int):
+        return jsonify({'error': "'sender_id' and 'receiver_id' must be integers"}), 400
+    if sender_id == receiver_id:
+        return jsonify({'error': 'Cannot send a message to yourself'}), 400
+    if not isinstance(content, str) or not content.strip() or len(content) > MAX_MESSAGE_LENGTH:
+        return jsonify({'error': f"'content' must be a non-empty string of at most {MAX_MESSAGE_LENGTH} characters"}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        created_at = datetime.now().replace(microsecond=0)
+        cursor.execute("INSERT INTO Message (sender_id, receiver_id, content, created_at) VALUES (%s, %s, %s, %s)",
+                       (sender_id, receiver_id, content, created_at))
+        message_id = cursor.lastrowid
+        cursor.execute(UPSERT_INBOX_QUERY, (sender_id, receiver_id, message_id, created_at,
+                                            receiver_id, sender_id, message_id, created_at))
+        cnx.commit()
+        cursor.close()
+        return jsonify({'id': message_id, 'message': 'Message sent'}), 201
+    except mysql.connector.IntegrityError as e:
+        cnx.rollback()
+        logger.error(f"Rejected message from {sender_id} to {receiver_id}: {e}")
+        return jsonify({'error': 'Unknown sender or receiver'}), 400
+    except Exception as e:
+        cnx.rollback()
+        logger.error(f"Error sending message: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/conversations/<int:user_id>/<int:peer_id>', methods=['GET'])
+def get_conversation(user_id, peer_id):
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        condition, params = keyset_condition(before)
+        # One range scan of the (sender_id, receiver_id, created_at, id) index per direction
+        direction = ("(SELECT id, sender_id, receiver_id, content, created_at FROM Message "
+                     "WHERE sender_id = %s AND receiver_id = %s" + condition +
+                     " ORDER BY created_at DESC, id DESC LIMIT %s)")
+        cursor.execute(direction + " UNION ALL " + direction + " ORDER BY created_at DESC, id DESC LIMIT %s",
+                       (user_id, peer_id, *params, limit + 1, peer_id, user_id, *params, limit + 1, limit + 1))
+        messages = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        logger.error(f"Error reading conversation of {user_id} with {peer_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+    next_cursor = None
+    if len(messages) > limit:
+        last = messages[limit - 1]
+        next_cursor = encode_cursor(last[4].timestamp(), last[0])
+    return jsonify({
+        'messages': [serialize_message(message) for message in messages[:limit]],
+        'next_cursor': next_cursor
+    }), 200
+
+@app.route('/conversations/<int:user_id>/<int:peer_id>/read', methods=['POST'])
+def mark_conversation_read(user_id, peer_id):
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("UPDATE Inbox SET unread_count = 0 WHERE user_id = %s AND peer_id = %s", (user_id, peer_id))
+        cnx.commit()
+        cursor.close()
+        return jsonify({'message': 'Conversation marked as read'}), 200
+    except Exception as e:
+        logger.error(f"Error marking conversation of {user_id} with {peer_id} read: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/inbox/<int:user_id>', methods=['GET'])
+def get_inbox(user_id):
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        condition, params = keyset_condition(before, 'i.last_message_at', 'i.last_message_id')
+        cursor.execute("SELECT i.peer_id, i.unread_count, m.id, m.sender_id, m.receiver_id, m.content, m.created_at "
+                       "FROM Inbox i JOIN Message m ON m.id = i.last_message_id "
+                       "WHERE i.user_id = %s" + condition +
+                       " ORDER BY i.last_message_at DESC, i.last_message_id DESC LIMIT %s",
+                       (user_id, *params, limit + 1))
+        rows = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        logger.error(f"Error reading inbox of {user_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[6].timestamp(), last[2])
+    return jsonify({
+        'conversations': [{
+            'peer_id': row[0],
+            'unread_count': row[1],
+            'last_message': serialize_message(row[2:])
+        } for row in rows[:limit]],
+        'next_cursor': next_cursor
+    }), 200
+
+@app.route('/health')
+def health_check():
+    return jsonify({"status": "healthy"}), 200
+
+@app.route('/health/db')
+def db_pool_stats():
+    return jsonify({"pool": db_pool.stats()}), 200
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5004)
@@ -0,0 +1,81 @@
+import pytest
+from app import app
+from datetime import datetime
+import mysql.connector
+from microservices.common.pagination import encode_cursor
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def mock_db(mocker):
+    mock_connection = mocker.Mock()
+    mock_cursor = mocker.Mock()
+    mock_connection.cursor.return_value = mock_cursor
+    mocker.patch('app.get_db_connection', return_value=mock_connection)
+    return mock_cursor
+
+def test_health_check(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json == {"status": "healthy"}
+
+def test_send_message_updates_both_inboxes_in_one_statement(client, mock_db):
+    mock_db.lastrowid = 11
+
+    response = client.post('/messages', json={"sender_id": 1, "receiver_id": 2, "content": "hi"})
+    assert response.status_code == 201
+    assert response.json['id'] == 11
+    assert mock_db.execute.call_count == 2
+    query, params = mock_db.execute.call_args.args
+    assert query.startswith("INSERT INTO Inbox") and "ON DUPLICATE KEY UPDATE" in query
+    assert params[:3] == (1, 2, 11) and params[4:7] == (2, 1, 11)
+
+def test_send_message_to_unknown_user_is_rejected(client, mock_db):
+    mock_db.execute.side_effect = mysql.connector.IntegrityError("foreign key")
+    response = client.post('/messages', json={"sender_id": 1, "receiver_id": 99, "content": "hi"})
+    assert response.status_code == 400
+
+def test_send_message_validates_input(client):
+    assert client.post('/messages', json={"sender_id": 1, "receiver_id": 1, "content": "me"}).status_code == 400
+    assert client.post('/messages', json={"sender_id": 1, "receiver_id": 2, "content": " "}).status_code == 400
+
+def test_get_conversation_merges_both_directions_newest_first(client, mock_db):
+    mock_db.fetchall.return_value = [
+        (12, 2, 1, "reply", datetime(2024, 2, 20, 12, 1, 0)),
+        (11, 1, 2, "hi", datetime(2024, 2, 20, 12, 0, 0)),
+    ]
+
+    response = client.get('/conversations/1/2?limit=1')
+    assert response.status_code == 200
+    assert [message['id'] for message in response.json['messages']] == [12]
+    assert response.json['next_cursor'] == encode_cursor(datetime(2024, 2, 20, 12, 1, 0).timestamp(), 12)
+    query, params = mock_db.execute.call_args.args
+    assert query.count("WHERE sender_id = %s AND receiver_id = %s") == 2 and "UNION ALL" in query
+    assert params == (1, 2, 2, 2, 1, 2, 2)
+
+def test_get_inbox_lists_conversations_from_summary_rows(client, mock_db):
+    mock_db.fetchall.return_value = [(2, 3, 12, 2, 1, "reply", datetime(2024, 2, 20, 12, 1, 0))]
+
+    response = client.get('/inbox/1')
+    assert response.status_code == 200
+    assert response.json == {
+        'conversations': [{
+            'peer_id': 2,
+            'unread_count': 3,
+            'last_message': {'id': 12, 'sender_id': 2, 'receiver_id': 1, 'content': "reply",
+                             'created_at': "2024-02-20 12:01:00"}
+        }],
+        'next_cursor': None
+    }
+    query, _ = mock_db.execute.call_args.args
+    assert "FROM Inbox i" in query and "GROUP BY" not in query
+
+def test_mark_conversation_read_resets_unread_count(client, mock_db):
+    response = client.post('/conversations/1/2/read')
+    assert response.status_code == 200
+    mock_db.execute.assert_called_once_with(
+        "UPDATE Inbox SET unread_count = 0 WHERE user_id = %s AND peer_id = %s", (1, 2))
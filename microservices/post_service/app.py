@@ -5,10 +5,22 @@ from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import mysql.connector
+import bisect
+import json
 import logging
-from db.config import config
+import redis
+from db.pool import get_pool
+from db.group_commit import CommitTimeout, GroupCommitter, insert_many
+from microservices.common.cache import TwoTierCache
+from microservices.common.profiling import Profiler
+from microservices.common.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, TRACEPARENT, start_trace
+from microservices.post_service import feed, ranking, tags
+from microservices.common.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, encode_rank_cursor,
+                                             decode_rank_cursor, get_page_args, keyset_condition)
+from microservices.post_service.search import SearchIndex
+from microservices.post_service.trending import TrendingTags, WINDOWS as TRENDING_WINDOWS
 
 
 app = Flask(__name__)
@@ -17,29 +29,410 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Database configuration
-db_config = {
-    'user': config['user'],
-    'password': config['password'],
-    'host': config['host'],
-    'database': config['database']
-}
+# Stage latency metrics, served at /metrics
+metrics = Metrics('post_service')
+
+# Opt-in request profiling, read back from /admin/profiles. Set PROFILING_TOKEN to
+# allow profiling by header, or PROFILING_SAMPLE_RATE to profile a share of requests.
+app.config['PROFILING_TOKEN'] = None
+app.config['PROFILING_SAMPLE_RATE'] = 0.0
+SLOW_QUERY_THRESHOLD = 0.1  # seconds; slower statements are explained
+profiler = Profiler('post_service', slow_query_threshold=SLOW_QUERY_THRESHOLD, buffer_size=100)
+
+# Database connection pool shared with the other services in this process
+db_pool = get_pool()
+
+# Redis configuration
+redis_client = metrics.instrument_redis(redis.Redis(host='localhost', port=6379, db=0))
+
+# Recent posts of high-follower authors, pulled into feeds at read time
+author_posts = feed.AuthorPostsCache(redis_client)
+
+# Post cache configuration; ids that do not exist are cached as an empty payload
+POST_CACHE_TTL = 3600
+POST_NEGATIVE_CACHE_TTL = 60
+POST_VERSION_TTL = 2 * POST_CACHE_TTL  # version counters must outlive the entries they guard
+POST_NOT_FOUND = b''
+post_cache = TwoTierCache(redis_client, channel='cache-invalidate:post', local_ttl=5)
+
+# Write batching configuration; a GROUP_COMMIT_WINDOW of 0 commits every add_post on its own
+MAX_BATCH_SIZE = 500
+GROUP_COMMIT_WINDOW = 0
+GROUP_COMMIT_MAX_BATCH = 100
+ADD_POST_QUERY = ("INSERT INTO Post (user_id, content, created_at) "
+                  "VALUES (%s, %s, %s)")
 
+# Search configuration; the snapshot is mapped at startup and rewritten every SEARCH_SNAPSHOT_INTERVAL seconds
+SEARCH_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search.snapshot')
+SEARCH_SNAPSHOT_INTERVAL = 300
+SEARCH_FETCH_BATCH = 1000  # posts loaded per query when reindexing
+SEARCH_RECONCILE_BATCH = 10000  # post ids per query of the reconcile scan
+SEARCH_TOP_UP_ATTEMPTS = 3  # searches per page when results turn out to be deleted posts
+
+# Ranked feed configuration; affinity counts the reader's most recent AFFINITY_HISTORY likes, comments and shares
+RANKING_CANDIDATES = 2000
+AFFINITY_HISTORY = 1000
+AFFINITY_CACHE_TTL = 600
+
+# Trending configuration; windows are counted in memory from the posts this process writes
+DEFAULT_TRENDING_WINDOW = '1h'
+DEFAULT_TRENDING_LIMIT = 10
+MAX_TRENDING_LIMIT = 100
+trending_tags = TrendingTags(capacity=2 * MAX_TRENDING_LIMIT)
+
+@metrics.timed('get_db_connection')
 def get_db_connection():
     try:
-        connection = mysql.connector.connect(**db_config)
-        return connection
+        connection = db_pool.get_connection()
+        return metrics.instrument_connection(profiler.instrument_connection(connection))
     except mysql.connector.Error as err:
         logger.error(f"Database error: {err}")
         return None
 
+def reindex_posts(cursor, index, post_ids):
+    # Reads the posts back so the index holds the latest committed version; ids with no row are removed
+    for start in range(0, len(post_ids), SEARCH_FETCH_BATCH):
+        batch = post_ids[start:start + SEARCH_FETCH_BATCH]
+        posts = fetch_posts(cursor, batch)
+        for post_id in batch:
+            post = posts.get(post_id)
+            if post is None:
+                index.remove(post_id)
+            else:
+                index.add(post_id, post[2], post[3].timestamp())
+
+def refresh_search_index(index, post_ids):
+    # Applies an update another worker published for these posts
+    cnx = get_db_connection()
+    if cnx is None:
+        raise mysql.connector.errors.OperationalError("Database connection failed")
+    try:
+        cursor = cnx.cursor()
+        reindex_posts(cursor, index, post_ids)
+        cursor.close()
+    finally:
+        cnx.close()
+
+def reconcile_search_index(index):
+    # Walks every post, reindexing those whose content differs from the indexed copy and dropping deleted ones
+    known = sorted(index.doc_ids())
+    cnx = get_db_connection()
+    if cnx is None:
+        raise mysql.connector.errors.OperationalError("Database connection failed")
+    try:
+        cursor = cnx.cursor()
+        after_id = 0
+        while True:
+            cursor.execute("SELECT id, CRC32(content) FROM Post WHERE id > %s ORDER BY id LIMIT %s",
+                           (after_id, SEARCH_RECONCILE_BATCH))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            seen = {post_id for post_id, _ in rows}
+            stale = [post_id for post_id, crc in rows if index.fingerprint(post_id) != (crc or 0)]
+            gone = [post_id for post_id in known[bisect.bisect_right(known, after_id):
+                                                 bisect.bisect_right(known, rows[-1][0])]
+                    if post_id not in seen]
+            reindex_posts(cursor, index, stale + gone)
+            after_id = rows[-1][0]
+        reindex_posts(cursor, index, known[bisect.bisect_right(known, after_id):])
+        cursor.close()
+    finally:
+        cnx.close()
+
+search_index = SearchIndex(SEARCH_SNAPSHOT_PATH, snapshot_interval=SEARCH_SNAPSHOT_INTERVAL,
+                           reconcile=reconcile_search_index, refresh=refresh_search_index,
+                           redis_client=redis_client, channel='search-index:post')
+
+def index_posts(posts):
+    try:
+        for post in posts:
+            search_index.add(post[0], post[2], post[3].timestamp())
+        search_index.publish([post[0] for post in posts])
+    except Exception as e:
+        logger.error(f"Failed to index posts for search: {e}")
+
+def unindex_post(post_id):
+    try:
+        search_index.remove(post_id)
+        search_index.publish([post_id])
+    except Exception as e:
+        logger.error(f"Failed to remove post {post_id} from search: {e}")
+
+def record_trending(posts):
+    try:
+        for post in posts:
+            trending_tags.record(tags.extract_tags(post[2]))
+    except Exception as e:
+        logger.error(f"Failed to count trending tags: {e}")
+
+def serialize_post(post):
+    return {
+        'id': post[0],
+        'user_id': post[1],
+        'content': post[2],
+        'created_at': post[3].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def encode_post(post):
+    return json.dumps(serialize_post(post)).encode()
+
+def post_key(post_id):
+    return f"post:{post_id}"
+
+def post_version_key(post_id):
+    return f"post:{post_id}:version"
+
+def get_cached_post(post_id):
+    # Returns (payload, version); on a miss, the version must be unchanged for the later fill to be written
+    try:
+        payload = post_cache.get(post_key(post_id))
+        if payload is not None:
+            return payload, None
+        return None, post_cache.version(post_version_key(post_id))
+    except Exception as e:
+        logger.error(f"Failed to read cached post {post_id}: {e}")
+        return None, None
+
+def fill_post_cache(post_id, payload, version):
+    if version is None:
+        return
+    ttl = POST_CACHE_TTL if payload != POST_NOT_FOUND else POST_NEGATIVE_CACHE_TTL
+    try:
+        post_cache.set_if_version(post_key(post_id), payload, ttl, post_version_key(post_id), version)
+    except Exception as e:
+        logger.error(f"Failed to cache post {post_id}: {e}")
+
+def cache_new_posts(posts):
+    try:
+        post_cache.set_many_versioned([(post_key(post[0]), encode_post(post), POST_CACHE_TTL, post_version_key(post[0]))
+                                       for post in posts], POST_VERSION_TTL)
+    except Exception as e:
+        logger.error(f"Failed to cache new posts: {e}")
+
+def start_post_write(post_id):
+    # Called after the UPDATE/DELETE and before commit, while the row lock orders concurrent writers
+    try:
+        return post_cache.bump_version(post_version_key(post_id), POST_VERSION_TTL, evict=[post_key(post_id)])
+    except Exception as e:
+        logger.error(f"Failed to evict cached post {post_id}: {e}")
+        return None
+
+def finish_post_write(post_id, payload, ttl, version):
+    # Only the latest writer's content lands; if this fails the entry stays evicted until the next read
+    if version is None:
+        return
+    try:
+        post_cache.set_if_version(post_key(post_id), payload, ttl, post_version_key(post_id), version,
+                                  bump=True, version_ttl=POST_VERSION_TTL)
+    except Exception as e:
+        logger.error(f"Failed to refresh cached post {post_id}: {e}")
+
+def fetch_posts(cursor, post_ids):
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    cursor.execute(f"SELECT id, user_id, content, created_at FROM Post WHERE id IN ({placeholders})",
+                   tuple(post_ids))
+    return {post[0]: post for post in cursor.fetchall()}
+
+def get_follower_ids(cursor, user_id, limit=None):
+    query = "SELECT follower_id FROM Follow WHERE followee_id = %s"
+    params = (user_id,)
+    if limit is not None:
+        query += " LIMIT %s"
+        params += (limit,)
+    cursor.execute(query, params)
+    return [row[0] for row in cursor.fetchall()]
+
+def get_fanout_followers(cursor, user_id):
+    # Returns None for authors above the fan-out threshold, whose followers pull instead
+    followers = get_follower_ids(cursor, user_id, limit=feed.FEED_FANOUT_THRESHOLD + 1)
+    if len(followers) > feed.FEED_FANOUT_THRESHOLD:
+        return None
+    return followers
+
+def publish_to_feeds(cursor, posts):
+    # Followers are looked up once per author, however many of their posts are in the batch
+    followers_by_author = {}
+    for post_id, user_id, _, created_at in posts:
+        try:
+            if user_id not in followers_by_author:
+                followers_by_author[user_id] = get_fanout_followers(cursor, user_id)
+            followers = followers_by_author[user_id]
+            score = created_at.timestamp()
+            if followers is None:
+                feed.record_author_post(redis_client, user_id, post_id, score)
+                author_posts.invalidate(user_id)
+                followers = []
+            feed.fan_out(redis_client, post_id, score, [user_id] + followers)
+        except Exception as e:
+            logger.error(f"Failed to fan out post {post_id}: {e}")
+
+def after_posts_created(cursor, posts):
+    """Run once new posts are committed; ``posts`` are (id, user_id, content, created_at) rows."""
+    cache_new_posts(posts)
+    index_posts(posts)
+    record_trending(posts)
+    publish_to_feeds(cursor, posts)
+
+def get_feed_recipients(cursor, post_id):
+    # Looked up before the post row is deleted, while its author is still known
+    try:
+        cursor.execute("SELECT user_id FROM Post WHERE id = %s", (post_id,))
+        post = cursor.fetchone()
+        if post is None:
+            return None, []
+        author_id = post[0]
+        return author_id, [author_id] + (get_fanout_followers(cursor, author_id) or [])
+    except Exception as e:
+        logger.error(f"Failed to look up feed recipients of post {post_id}: {e}")
+        return None, []
+
+def retract_from_feeds(post_id, author_id, recipients):
+    try:
+        feed.remove_from_timelines(redis_client, [post_id], recipients)
+        if author_id is not None:
+            feed.remove_author_post(redis_client, author_id, post_id)
+            author_posts.invalidate(author_id)
+    except Exception as e:
+        logger.error(f"Failed to remove post {post_id} from feeds: {e}")
+
+def next_page_cursor(rows, limit):
+    # Rows are fetched with LIMIT limit + 1; the extra row only signals another page
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return encode_cursor(last[3].timestamp(), last[0])
+
+def get_followed_celebrities(cursor, user_id):
+    celebrities = author_posts.celebrities()
+    if not celebrities:
+        return []
+    placeholders = ', '.join(['%s'] * len(celebrities))
+    cursor.execute(f"SELECT followee_id FROM Follow WHERE follower_id = %s AND followee_id IN ({placeholders})",
+                   (user_id, *celebrities))
+    return [row[0] for row in cursor.fetchall()]
+
+def fetch_ranking_candidates(cursor, post_ids):
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    # The epoch copy of created_at saves converting thousands of datetimes in Python
+    cursor.execute("SELECT id, user_id, content, created_at, like_count, comment_count, share_count, "
+                   f"UNIX_TIMESTAMP(created_at) FROM Post WHERE id IN ({placeholders})", tuple(post_ids))
+    return cursor.fetchall()
+
+def affinity_key(user_id):
+    return f"affinity:{user_id}"
+
+def get_interaction_counts(cursor, user_id):
+    # {author_id: interactions}; the '_' field marks a cached reader with no interactions
+    key = affinity_key(user_id)
+    try:
+        cached = redis_client.hgetall(key)
+        if cached:
+            return {int(author_id): int(count) for author_id, count in cached.items() if author_id != b'_'}
+    except Exception as e:
+        logger.error(f"Failed to read cached affinity of user {user_id}: {e}")
+
+    recent = "(SELECT post_id FROM {} WHERE user_id = %s ORDER BY id DESC LIMIT %s)"
+    cursor.execute("SELECT p.user_id, COUNT(*) FROM (" +
+                   " UNION ALL ".join(recent.format(table) for table in ('`Like`', 'Comment', 'Share')) +
+                   ") i JOIN Post p ON p.id = i.post_id GROUP BY p.user_id",
+                   (user_id, AFFINITY_HISTORY) * 3)
+    counts = {author_id: count for author_id, count in cursor.fetchall()}
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={'_': 0, **counts})
+        pipe.expire(key, AFFINITY_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to cache affinity of user {user_id}: {e}")
+    return counts
+
+def get_mutual_followers(cursor, user_id, author_ids):
+    if not author_ids:
+        return set()
+    placeholders = ', '.join(['%s'] * len(author_ids))
+    cursor.execute(f"SELECT follower_id FROM Follow WHERE followee_id = %s AND follower_id IN ({placeholders})",
+                   (user_id, *author_ids))
+    return {row[0] for row in cursor.fetchall()}
+
+def get_ranked_feed(user_id):
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    as_of, before = int(datetime.now().timestamp()), None
+    if request.args.get('cursor'):
+        try:
+            as_of, *before = decode_rank_cursor(request.args['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        timeline = feed.read_timeline(redis_client, user_id, RANKING_CANDIDATES)
+        pulled = author_posts.get_many(get_followed_celebrities(cursor, user_id))
+        entries = feed.merge_timelines([timeline, *pulled.values()], RANKING_CANDIDATES)
+        rows = fetch_ranking_candidates(cursor, [post_id for _, post_id in entries]) if entries else []
+        authors = [row[1] for row in rows]
+        interactions = get_interaction_counts(cursor, user_id) if rows else {}
+        mutual = get_mutual_followers(cursor, user_id, set(authors) - {user_id})
+        cursor.close()
+    except Exception as e:
+        logger.error(f"Error reading ranked feed for user {user_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+    columns = list(zip(*rows)) or [()] * 8
+    candidates = ranking.Candidates(
+        post_ids=columns[0],
+        created_at=columns[7],
+        likes=columns[4],
+        comments=columns[5],
+        shares=columns[6],
+        affinity=ranking.author_affinity(columns[1], interactions, mutual)
+    )
+    ranked = ranking.rank(candidates, as_of, limit + 1, before)
+    posts = {row[0]: row for row in rows}
+    return jsonify({
+        'posts': [serialize_post(posts[post_id]) for _, post_id in ranked[:limit]],
+        'next_cursor': encode_rank_cursor(as_of, *ranked[limit - 1]) if len(ranked) > limit else None
+    }), 200
+
+group_commit = None
+if GROUP_COMMIT_WINDOW:
+    group_commit = GroupCommitter(
+        get_db_connection,
+        ADD_POST_QUERY,
+        window=GROUP_COMMIT_WINDOW,
+        max_batch=GROUP_COMMIT_MAX_BATCH,
+        before_commit=lambda cursor, rows: tags.link_tags(
+            cursor, {post_id: params[1] for post_id, params in rows}),
+        on_commit=lambda cursor, rows: after_posts_created(
+            cursor, [(post_id, *params) for post_id, params in rows])
+    )
+
 @app.route('/post', methods=['POST'])
 def add_post():
     logger.info("Received request to add post")
+    cnx = None
     try:
         data = request.get_json()
         user_id = data['user_id']
         content = data['content']
+        created_at = datetime.now().replace(microsecond=0)
+
+        if group_commit is not None:
+            try:
+                post_id = group_commit.submit((user_id, content, created_at))
+            except CommitTimeout as e:
+                logger.warning(f"Adding post timed out: {e}")
+                if e.written is False:
+                    return jsonify({'error': 'Post service is busy, try again'}), 503
+                # The insert is in flight and may still commit; a blind retry could add the post twice
+                return jsonify({'message': 'Post submitted but not confirmed; check for it before retrying'}), 202
+            logger.info(f"Post added successfully with id: {post_id}")
+            return jsonify({"id": post_id, 'message': 'Post added successfully'}), 201
                 
         cnx = get_db_connection()
         if cnx is None:
@@ -47,21 +440,74 @@ def add_post():
         
         cursor = cnx.cursor()
         
-        add_post_query = ("INSERT INTO Post (user_id, content) "
-                          "VALUES (%s, %s)")
-        cursor.execute(add_post_query, (user_id, content))
+        cursor.execute(ADD_POST_QUERY, (user_id, content, created_at))
         
         post_id = cursor.lastrowid
+        tags.link_tags(cursor, {post_id: content})
         
         cnx.commit()
+        after_posts_created(cursor, [(post_id, user_id, content, created_at)])
         cursor.close()
-        cnx.close()
         
         logger.info(f"Post added successfully with id: {post_id}")
         return jsonify({"id": post_id, 'message': 'Post added successfully'}), 201
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        if cnx:
+            cnx.close()
+
+def validate_batch(posts):
+    if not isinstance(posts, list) or not posts:
+        return [{'error': "Expected a non-empty 'posts' list"}]
+    if len(posts) > MAX_BATCH_SIZE:
+        return [{'error': f"At most {MAX_BATCH_SIZE} posts can be added per batch"}]
+    errors = []
+    for index, post in enumerate(posts):
+        if not isinstance(post, dict):
+            errors.append({'index': index, 'error': 'Post must be an object'})
+        elif not isinstance(post.get('user_id'), int) or isinstance(post.get('user_id'), bool):
+            errors.append({'index': index, 'error': "'user_id' must be an integer"})
+        elif not isinstance(post.get('content'), str) or not post['content'].strip():
+            errors.append({'index': index, 'error': "'content' must be a non-empty string"})
+    return errors
+
+@app.route('/post/batch', methods=['POST'])
+def add_posts_batch():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'errors': [{'error': "Expected a JSON object with a 'posts' list"}]}), 400
+    posts = data.get('posts')
+    errors = validate_batch(posts)
+    if errors:
+        return jsonify({'errors': errors}), 400
+    logger.info(f"Received request to add {len(posts)} posts")
+
+    created_at = datetime.now().replace(microsecond=0)
+    rows = [(post['user_id'], post['content'], created_at) for post in posts]
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        post_ids = insert_many(cursor, ADD_POST_QUERY, rows)
+        tags.link_tags(cursor, {post_id: row[1] for post_id, row in zip(post_ids, rows)})
+        cnx.commit()
+        after_posts_created(cursor, [(post_id, *row) for post_id, row in zip(post_ids, rows)])
+        cursor.close()
+        return jsonify({'ids': post_ids, 'message': 'Posts added successfully'}), 201
+    except mysql.connector.IntegrityError as e:
+        cnx.rollback()
+        logger.error(f"Rejected post batch: {e}")
+        return jsonify({'error': 'Batch references an unknown user'}), 400
+    except Exception as e:
+        cnx.rollback()
+        logger.error(f"Error adding post batch: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
 
 @app.route('/post/<int:post_id>', methods=['PUT'])
 def update_post(post_id):
@@ -78,10 +524,20 @@ def update_post(post_id):
     try:
         update_post_query = "UPDATE Post SET content = %s WHERE id = %s"
         cursor.execute(update_post_query, (content, post_id))
-        cnx.commit()
-        
         if cursor.rowcount == 0:
+            cnx.rollback()
             return jsonify({'error': 'Post not found'}), 404
+        tags.relink_tags(cursor, post_id, content)
+        version = start_post_write(post_id)
+        cnx.commit()
+
+        try:
+            post = fetch_posts(cursor, [post_id]).get(post_id)
+            if post:
+                finish_post_write(post_id, encode_post(post), POST_CACHE_TTL, version)
+                index_posts([post])
+        except Exception as e:
+            logger.error(f"Failed to refresh cached post {post_id}: {e}")
         
         logger.info("Post updated successfully")
         return jsonify({'message': 'Post updated successfully'}), 200
@@ -102,12 +558,19 @@ def delete_post(post_id):
 
     try:
         cursor = cnx.cursor()
+        author_id, recipients = get_feed_recipients(cursor, post_id)
+        # PostTag rows go with the post through ON DELETE CASCADE
         cursor.execute("DELETE FROM Post WHERE id = %s", (post_id,))
+        version = start_post_write(post_id)
         cnx.commit()
         
         if cursor.rowcount == 0:
             return jsonify({'error': 'Post not found'}), 404
         
+        retract_from_feeds(post_id, author_id, recipients)
+        finish_post_write(post_id, POST_NOT_FOUND, POST_NEGATIVE_CACHE_TTL, version)
+        unindex_post(post_id)
+        
         logger.info("Post deleted successfully")
         return jsonify({'message': 'Post deleted successfully'}), 200
     except Exception as e:
@@ -120,23 +583,288 @@ def delete_post(post_id):
 
 @app.route('/post/<int:post_id>', methods=['GET'])
 def get_post(post_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Cache hits, including cached misses, never touch the database
+    payload, version = get_cached_post(post_id)
+    if payload is None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id, user_id, content, created_at FROM Post WHERE id = %s", (post_id,))
+            post = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        payload = encode_post(post) if post else POST_NOT_FOUND
+        fill_post_cache(post_id, payload, version)
+
+    if payload != POST_NOT_FOUND:
+        return Response(payload, mimetype='application/json')
+    else:
+        return jsonify({'message': 'Post not found'}), 404
+
+@app.route('/post/user/<int:user_id>', methods=['GET'])
+def get_user_posts(user_id):
     try:
-        cursor.execute("SELECT * FROM Post WHERE id = %s", (post_id,))
-        post = cursor.fetchone()
-        if post:
-            return jsonify({
-                'id': post[0],
-                'user_id': post[1],
-                'content': post[2],
-                'created_at': post[3].strftime('%Y-%m-%d %H:%M:%S')
-            }), 200
-        else:
-            return jsonify({'message': 'Post not found'}), 404
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        condition, params = keyset_condition(before)
+        cursor.execute("SELECT id, user_id, content, created_at FROM Post WHERE user_id = %s" + condition +
+                       " ORDER BY created_at DESC, id DESC LIMIT %s", (user_id, *params, limit + 1))
+        posts = cursor.fetchall()
+        cursor.close()
+        return jsonify({
+            'posts': [serialize_post(post) for post in posts[:limit]],
+            'next_cursor': next_page_cursor(posts, limit)
+        }), 200
+    except Exception as e:
+        logger.error(f"Error listing posts of user {user_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
     finally:
+        cnx.close()
+
+@app.route('/post/search', methods=['GET'])
+def search_posts():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': "'q' is required"}), 400
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    as_of, before = int(datetime.now().timestamp()), None
+    if request.args.get('cursor'):
+        try:
+            as_of, *before = decode_rank_cursor(request.args['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    search_index.ensure_reconciled()
+    ranked = search_index.search(query, limit + 1, before=before, now=as_of)
+    page = ranked[:limit]
+    posts = {}
+    if page:
+        cnx = get_db_connection()
+        if cnx is None:
+            return jsonify({'error': 'Database connection failed'}), 500
+        try:
+            cursor = cnx.cursor()
+            for _ in range(SEARCH_TOP_UP_ATTEMPTS):
+                wanted = [post_id for _, post_id in page if post_id not in posts]
+                posts.update(fetch_posts(cursor, wanted))
+                missing = [post_id for post_id in wanted if post_id not in posts]
+                if not missing:
+                    break
+                # Deleted before the index heard of it; drop it and fill the page from the next results
+                for post_id in missing:
+                    search_index.remove(post_id)
+                ranked = search_index.search(query, limit + 1, before=before, now=as_of)
+                page = ranked[:limit]
+            cursor.close()
+        except Exception as e:
+            logger.error(f"Error loading search results for {query!r}: {e}")
+            return jsonify({'error': 'Internal Server Error'}), 500
+        finally:
+            cnx.close()
+
+    return jsonify({
+        'posts': [serialize_post(posts[post_id]) for _, post_id in page if post_id in posts],
+        'next_cursor': encode_rank_cursor(as_of, *page[-1]) if len(ranked) > limit else None
+    }), 200
+
+@app.route('/post/tag/<name>', methods=['GET'])
+def get_tag_posts(name):
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        condition, params = keyset_condition(before, 'pt.created_at', 'pt.post_id')
+        cursor.execute("SELECT p.id, p.user_id, p.content, p.created_at FROM PostTag pt "
+                       "JOIN Post p ON p.id = pt.post_id "
+                       "WHERE pt.tag_id = (SELECT id FROM Tag WHERE name = %s)" + condition +
+                       " ORDER BY pt.created_at DESC, pt.post_id DESC LIMIT %s",
+                       (tags.normalize_tag(name), *params, limit + 1))
+        posts = cursor.fetchall()
+        cursor.close()
+        return jsonify({
+            'posts': [serialize_post(post) for post in posts[:limit]],
+            'next_cursor': next_page_cursor(posts, limit)
+        }), 200
+    except Exception as e:
+        logger.error(f"Error listing posts tagged {name}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/trending', methods=['GET'])
+def get_trending():
+    window = request.args.get('window', DEFAULT_TRENDING_WINDOW)
+    if window not in TRENDING_WINDOWS:
+        return jsonify({'error': f"window must be one of {', '.join(TRENDING_WINDOWS)}"}), 400
+    limit = max(1, min(request.args.get('limit', DEFAULT_TRENDING_LIMIT, type=int), MAX_TRENDING_LIMIT))
+    return jsonify({
+        'window': window,
+        'tags': [{'tag': tag, 'count': count} for tag, count in trending_tags.top(window, limit)]
+    }), 200
+
+@app.route('/post/<int:post_id>/comments', methods=['GET'])
+def get_post_comments(post_id):
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        condition, params = keyset_condition(before)
+        cursor.execute("SELECT id, user_id, content, created_at FROM Comment WHERE post_id = %s" + condition +
+                       " ORDER BY created_at DESC, id DESC LIMIT %s", (post_id, *params, limit + 1))
+        comments = cursor.fetchall()
         cursor.close()
-        conn.close()
+        return jsonify({
+            'comments': [{
+                'id': comment[0],
+                'post_id': post_id,
+                'user_id': comment[1],
+                'content': comment[2],
+                'created_at': comment[3].strftime('%Y-%m-%d %H:%M:%S')
+            } for comment in comments[:limit]],
+            'next_cursor': next_page_cursor(comments, limit)
+        }), 200
+    except Exception as e:
+        logger.error(f"Error listing comments of post {post_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/feed/<int:user_id>', methods=['GET'])
+def get_feed(user_id):
+    ranking_mode = request.args.get('ranking')
+    if ranking_mode == 'engagement':
+        return get_ranked_feed(user_id)
+    if ranking_mode is not None:
+        return jsonify({'error': "ranking must be 'engagement'"}), 400
+
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        timeline = feed.read_timeline(redis_client, user_id, limit, before)
+        pulled = author_posts.get_many(get_followed_celebrities(cursor, user_id))
+        entries = feed.merge_timelines([timeline, *pulled.values()], limit, before)
+        posts = fetch_posts(cursor, [post_id for _, post_id in entries]) if entries else {}
+        cursor.close()
+
+        # Drop ids whose posts were deleted before their fan-out removal landed
+        stale = [post_id for _, post_id in entries if post_id not in posts]
+        if stale:
+            feed.remove_from_timelines(redis_client, stale, [user_id])
+    except Exception as e:
+        logger.error(f"Error reading feed for user {user_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+    next_cursor = encode_cursor(*entries[-1]) if len(entries) == limit else None
+    return jsonify({
+        'posts': [serialize_post(posts[post_id]) for _, post_id in entries if post_id in posts],
+        'next_cursor': next_cursor
+    }), 200
+
+@app.route('/follow', methods=['POST'])
+def follow():
+    data = request.get_json()
+    follower_id = data['follower_id']
+    followee_id = data['followee_id']
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("INSERT IGNORE INTO Follow (follower_id, followee_id) VALUES (%s, %s)",
+                       (follower_id, followee_id))
+        cnx.commit()
+        # Posts of high-follower authors are pulled at read time, so there is nothing to backfill
+        if followee_id not in author_posts.celebrities():
+            cursor.execute("SELECT id, created_at FROM Post WHERE user_id = %s ORDER BY created_at DESC LIMIT %s",
+                           (followee_id, feed.FEED_MAX_LENGTH))
+            recent = [(post_id, created_at.timestamp()) for post_id, created_at in cursor.fetchall()]
+            feed.backfill(redis_client, follower_id, recent)
+        cursor.close()
+        return jsonify({'message': 'Followed successfully'}), 201
+    except Exception as e:
+        logger.error(f"Error following user {followee_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.route('/follow', methods=['DELETE'])
+def unfollow():
+    data = request.get_json()
+    follower_id = data['follower_id']
+    followee_id = data['followee_id']
+
+    cnx = get_db_connection()
+    if cnx is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("DELETE FROM Follow WHERE follower_id = %s AND followee_id = %s",
+                       (follower_id, followee_id))
+        cnx.commit()
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Follow not found'}), 404
+        # Any of the followee's posts still on the timeline are among their newest FEED_MAX_LENGTH
+        cursor.execute("SELECT id FROM Post WHERE user_id = %s ORDER BY created_at DESC LIMIT %s",
+                       (followee_id, feed.FEED_MAX_LENGTH))
+        post_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        feed.remove_from_timelines(redis_client, post_ids, [follower_id])
+        return jsonify({'message': 'Unfollowed successfully'}), 200
+    except Exception as e:
+        logger.error(f"Error unfollowing user {followee_id}: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+    finally:
+        cnx.close()
+
+@app.before_request
+def begin_trace():
+    # Continues the trace the gateway passed on
+    start_trace(request.headers.get(TRACEPARENT))
+
+# Registered after begin_trace so profiles carry the trace id
+profiler.install(app)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/health')
+def health_check():
+    return jsonify({"status": "healthy"}), 200
+
+@app.route('/health/db')
+def db_pool_stats():
+    return jsonify({"pool": db_pool.stats()}), 200
 
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""Home timelines kept as capped Redis sorted sets of post ids scored by created_at.
+
+Authors with more than FEED_FANOUT_THRESHOLD followers are not fanned out.
+Their posts go to a short per-author list instead, which readers pull and
+merge with their own timeline at read time.
+
+Timeline entries are (score, post_id) tuples ordered newest first.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+FEED_MAX_LENGTH = 800
+FANOUT_BATCH_SIZE = 1000
+FEED_FANOUT_THRESHOLD = 10000
+AUTHOR_RECENT_LENGTH = 200
+AUTHOR_CACHE_TTL = 5
+AUTHOR_CACHE_SIZE = 10000
+
+CELEBRITIES_KEY = "feed:celebrities"
+
+
+def timeline_key(user_id):
+    return f"feed:{user_id}"
+
+
+def author_posts_key(user_id):
+    return f"author_posts:{user_id}"
+
+
+def fan_out(redis_client, post_id, score, recipient_ids):
+    """Push a post onto each recipient's timeline, trimming to FEED_MAX_LENGTH."""
+    pipe = redis_client.pipeline(transaction=False)
+    for i, recipient_id in enumerate(recipient_ids, 1):
+        key = timeline_key(recipient_id)
+        pipe.zadd(key, {post_id: score})
+        pipe.zremrangebyrank(key, 0, -FEED_MAX_LENGTH - 1)
+        if i % FANOUT_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def remove_from_timelines(redis_client, post_ids, recipient_ids):
+    if not post_ids:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for i, recipient_id in enumerate(recipient_ids, 1):
+        pipe.zrem(timeline_key(recipient_id), *post_ids)
+        if i % FANOUT_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def backfill(redis_client, user_id, scored_posts):
+    """Merge (post_id, score) pairs into one user's timeline, e.g. after a follow."""
+    if not scored_posts:
+        return
+    key = timeline_key(user_id)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(key, dict(scored_posts))
+    pipe.zremrangebyrank(key, 0, -FEED_MAX_LENGTH - 1)
+    pipe.execute()
+
+
+def record_author_post(redis_client, author_id, post_id, score):
+    """Keep a post of a high-follower author for readers to pull."""
+    key = author_posts_key(author_id)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(key, {post_id: score})
+    pipe.zremrangebyrank(key, 0, -AUTHOR_RECENT_LENGTH - 1)
+    pipe.sadd(CELEBRITIES_KEY, author_id)
+    pipe.execute()
+
+
+def remove_author_post(redis_client, author_id, post_id):
+    redis_client.zrem(author_posts_key(author_id), post_id)
+
+
+def read_timeline(redis_client, user_id, limit, before=None):
+    """Return up to ``limit`` timeline entries older than the ``before`` entry."""
+    key = timeline_key(user_id)
+    max_score = '+inf' if before is None else before[0]
+    page = set()
+    while True:
+        entries = redis_client.zrevrangebyscore(key, max_score, '-inf', start=0, num=limit, withscores=True)
+        if not entries:
+            break
+        exhausted = len(entries) < limit
+        # Redis orders equal scores lexicographically, so pull in the whole tie group at the boundary
+        last_score = entries[-1][1]
+        entries += redis_client.zrangebyscore(key, last_score, last_score, withscores=True)
+        for post_id, score in entries:
+            entry = (score, int(post_id))
+            if before is None or entry < before:
+                page.add(entry)
+        if exhausted or len(page) >= limit:
+            break
+        max_score = f"({last_score}"
+    return sorted(page, reverse=True)[:limit]
+
+
+def _entries_before(entries, before, limit):
+    if before is None:
+        return entries[:limit]
+    start = bisect_right(entries, (-before[0], -before[1]), key=lambda entry: (-entry[0], -entry[1]))
+    return entries[start:start + limit]
+
+
+def merge_timelines(sources, limit, before=None):
+    """K-way merge of newest-first entry lists into one page of at most ``limit`` entries.
+
+    Each source contributes at most ``limit`` entries, so the cost is bounded
+    by the page size and the number of sources rather than their lengths.
+    """
+    candidates = [_entries_before(source, before, limit) for source in sources]
+    page = []
+    seen = set()
+    for entry in heapq.merge(*candidates, reverse=True):
+        if entry[1] in seen:
+            continue
+        seen.add(entry[1])
+        page.append(entry)
+        if len(page) == limit:
+            break
+    return page
+
+
+class AuthorPostsCache:
+    """Per-process TTL cache of the celebrity set and per-author recent post lists."""
+
+    def __init__(self, redis_client, ttl=AUTHOR_CACHE_TTL, max_authors=AUTHOR_CACHE_SIZE):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_authors = max_authors
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._celebrities = (0, frozenset())
+
+    def celebrities(self):
+        expires_at, members = self._celebrities
+        if time.monotonic() >= expires_at:
+            members = frozenset(int(member) for member in self.redis_client.smembers(CELEBRITIES_KEY))
+            self._celebrities = (time.monotonic() + self.ttl, members)
+        return members
+
+    def get_many(self, author_ids):
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for author_id in author_ids:
+                cached = self._entries.get(author_id)
+                if cached and cached[0] > now:
+                    self._entries.move_to_end(author_id)
+                    found[author_id] = cached[1]
+                else:
+                    missing.append(author_id)
+
+        if missing:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for author_id in missing:
+                pipe.zrevrange(author_posts_key(author_id), 0, AUTHOR_RECENT_LENGTH - 1, withscores=True)
+            results = pipe.execute()
+            with self._lock:
+                for author_id, entries in zip(missing, results):
+                    entries = sorted(((score, int(post_id)) for post_id, score in entries), reverse=True)
+                    found[author_id] = entries
+                    self._entries[author_id] = (now + self.ttl, entries)
+                    self._entries.move_to_end(author_id)
+                while len(self._entries) > self.max_authors:
+                    self._entries.popitem(last=False)
+        return found
+
+    def invalidate(self, author_id):
+        with self._lock:
+            self._entries.pop(author_id, None)
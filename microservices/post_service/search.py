@@ -0,0 +1,598 @@
+"""In-process full-text index over post content, ranked by BM25 with a recency boost.
+
+Postings live in segments. New and edited posts go to a mutable in-memory
+segment. A snapshot merges every segment into one file that is then read
+through mmap, so a restart maps the last snapshot instead of rebuilding
+the index on the heap. Edits and deletes mark the old copy of a post dead
+in older segments rather than rewriting them.
+
+The index is per process. Each process indexes its own writes and
+publishes the ids of the posts it changed on a Redis channel. The others
+re-read those posts from MySQL through the ``refresh`` callback, so every
+index ends up with the latest committed version whatever order the
+messages arrive in. Updates published while a process is not subscribed
+are lost, so each time the subscription is established the index is
+reconciled with MySQL through the ``reconcile`` callback. It compares a
+CRC32 fingerprint of each post's content with the indexed copy, and
+reindexes or drops whatever differs.
+
+With several workers, the first to take the snapshot's lock file writes
+the snapshot. The others map it again whenever it changes, dropping from
+their heap every post it already holds in the same version.
+"""
+import bisect
+import fcntl
+import heapq
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 40
+
+# Ranking configuration
+BM25_K1 = 1.2
+BM25_B = 0.75
+RECENCY_WEIGHT = 0.5  # a post created now scores up to 1.5x an old post with the same text relevance
+RECENCY_HALF_LIFE = 7 * 24 * 3600
+RANK_SCALE = 1000000  # ranks are integers so cursors can carry them exactly
+
+# Snapshot layout: header, then doc ids, lengths, creation times and
+# content fingerprints, term and posting offsets, posting doc indexes and term frequencies,
+# and finally the UTF-8 terms in sorted order.
+_MAGIC = b'PSX2'
+_HEADER = struct.Struct('<4sIIIQ')  # magic, docs, terms, postings, total doc length
+_MAX_TF = 65535
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall((text or '').lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def fingerprint(text):
+    """CRC32 of the UTF-8 text, the value MySQL's CRC32() gives for a utf8mb4 column."""
+    return zlib.crc32((text or '').encode())
+
+
+class _MemorySegment:
+    """Appendable postings; re-adding a post supersedes its earlier copy in the same segment."""
+
+    def __init__(self):
+        self.dead = set()
+        self.slot_docs = array('I')
+        self.slot_lengths = array('I')
+        self.slot_times = array('I')
+        self.slot_fingerprints = array('I')
+        self.current = {}  # post id -> slot of its latest copy
+        self.terms = {}  # term -> (slots, term frequencies)
+
+    def add(self, doc_id, tokens, created_at, fingerprint):
+        slot = len(self.slot_docs)
+        self.slot_docs.append(doc_id)
+        self.slot_lengths.append(len(tokens))
+        self.slot_times.append(int(created_at))
+        self.slot_fingerprints.append(fingerprint)
+        for term, tf in Counter(tokens).items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = (array('I'), array('H'))
+            postings[0].append(slot)
+            postings[1].append(min(tf, _MAX_TF))
+        self.current[doc_id] = slot
+
+    def discard(self, doc_id):
+        slot = self.current.pop(doc_id, None)
+        return None if slot is None else self.slot_lengths[slot]
+
+    def doc_length(self, doc_id):
+        slot = self.current.get(doc_id)
+        return None if slot is None else self.slot_lengths[slot]
+
+    def fingerprint(self, doc_id):
+        slot = self.current.get(doc_id)
+        return None if slot is None else self.slot_fingerprints[slot]
+
+    def compacted(self, doc_ids):
+        """A new segment holding only the latest copies of ``doc_ids``."""
+        segment = _MemorySegment()
+        slots = {}
+        for doc_id in doc_ids:
+            slot = self.current[doc_id]
+            slots[slot] = segment.current[doc_id] = len(segment.slot_docs)
+            segment.slot_docs.append(doc_id)
+            segment.slot_lengths.append(self.slot_lengths[slot])
+            segment.slot_times.append(self.slot_times[slot])
+            segment.slot_fingerprints.append(self.slot_fingerprints[slot])
+        for term, (term_slots, tfs) in self.terms.items():
+            for slot, tf in zip(term_slots, tfs):
+                new_slot = slots.get(slot)
+                if new_slot is not None:
+                    postings = segment.terms.get(term)
+                    if postings is None:
+                        postings = segment.terms[term] = (array('I'), array('H'))
+                    postings[0].append(new_slot)
+                    postings[1].append(tf)
+        return segment
+
+    def postings(self, term):
+        postings = self.terms.get(term)
+        if postings is None:
+            return
+        for slot, tf in zip(*postings):
+            doc_id = self.slot_docs[slot]
+            if self.current.get(doc_id) == slot and doc_id not in self.dead:
+                yield doc_id, tf, self.slot_lengths[slot], self.slot_times[slot]
+
+    def docs(self):
+        for doc_id, slot in self.current.items():
+            if doc_id not in self.dead:
+                yield doc_id, self.slot_lengths[slot], self.slot_times[slot], self.slot_fingerprints[slot]
+
+    def sorted_terms(self):
+        # Code point order matches the byte order of the UTF-8 terms in a snapshot
+        return sorted(self.terms)
+
+    def nbytes(self):
+        arrays = [self.slot_docs, self.slot_lengths, self.slot_times, self.slot_fingerprints]
+        arrays.extend(a for postings in self.terms.values() for a in postings)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+class _MappedSegment:
+    """Read-only postings served straight from a memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, n_docs, n_terms, n_postings, self.total_length = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a search snapshot")
+        offset = _HEADER.size
+
+        def section(count, fmt):
+            nonlocal offset
+            size = count * struct.calcsize(fmt)
+            values = view[offset:offset + size].cast(fmt)
+            offset += size
+            return values
+
+        self.doc_ids = section(n_docs, 'I')
+        self.doc_lengths = section(n_docs, 'I')
+        self.doc_times = section(n_docs, 'I')
+        self.doc_fingerprints = section(n_docs, 'I')
+        self.term_offsets = section(n_terms + 1, 'I')
+        self.posting_offsets = section(n_terms + 1, 'I')
+        self.posting_docs = section(n_postings, 'I')
+        self.posting_tfs = section(n_postings, 'H')
+        self.term_blob = view[offset:]
+        self.size = len(self._mmap)
+        self.dead = set()
+
+    def _term(self, i):
+        return self.term_blob[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes()
+
+    def _find(self, term):
+        key = term.encode()
+        lo, hi = 0, len(self.term_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.term_offsets) - 1 and self._term(lo) == key:
+            return lo
+        return None
+
+    def _doc_index(self, doc_id):
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            return i
+        return None
+
+    def doc_length(self, doc_id):
+        i = self._doc_index(doc_id)
+        return None if i is None else self.doc_lengths[i]
+
+    def fingerprint(self, doc_id):
+        i = self._doc_index(doc_id)
+        return None if i is None else self.doc_fingerprints[i]
+
+    def postings(self, term):
+        i = self._find(term)
+        if i is None:
+            return
+        start, end = self.posting_offsets[i], self.posting_offsets[i + 1]
+        for index, tf in zip(self.posting_docs[start:end], self.posting_tfs[start:end]):
+            doc_id = self.doc_ids[index]
+            if doc_id not in self.dead:
+                yield doc_id, tf, self.doc_lengths[index], self.doc_times[index]
+
+    def docs(self):
+        for doc in zip(self.doc_ids, self.doc_lengths, self.doc_times, self.doc_fingerprints):
+            if doc[0] not in self.dead:
+                yield doc
+
+    def sorted_terms(self):
+        for i in range(len(self.term_offsets) - 1):
+            yield self._term(i).decode()
+
+
+def write_snapshot(path, segments):
+    """Merge the live postings of ``segments`` into a snapshot file, replacing ``path`` atomically."""
+    docs = {}
+    for segment in segments:
+        for doc_id, length, created_at, fingerprint in segment.docs():
+            docs[doc_id] = (length, created_at, fingerprint)
+    doc_ids = array('I', sorted(docs))
+    doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    term_blob = bytearray()
+    term_offsets, posting_offsets = array('I', [0]), array('I', [0])
+    posting_docs, posting_tfs = array('I'), array('H')
+    previous = None
+    for term in heapq.merge(*(segment.sorted_terms() for segment in segments)):
+        if term == previous:
+            continue
+        previous = term
+        for segment in segments:
+            for doc_id, tf, _, _ in segment.postings(term):
+                posting_docs.append(doc_index[doc_id])
+                posting_tfs.append(tf)
+        if len(posting_docs) == posting_offsets[-1]:
+            continue  # every post with this term is gone
+        term_blob += term.encode()
+        term_offsets.append(len(term_blob))
+        posting_offsets.append(len(posting_docs))
+
+    lengths = array('I', (docs[doc_id][0] for doc_id in doc_ids))
+    times = array('I', (docs[doc_id][1] for doc_id in doc_ids))
+    fingerprints = array('I', (docs[doc_id][2] for doc_id in doc_ids))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(doc_ids), len(term_offsets) - 1, len(posting_docs), sum(lengths)))
+        for values in (doc_ids, lengths, times, fingerprints, term_offsets, posting_offsets, posting_docs, posting_tfs):
+            values.tofile(f)
+        f.write(term_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SearchIndex:
+    """Incrementally maintained inverted index over posts.
+
+    Writes take a short lock. Searches read the segments without it, since
+    segments only ever gain postings and dead ids while they are in use.
+
+    ``refresh(index, doc_ids)`` reindexes the given posts from MySQL, or
+    removes those that no longer exist. ``reconcile(index)`` does the same
+    for every post whose fingerprint differs from the indexed one. Without a
+    Redis client the index sees only this process's writes.
+    """
+
+    def __init__(self, snapshot_path=None, snapshot_interval=300, reconcile=None, refresh=None,
+                 redis_client=None, channel=None, retry_interval=1):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.redis = redis_client
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self.instance_id = uuid.uuid4().hex
+        self._reconcile = reconcile
+        self._refresh = refresh
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._segments = []
+        self._live = _MemorySegment()
+        self._removed = set()  # ids removed since the snapshot was last mapped
+        self._doc_count = 0
+        self._total_length = 0
+        self._dirty = False
+        self._snapshot_thread = None
+        self._snapshot_lock = None  # lock file held while this process owns the snapshot
+        self._snapshot_version = None  # (inode, mtime) of the mapped snapshot
+        self._subscriber = None
+        self._reconcile_thread = None
+        self._reconcile_pending = False
+        self._reconciled = False
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self._map_snapshot()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable search snapshot {snapshot_path}: {e}")
+
+    def _map_snapshot(self):
+        version = _file_version(self.snapshot_path)
+        segment = _MappedSegment(self.snapshot_path)
+        self._segments = [segment]
+        self._doc_count = len(segment.doc_ids)
+        self._total_length = segment.total_length
+        self._snapshot_version = version
+
+    def add(self, doc_id, text, created_at):
+        """Index a post, replacing any earlier copy of it; ``created_at`` is in epoch seconds."""
+        tokens = tokenize(text)
+        with self._lock:
+            self._discard(doc_id)
+            self._live.add(doc_id, tokens, created_at, fingerprint(text))
+            self._doc_count += 1
+            self._total_length += len(tokens)
+            self._dirty = True
+        self._ensure_snapshots()
+
+    def fingerprint(self, doc_id):
+        """Content fingerprint of the indexed copy of a post, or None if it is not indexed."""
+        with self._lock:
+            value = self._live.fingerprint(doc_id)
+            if value is not None:
+                return value
+            for segment in self._segments:
+                if doc_id not in segment.dead:
+                    value = segment.fingerprint(doc_id)
+                    if value is not None:
+                        return value
+            return None
+
+    def doc_ids(self):
+        with self._lock:
+            segments = self._segments + [self._live]
+            return {doc[0] for segment in segments for doc in segment.docs()}
+
+    def remove(self, doc_id):
+        with self._lock:
+            if self._discard(doc_id):
+                self._dirty = True
+            if self.snapshot_path:
+                self._removed.add(doc_id)
+
+    def _discard(self, doc_id):
+        length = self._live.discard(doc_id)
+        if length is None:
+            for segment in self._segments:
+                if doc_id not in segment.dead:
+                    length = segment.doc_length(doc_id)
+                    if length is not None:
+                        segment.dead.add(doc_id)
+                        break
+        if length is None:
+            return False
+        self._doc_count -= 1
+        self._total_length -= length
+        return True
+
+    def publish(self, doc_ids):
+        """Tell the other processes on ``channel`` that these posts were written or deleted."""
+        if self.redis is None or not doc_ids:
+            return
+        self._ensure_subscriber()
+        pipe = self.redis.pipeline(transaction=False)
+        for doc_id in doc_ids:
+            pipe.publish(self.channel, f"{self.instance_id}:{doc_id}")
+        pipe.execute()
+
+    def search(self, query, limit, before=None, now=None):
+        """Return up to ``limit`` (rank, post id) pairs, best first.
+
+        ``before`` is the pair of the last result already returned; ``now``
+        is the time recency is measured from, fixed across the pages of one
+        search so ranks stay comparable.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            segments = self._segments + [self._live]
+            doc_count, total_length = self._doc_count, self._total_length
+        if not terms or doc_count <= 0:
+            return []
+        now = time.time() if now is None else now
+        avg_length = max(total_length / doc_count, 1.0)
+        length_norm = BM25_K1 * (1 - BM25_B)
+        length_weight = BM25_K1 * BM25_B / avg_length
+
+        scores, times = {}, {}
+        for term in terms:
+            postings = [posting for segment in segments for posting in segment.postings(term)]
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf, length, created_at in postings:
+                score = idf * tf * (BM25_K1 + 1) / (tf + length_norm + length_weight * length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+                times[doc_id] = created_at
+
+        ranked = ((int(score * (1 + RECENCY_WEIGHT * 0.5 ** (max(0.0, now - times[doc_id]) / RECENCY_HALF_LIFE))
+                       * RANK_SCALE), doc_id)
+                  for doc_id, score in scores.items())
+        if before is not None:
+            before = tuple(before)
+            ranked = (result for result in ranked if result < before)
+        return heapq.nlargest(limit, ranked)
+
+    def ensure_reconciled(self):
+        """Reconcile with MySQL once per process, or each time the update subscription is established."""
+        if self.redis is not None:
+            self._ensure_subscriber()
+        elif not self._reconciled:
+            self._reconciled = True
+            self.reconcile()
+
+    def reconcile(self):
+        """Reconcile with MySQL in the background; a request made while one runs queues one more run."""
+        if self._reconcile is None:
+            return
+        with self._lock:
+            self._reconcile_pending = True
+            if self._reconcile_thread is None:
+                self._reconcile_thread = threading.Thread(target=self._run_reconcile, name='search-reconcile',
+                                                          daemon=True)
+                self._reconcile_thread.start()
+
+    def _run_reconcile(self):
+        while True:
+            with self._lock:
+                if not self._reconcile_pending:
+                    self._reconcile_thread = None
+                    return
+                self._reconcile_pending = False
+            try:
+                self._reconcile(self)
+            except Exception as e:
+                logger.error(f"Search index reconcile failed: {e}")
+
+    def _ensure_subscriber(self):
+        if self._subscriber is None:
+            with self._lock:
+                if self._subscriber is None:
+                    self._subscriber = threading.Thread(target=self._listen, name=f"search-updates-{self.channel}",
+                                                        daemon=True)
+                    self._subscriber.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not listening is lost, so compare every post with MySQL
+                self.reconcile()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._on_update(message['data'])
+            except Exception as e:
+                logger.warning(f"Search index subscription to {self.channel} failed: {e}")
+            time.sleep(self.retry_interval)
+
+    def _on_update(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        sender, _, doc_id = data.partition(':')
+        if sender == self.instance_id or self._refresh is None:
+            return
+        try:
+            self._refresh(self, [int(doc_id)])
+        except Exception as e:
+            logger.error(f"Failed to refresh post {doc_id} in the search index: {e}")
+            self.reconcile()
+
+    def _owns_snapshot(self):
+        # Only one process writes the snapshot; the others would overwrite it with their own partial view
+        if self._snapshot_lock is None:
+            lock_file = open(f"{self.snapshot_path}.lock", 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._snapshot_lock = lock_file
+        return True
+
+    def _ensure_snapshots(self):
+        if self.snapshot_path and self._snapshot_thread is None:
+            with self._lock:
+                if self._snapshot_thread is None:
+                    self._snapshot_thread = threading.Thread(target=self._run_snapshots, name='search-snapshot',
+                                                             daemon=True)
+                    self._snapshot_thread.start()
+
+    def _run_snapshots(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.snapshot() or self.reload()
+            except Exception as e:
+                logger.error(f"Search index snapshot failed: {e}")
+
+    def snapshot(self):
+        """Merge all segments into a new snapshot and serve from its mapping; returns whether one was written."""
+        if not self.snapshot_path:
+            return False
+        with self._merge_lock:
+            if not self._owns_snapshot():
+                return False
+            with self._lock:
+                if not self._dirty:
+                    return False
+                sources = self._segments + [self._live]
+                dead_at_start = [set(segment.dead) for segment in sources]
+                self._segments = sources
+                self._live = _MemorySegment()
+                self._removed = set()
+                self._dirty = False
+            try:
+                write_snapshot(self.snapshot_path, sources)
+                version = _file_version(self.snapshot_path)
+                merged = _MappedSegment(self.snapshot_path)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+            with self._lock:
+                # Posts edited or deleted while the snapshot was written are dead in the merged copy too
+                for segment, dead in zip(sources, dead_at_start):
+                    merged.dead.update(segment.dead - dead)
+                self._segments = [merged] + self._segments[len(sources):]
+                self._snapshot_version = version
+            return True
+
+    def reload(self):
+        """Map the snapshot again if another process rewrote it; returns whether it was reloaded.
+
+        Posts in the heap that the new snapshot holds with the same
+        fingerprint are dropped from it, so a process that does not write
+        the snapshot keeps only what changed since the last one.
+        """
+        if not self.snapshot_path:
+            return False
+        with self._merge_lock:
+            try:
+                version = _file_version(self.snapshot_path)
+            except FileNotFoundError:
+                return False
+            if version == self._snapshot_version:
+                return False
+            mapped = _MappedSegment(self.snapshot_path)
+            with self._lock:
+                live = self._live.compacted([doc_id for doc_id, _, _, value in self._live.docs()
+                                             if mapped.fingerprint(doc_id) != value])
+                for doc_id in self._removed.union(live.current):
+                    if mapped.doc_length(doc_id) is not None:
+                        mapped.dead.add(doc_id)
+                self._segments = [mapped]
+                self._live = live
+                self._removed = set()
+                live_lengths = [live.slot_lengths[slot] for slot in live.current.values()]
+                self._doc_count = len(mapped.doc_ids) - len(mapped.dead) + len(live_lengths)
+                self._total_length = (mapped.total_length - sum(mapped.doc_length(doc_id) for doc_id in mapped.dead)
+                                      + sum(live_lengths))
+                self._snapshot_version = version
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': self._doc_count,
+                'segments': len(self._segments) + 1,
+                'live_documents': len(self._live.current),
+                'live_terms': len(self._live.terms),
+                'live_posting_bytes': self._live.nbytes(),
+                'mapped_bytes': sum(segment.size for segment in self._segments if isinstance(segment, _MappedSegment)),
+                'dead': sum(len(segment.dead) for segment in self._segments),
+            }
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
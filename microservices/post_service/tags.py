@@ -0,0 +1,52 @@
+"""Hashtag extraction and the Tag/PostTag index.
+
+Tags are parsed from post content at write time and linked in the same
+transaction as the post. PostTag carries a copy of the post's created_at,
+so a tag's timeline is a range scan of its (tag_id, created_at, post_id)
+index, newest first.
+"""
+import re
+
+TAG_PATTERN = re.compile(r'(?<![\w#])#(\w{1,50})')
+MAX_TAGS_PER_POST = 20
+
+
+def normalize_tag(name):
+    return name.lstrip('#').lower()
+
+
+def extract_tags(content):
+    """Distinct lowercased hashtags in ``content``, in order of first appearance."""
+    tags = dict.fromkeys(normalize_tag(match) for match in TAG_PATTERN.findall(content or ''))
+    return list(tags)[:MAX_TAGS_PER_POST]
+
+
+def link_tags(cursor, contents_by_post):
+    """Upsert the hashtags of ``{post_id: content}`` and link them to their posts.
+
+    Two statements, however many posts and tags: a multi-row upsert into Tag,
+    then one INSERT ... SELECT that resolves tag ids and copies created_at
+    from Post. Must run inside the transaction that wrote the posts.
+    """
+    tags_by_post = {post_id: extract_tags(content) for post_id, content in contents_by_post.items()}
+    tags_by_post = {post_id: tags for post_id, tags in tags_by_post.items() if tags}
+    if not tags_by_post:
+        return
+    names = list(dict.fromkeys(tag for tags in tags_by_post.values() for tag in tags))
+    cursor.execute("INSERT INTO Tag (name) VALUES " + ', '.join(['(%s)'] * len(names)) +
+                   " ON DUPLICATE KEY UPDATE id = id", tuple(names))
+
+    selects, params = [], []
+    for post_id, tags in tags_by_post.items():
+        selects.append("SELECT p.id, t.id, p.created_at FROM Post p JOIN Tag t ON t.name IN (" +
+                       ', '.join(['%s'] * len(tags)) + ") WHERE p.id = %s")
+        params.extend(tags)
+        params.append(post_id)
+    cursor.execute("INSERT INTO PostTag (post_id, tag_id, created_at) " + " UNION ALL ".join(selects),
+                   tuple(params))
+
+
+def relink_tags(cursor, post_id, content):
+    """Replace a post's tag links after its content changed."""
+    cursor.execute("DELETE FROM PostTag WHERE post_id = %s", (post_id,))
+    link_tags(cursor, {post_id: content})
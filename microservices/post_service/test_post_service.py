@@ -1,11 +1,18 @@
 import pytest
-from app import app, get_db_connection
+from app import app, get_db_connection, post_cache
 import json
 import mysql.connector
 from unittest.mock import patch, MagicMock
 import logging
 import time
+import itertools
 from mysql.connector import errors
+from datetime import datetime
+from microservices.post_service import feed, ranking, tags
+from microservices.post_service.feed import AuthorPostsCache
+from microservices.common.pagination import encode_cursor
+from microservices.post_service.search import SearchIndex
+from microservices.post_service.trending import TrendingTags
 
 @pytest.fixture
 def client():
@@ -94,6 +101,18 @@ def test_add_post_db_error(client, mock_db):
     assert response.status_code == 500
     assert response.json == {"error": "Internal Server Error"}
 
+def test_add_post_timeout_separates_withdrawn_from_unknown_writes(client, mocker):
+    from db.group_commit import CommitTimeout
+    committer = mocker.patch('app.group_commit')
+
+    committer.submit.side_effect = CommitTimeout("timed out", written=False)
+    assert client.post('/post', json={"user_id": 1, "content": "hi"}).status_code == 503
+
+    committer.submit.side_effect = CommitTimeout("timed out", written=None)
+    response = client.post('/post', json={"user_id": 1, "content": "hi"})
+    assert response.status_code == 202
+    assert 'id' not in response.json
+
 def test_update_post_success(client, mock_db):
     mock_cursor = mock_db.return_value
     mock_cursor.rowcount = 1
@@ -134,4 +153,490 @@ def test_get_post_success(client, setup_database):
         "user_id": user_id,
         "content": "This is a test post",
         "created_at": "2024-02-20 12:00:00"
-    }
\ No newline at end of file
+    }
+
+@pytest.fixture
+def mock_redis(mocker):
+    redis_client = mocker.patch('app.redis_client')
+    redis_client.smembers.return_value = set()
+    redis_client.zrangebyscore.return_value = []
+    mocker.patch('app.author_posts', AuthorPostsCache(redis_client))
+    mocker.patch.object(post_cache, 'redis', redis_client)
+    post_cache.clear_local()
+    return redis_client
+
+def test_add_post_fans_out_to_followers(client, mock_db, mock_redis):
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = [(7,), (8,)]
+
+    response = client.post('/post', json={"user_id": 1, "content": "Hello followers"})
+    assert response.status_code == 201
+
+    pipe = mock_redis.pipeline.return_value
+    fanned_out_to = [call.args[0] for call in pipe.zadd.call_args_list]
+    assert fanned_out_to == ["feed:1", "feed:7", "feed:8"]
+    assert all(call.args[1].keys() == {42} for call in pipe.zadd.call_args_list)
+
+def test_get_feed_returns_posts_in_timeline_order(client, mock_db, mock_redis):
+    mock_redis.zrevrangebyscore.return_value = [(b'3', 1708430500.0), (b'2', 1708430400.0)]
+    mock_db.fetchall.return_value = [
+        (2, 5, "older post", datetime(2024, 2, 20, 12, 0, 0)),
+        (3, 6, "newer post", datetime(2024, 2, 20, 12, 1, 40)),
+    ]
+
+    response = client.get('/feed/1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [3, 2]
+    mock_redis.pipeline.return_value.zrem.assert_not_called()
+
+def test_get_feed_drops_deleted_posts(client, mock_db, mock_redis):
+    mock_redis.zrevrangebyscore.return_value = [(b'3', 1708430500.0), (b'2', 1708430400.0)]
+    mock_db.fetchall.return_value = [(2, 5, "still here", datetime(2024, 2, 20, 12, 0, 0))]
+
+    response = client.get('/feed/1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [2]
+    mock_redis.pipeline.return_value.zrem.assert_called_once_with("feed:1", 3)
+
+def test_delete_post_removes_it_from_feeds(client, mock_db, mock_redis):
+    mock_db.fetchone.return_value = (5,)
+    mock_db.fetchall.return_value = [(7,)]
+    mock_db.rowcount = 1
+
+    response = client.delete('/post/3')
+    assert response.status_code == 200
+
+    pipe = mock_redis.pipeline.return_value
+    assert [call.args for call in pipe.zrem.call_args_list] == [("feed:5", 3), ("feed:7", 3)]
+
+def test_add_post_above_fanout_threshold_is_pulled_not_pushed(client, mock_db, mock_redis, mocker):
+    mocker.patch.object(feed, 'FEED_FANOUT_THRESHOLD', 1)
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = [(7,), (8,)]
+
+    response = client.post('/post', json={"user_id": 1, "content": "Hello fans"})
+    assert response.status_code == 201
+
+    pipe = mock_redis.pipeline.return_value
+    assert [call.args[0] for call in pipe.zadd.call_args_list] == ["author_posts:1", "feed:1"]
+    pipe.sadd.assert_called_once_with("feed:celebrities", 1)
+
+def test_get_feed_merges_followed_celebrity_posts(client, mock_db, mock_redis):
+    mock_redis.zrevrangebyscore.return_value = [(b'3', 300.0), (b'2', 100.0)]
+    mock_redis.smembers.return_value = {b'9'}
+    mock_redis.pipeline.return_value.execute.return_value = [[(b'5', 200.0)]]
+    mock_db.fetchall.side_effect = [
+        [(9,)],
+        [
+            (2, 5, "pushed, older", datetime(2024, 2, 20, 12, 0, 0)),
+            (3, 6, "pushed, newer", datetime(2024, 2, 20, 12, 2, 0)),
+            (5, 9, "pulled", datetime(2024, 2, 20, 12, 1, 0)),
+        ],
+    ]
+
+    response = client.get('/feed/1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [3, 5, 2]
+    assert response.json['next_cursor'] is None
+
+def test_get_feed_rejects_invalid_cursor(client):
+    response = client.get('/feed/1?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+def test_get_user_posts_rejects_out_of_range_cursor(client, mock_db):
+    response = client.get(f'/post/user/1?cursor={encode_cursor(10 ** 20, 4)}')
+    assert response.status_code == 400
+    mock_db.execute.assert_not_called()
+
+def test_merge_timelines_pages_without_gaps_or_duplicates():
+    timeline = [(9.0, 90), (7.0, 70), (5.0, 50), (5.0, 40), (1.0, 10)]
+    celebrity = [(8.0, 80), (5.0, 45), (2.0, 20)]
+    seen = []
+    before = None
+    while True:
+        page = feed.merge_timelines([timeline, celebrity, [(7.0, 70)]], 3, before)
+        seen.extend(post_id for _, post_id in page)
+        if len(page) < 3:
+            break
+        before = page[-1]
+    assert seen == [90, 80, 70, 50, 45, 40, 20, 10]
+
+def test_get_user_posts_first_page_has_next_cursor(client, mock_db):
+    mock_db.fetchall.return_value = [
+        (5, 1, "newest", datetime(2024, 2, 20, 12, 2, 0)),
+        (4, 1, "middle", datetime(2024, 2, 20, 12, 1, 0)),
+        (3, 1, "oldest", datetime(2024, 2, 20, 12, 0, 0)),
+    ]
+
+    response = client.get('/post/user/1?limit=2')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [5, 4]
+    assert response.json['next_cursor'] == encode_cursor(datetime(2024, 2, 20, 12, 1, 0).timestamp(), 4)
+    query, params = mock_db.execute.call_args.args
+    assert "OFFSET" not in query
+    assert params == (1, 3)
+
+def test_get_user_posts_with_cursor_seeks_past_it(client, mock_db):
+    mock_db.fetchall.return_value = [(3, 1, "oldest", datetime(2024, 2, 20, 12, 0, 0))]
+    created_at = datetime(2024, 2, 20, 12, 1, 0)
+
+    response = client.get(f'/post/user/1?limit=2&cursor={encode_cursor(created_at.timestamp(), 4)}')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [3]
+    assert response.json['next_cursor'] is None
+    _, params = mock_db.execute.call_args.args
+    assert params == (1, created_at, created_at, 4, 3)
+
+def test_get_post_comments(client, mock_db):
+    mock_db.fetchall.return_value = [(11, 2, "Nice post", datetime(2024, 2, 20, 12, 5, 0))]
+
+    response = client.get('/post/200/comments')
+    assert response.status_code == 200
+    assert response.json == {
+        'comments': [{
+            'id': 11,
+            'post_id': 200,
+            'user_id': 2,
+            'content': "Nice post",
+            'created_at': "2024-02-20 12:05:00"
+        }],
+        'next_cursor': None
+    }
+
+def test_add_posts_batch_returns_ids_in_order(client, mock_db, mock_redis):
+    mock_db.lastrowid = 300
+    mock_db.fetchall.return_value = []
+    posts = [{"user_id": 1, "content": f"Imported post {i}"} for i in range(3)]
+
+    response = client.post('/post/batch', json={"posts": posts})
+    assert response.status_code == 201
+    assert response.json['ids'] == [300, 301, 302]
+    mock_db.executemany.assert_called_once()
+    assert [row[:2] for row in mock_db.executemany.call_args.args[1]] == [(1, post["content"]) for post in posts]
+
+def test_add_posts_batch_reports_every_invalid_post(client, mock_db):
+    posts = [{"user_id": 1, "content": "ok"}, {"user_id": "1", "content": "bad id"}, {"user_id": 2, "content": " "}]
+
+    response = client.post('/post/batch', json={"posts": posts})
+    assert response.status_code == 400
+    assert [error['index'] for error in response.json['errors']] == [1, 2]
+    mock_db.executemany.assert_not_called()
+
+def test_add_posts_batch_rejects_non_object_body(client, mock_db):
+    response = client.post('/post/batch', json=[{"user_id": 1, "content": "ok"}])
+    assert response.status_code == 400
+    mock_db.executemany.assert_not_called()
+
+CACHED_POST = b'{"id": 3, "user_id": 5, "content": "hello", "created_at": "2024-02-20 12:00:00"}'
+
+def test_get_post_cache_hit_skips_database(client, mock_redis, mocker):
+    get_connection = mocker.patch('app.get_db_connection')
+    mock_redis.get.return_value = CACHED_POST
+
+    response = client.get('/post/3')
+    assert response.status_code == 200
+    assert response.get_data() == CACHED_POST
+    get_connection.assert_not_called()
+
+def test_get_post_missing_id_is_negatively_cached(client, mock_redis, mocker):
+    get_connection = mocker.patch('app.get_db_connection')
+    mock_redis.get.return_value = b''
+
+    response = client.get('/post/404')
+    assert response.status_code == 404
+    get_connection.assert_not_called()
+
+def test_get_post_miss_fills_cache_if_version_unchanged(client, mock_db, mock_redis):
+    mock_redis.get.return_value = None
+    mock_db.fetchone.return_value = (3, 5, "hello", datetime(2024, 2, 20, 12, 0, 0))
+    txn = mock_redis.pipeline.return_value.__enter__.return_value
+    txn.get.return_value = None
+
+    response = client.get('/post/3')
+    assert response.status_code == 200
+    assert response.json["content"] == "hello"
+    txn.watch.assert_called_once_with("post:3:version")
+    txn.setex.assert_called_once_with("post:3", 3600, response.get_data())
+
+def test_get_post_miss_does_not_overwrite_concurrent_update(client, mock_db, mock_redis):
+    mock_redis.get.return_value = None
+    mock_db.fetchone.return_value = (3, 5, "stale", datetime(2024, 2, 20, 12, 0, 0))
+    txn = mock_redis.pipeline.return_value.__enter__.return_value
+    txn.get.return_value = b'1'  # an update bumped the version while we read MySQL
+
+    response = client.get('/post/3')
+    assert response.status_code == 200
+    txn.setex.assert_not_called()
+
+def test_update_post_evicts_then_writes_through(client, mock_db, mock_redis):
+    mock_db.rowcount = 1
+    mock_db.fetchall.return_value = [(3, 5, "edited", datetime(2024, 2, 20, 12, 0, 0))]
+    mock_redis.pipeline.return_value.execute.return_value = [7, True, 1, 1]
+    txn = mock_redis.pipeline.return_value.__enter__.return_value
+    txn.get.return_value = b'7'
+
+    response = client.put('/post/3', json={"content": "edited"})
+    assert response.status_code == 200
+    mock_redis.pipeline.return_value.delete.assert_called_once_with("post:3")
+    payload = txn.setex.call_args.args[2]
+    assert json.loads(payload)["content"] == "edited"
+    txn.incr.assert_called_once_with("post:3:version")
+
+def test_add_post_writes_new_post_to_cache(client, mock_db, mock_redis):
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = []
+
+    response = client.post('/post', json={"user_id": 1, "content": "cached on write"})
+    assert response.status_code == 201
+    pipe = mock_redis.pipeline.return_value
+    pipe.incr.assert_any_call("post:42:version")
+    key, ttl, payload = pipe.setex.call_args.args
+    assert key == "post:42" and json.loads(payload)["content"] == "cached on write"
+
+def test_extract_tags_dedupes_and_lowercases():
+    assert tags.extract_tags("#Python and #python, #rust_lang! not#tag ##x") == ["python", "rust_lang"]
+
+def test_add_post_links_hashtags_before_commit(client, mock_db, mock_redis, mocker):
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = []
+    connection = mocker.Mock()
+    connection.cursor.return_value = mock_db
+    mocker.patch('app.get_db_connection', return_value=connection)
+    order = []
+    mock_db.execute.side_effect = lambda query, params=None: order.append(query.split()[2])
+    connection.commit.side_effect = lambda: order.append('COMMIT')
+
+    response = client.post('/post', json={"user_id": 1, "content": "Launch day #News #news #tech"})
+    assert response.status_code == 201
+    assert order[:4] == ['Post', 'Tag', 'PostTag', 'COMMIT']
+    tag_query, tag_params = mock_db.execute.call_args_list[1].args
+    assert tag_params == ("news", "tech") and "ON DUPLICATE KEY UPDATE" in tag_query
+    link_query, link_params = mock_db.execute.call_args_list[2].args
+    assert link_query.startswith("INSERT INTO PostTag") and link_params == ("news", "tech", 42)
+
+def test_add_post_without_hashtags_skips_tag_writes(client, mock_db, mock_redis):
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = []
+
+    response = client.post('/post', json={"user_id": 1, "content": "no tags here"})
+    assert response.status_code == 201
+    assert not any("Tag" in call.args[0] for call in mock_db.execute.call_args_list)
+
+def test_update_post_relinks_hashtags(client, mock_db, mock_redis):
+    mock_db.rowcount = 1
+    mock_db.fetchall.return_value = []
+
+    response = client.put('/post/3', json={"content": "now about #golang"})
+    assert response.status_code == 200
+    queries = [call.args for call in mock_db.execute.call_args_list]
+    assert queries[1] == ("DELETE FROM PostTag WHERE post_id = %s", (3,))
+    assert queries[2][1] == ("golang",)
+    assert queries[3][1] == ("golang", 3)
+
+def test_update_missing_post_does_not_touch_tags(client, mock_db, mock_redis):
+    mock_db.rowcount = 0
+
+    response = client.put('/post/3', json={"content": "now about #golang"})
+    assert response.status_code == 404
+    assert not any("Tag" in call.args[0] for call in mock_db.execute.call_args_list)
+
+def test_get_tag_posts_pages_through_tag_index(client, mock_db):
+    mock_db.fetchall.return_value = [
+        (9, 1, "#news later", datetime(2024, 2, 20, 12, 5, 0)),
+        (4, 2, "#news earlier", datetime(2024, 2, 20, 12, 0, 0)),
+    ]
+
+    response = client.get('/post/tag/%23News?limit=1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [9]
+    assert response.json['next_cursor'] == encode_cursor(datetime(2024, 2, 20, 12, 5, 0).timestamp(), 9)
+    query, params = mock_db.execute.call_args.args
+    assert "ORDER BY pt.created_at DESC, pt.post_id DESC" in query
+    assert params == ("news", 2)
+
+def test_search_index_ranks_by_relevance_then_recency():
+    index = SearchIndex()
+    now = datetime(2024, 2, 20, 12, 0, 0).timestamp()
+    index.add(1, "python tips and python tricks", now - 30 * 86400)
+    index.add(2, "python tips and python tricks", now)
+    index.add(3, "a note that mentions python once among many other words here", now)
+    index.add(4, "nothing relevant", now)
+
+    assert [post_id for _, post_id in index.search("Python tricks", 10, now=now)] == [2, 1, 3]
+
+def test_search_index_pages_and_applies_edits(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.snapshot"))
+    now = datetime(2024, 2, 20, 12, 0, 0).timestamp()
+    for post_id in range(1, 6):
+        index.add(post_id, f"release notes {post_id}", now - post_id * 3600)
+    assert index.snapshot()
+    index.add(6, "fresh release", now)
+    index.add(2, "edited away", now)
+    index.remove(3)
+
+    first = index.search("release", 2, now=now)
+    rest = index.search("release", 10, before=first[-1], now=now)
+    assert [post_id for _, post_id in first + rest] == [6, 1, 4, 5]
+    assert [post_id for _, post_id in index.search("edited", 10, now=now)] == [2]
+
+    # A restart maps the snapshot taken after the edits
+    assert index.snapshot()
+    reloaded = SearchIndex(str(tmp_path / "search.snapshot"))
+    assert [post_id for _, post_id in reloaded.search("release", 10, now=now)] == [6, 1, 4, 5]
+    assert reloaded.stats()['documents'] == 5
+
+def test_search_updates_reach_the_snapshot_owner_and_reload_compacts(tmp_path):
+    path = str(tmp_path / "search.snapshot")
+    db = {1: "old words here"}
+    refresh = lambda index, post_ids: [index.add(post_id, db[post_id], 0) for post_id in post_ids]
+    owner, other = SearchIndex(path, refresh=refresh), SearchIndex(path, refresh=refresh)
+    owner.add(1, db[1], 0)
+    assert owner.snapshot()
+    assert not other.snapshot()
+    assert other.reload()
+
+    db[1] = "fresh content"
+    other.add(1, db[1], 0)
+    owner._on_update(f"{other.instance_id}:1")
+    assert owner.snapshot()
+    assert other.reload()
+    assert other.stats()['live_documents'] == 0
+    assert [post_id for _, post_id in other.search("fresh", 10, now=0)] == [1]
+
+    restarted = SearchIndex(path)
+    assert [post_id for _, post_id in restarted.search("fresh", 10, now=0)] == [1]
+    assert restarted.search("old", 10, now=0) == []
+
+def test_reconcile_reindexes_changed_posts_and_drops_deleted_ones(mock_db):
+    from app import reconcile_search_index
+    from microservices.post_service.search import fingerprint
+    created_at = datetime(2024, 2, 20, 12, 0, 0)
+    index = SearchIndex()
+    for post_id, content in [(1, "same words"), (2, "old words"), (3, "deleted words"), (9, "deleted tail")]:
+        index.add(post_id, content, 0)
+    mock_db.fetchall.side_effect = [
+        [(1, fingerprint("same words")), (2, fingerprint("new words")), (4, fingerprint("new post"))],
+        [(2, 1, "new words", created_at), (4, 1, "new post", created_at)],
+        [],
+        [],
+    ]
+
+    reconcile_search_index(index)
+    assert sorted(index.doc_ids()) == [1, 2, 4]
+    assert sorted(post_id for _, post_id in index.search("new", 10, now=0)) == [2, 4]
+    assert index.search("old deleted", 10, now=0) == []
+
+def test_search_posts_returns_ranked_page_with_cursor(client, mock_db, mocker):
+    index = SearchIndex()
+    mocker.patch('app.search_index', index)
+    index.add(7, "launch day", datetime(2024, 2, 20, 12, 0, 0).timestamp())
+    index.add(8, "launch day launch", datetime(2024, 2, 20, 12, 0, 0).timestamp())
+    mock_db.fetchall.return_value = [(8, 1, "launch day launch", datetime(2024, 2, 20, 12, 0, 0))]
+
+    response = client.get('/post/search?q=launch&limit=1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [8]
+    assert response.json['next_cursor']
+
+    mock_db.fetchall.return_value = [(7, 1, "launch day", datetime(2024, 2, 20, 12, 0, 0))]
+    response = client.get(f"/post/search?q=launch&limit=1&cursor={response.json['next_cursor']}")
+    assert [post['id'] for post in response.json['posts']] == [7]
+    assert response.json['next_cursor'] is None
+
+def test_search_posts_drops_deleted_posts_and_fills_the_page(client, mock_db, mocker):
+    index = SearchIndex()
+    mocker.patch('app.search_index', index)
+    created_at = datetime(2024, 2, 20, 12, 0, 0)
+    for post_id, content in [(1, "launch launch launch"), (2, "launch launch"), (3, "launch")]:
+        index.add(post_id, content, created_at.timestamp())
+    mock_db.fetchall.side_effect = [[(2, 1, "launch launch", created_at)], [(3, 1, "launch", created_at)]]
+
+    response = client.get('/post/search?q=launch&limit=2')
+    assert [post['id'] for post in response.json['posts']] == [2, 3]
+    assert response.json['next_cursor'] is None
+    assert 1 not in index.doc_ids()
+
+def test_search_posts_requires_query(client):
+    response = client.get('/post/search?q=%20')
+    assert response.status_code == 400
+
+class FakeClock:
+    def __init__(self, now=1708430400.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_trending_estimates_match_exact_counts():
+    import random
+    from collections import Counter
+    rng = random.Random(7)
+    clock = FakeClock()
+    trending = TrendingTags(windows={'5m': 300}, capacity=50, refresh_interval=0, clock=clock)
+    population = [f"tag{i}" for i in range(5000)]
+    cum_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(population) + 1)))
+    stream = rng.choices(population, cum_weights=cum_weights, k=30000)
+    for tag in stream:
+        trending.record([tag])
+    exact = Counter(stream)
+
+    top = trending.top('5m', 10)
+    true_top = {tag for tag, _ in exact.most_common(10)}
+    assert len(true_top & {tag for tag, _ in top}) >= 9
+    for tag, estimate in top:
+        assert exact[tag] <= estimate <= exact[tag] * 1.1
+
+def test_trending_window_forgets_old_slices():
+    clock = FakeClock()
+    trending = TrendingTags(windows={'5m': 300}, refresh_interval=0, clock=clock)
+    trending.record(["old"] * 5)
+    clock.now += 150
+    trending.record(["new"] * 2)
+    assert trending.top('5m') == [("old", 5), ("new", 2)]
+    clock.now += 200
+    assert trending.top('5m') == [("new", 2)]
+
+def test_get_trending_counts_hashtags_of_new_posts(client, mock_db, mock_redis, mocker):
+    mocker.patch('app.trending_tags', TrendingTags(refresh_interval=0))
+    mock_db.lastrowid = 42
+    mock_db.fetchall.return_value = []
+    client.post('/post', json={"user_id": 1, "content": "#launch is live #news"})
+    client.post('/post', json={"user_id": 2, "content": "watching the #launch"})
+
+    response = client.get('/trending?window=1h&limit=1')
+    assert response.status_code == 200
+    assert response.json == {'window': '1h', 'tags': [{'tag': 'launch', 'count': 2}]}
+    assert client.get('/trending?window=2d').status_code == 400
+
+def test_ranking_prefers_engagement_and_affinity_over_small_age_gaps():
+    now = datetime(2024, 2, 20, 12, 0, 0).timestamp()
+    candidates = ranking.Candidates(
+        post_ids=[1, 2, 3],
+        created_at=[now - 600, now - 1200, now - 1200],
+        likes=[0, 50, 0],
+        comments=[0, 5, 0],
+        shares=[0, 1, 0],
+        affinity=ranking.author_affinity([10, 11, 12], {12: 40}, {12})
+    )
+    ranked = ranking.rank(candidates, now, 2)
+    assert [post_id for _, post_id in ranked] == [3, 2]
+    assert [post_id for _, post_id in ranking.rank(candidates, now, 5, before=ranked[-1])] == [1]
+
+def test_get_feed_engagement_ranking(client, mock_db, mock_redis):
+    mock_redis.zrevrangebyscore.return_value = [(b'3', 1708430500.0), (b'2', 1708430400.0)]
+    mock_redis.hgetall.return_value = {}
+    mock_db.fetchall.side_effect = [
+        [(2, 5, "popular", datetime(2024, 2, 20, 12, 0, 0), 400, 30, 10, 1708430400),
+         (3, 6, "quiet", datetime(2024, 2, 20, 12, 1, 40), 0, 0, 0, 1708430500)],
+        [(5, 4)],  # the reader has interacted with author 5 four times
+        [],
+    ]
+
+    response = client.get('/feed/1?ranking=engagement&limit=1')
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json['posts']] == [2]
+    assert response.json['next_cursor']
+    mock_redis.pipeline.return_value.hset.assert_called_once_with("affinity:1", mapping={'_': 0, 5: 4})
+
+def test_get_feed_rejects_unknown_ranking(client):
+    assert client.get('/feed/1?ranking=magic').status_code == 400
@@ -0,0 +1,149 @@
+"""Trending hashtags over sliding windows, in bounded memory.
+
+Each window keeps a ring of count-min sketches, one per slice of the
+window, plus their running sum, so a tag's count over the window is one
+sketch lookup. A bounded pool of the tags with the highest estimates is
+updated on every increment, and the top of a window is read from that
+pool instead of from the posts. The window advances one slice at a time:
+the oldest slice is subtracted from the sum and cleared.
+
+Counts are per process, fed by the posts this process writes.
+"""
+import hashlib
+import threading
+import time
+from array import array
+
+WINDOWS = {'5m': 300, '1h': 3600, '24h': 86400}
+
+
+def tag_hashes(tag):
+    """Two independent 64-bit hashes of a tag; a sketch derives its row indexes from them."""
+    digest = hashlib.blake2b(tag.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class CountMinSketch:
+    """Frequency estimates that never undercount and overcount by about total / width."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array('Q', [0]) * (width * depth)
+
+    def cells(self, hashes):
+        h1, h2 = hashes
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, cells, count=1):
+        for cell in cells:
+            self.table[cell] += count
+
+    def estimate(self, cells):
+        return min(self.table[cell] for cell in cells)
+
+    def subtract(self, other):
+        table = self.table
+        for i, count in enumerate(other.table):
+            if count:
+                table[i] -= count
+
+    def clear(self):
+        self.table = array('Q', [0]) * (self.width * self.depth)
+
+
+class SlidingTopK:
+    """Approximate heaviest tags over the last ``window`` seconds, advancing in ``window / slices`` steps."""
+
+    def __init__(self, window, slices=12, width=2048, depth=4, capacity=200):
+        self.slice_seconds = window / slices
+        self.slices = [CountMinSketch(width, depth) for _ in range(slices)]
+        self.total = CountMinSketch(width, depth)
+        self.capacity = capacity
+        self.candidates = {}  # tag -> [cells, estimate]
+        self._floor = None  # candidate with the lowest estimate, found lazily
+        self._slice = None
+
+    def _advance(self, now):
+        current = int(now // self.slice_seconds)
+        if self._slice is None:
+            self._slice = current
+        if current <= self._slice:
+            return
+        for expired in range(self._slice + 1, self._slice + 1 + min(current - self._slice, len(self.slices))):
+            sketch = self.slices[expired % len(self.slices)]
+            self.total.subtract(sketch)
+            sketch.clear()
+        self._slice = current
+        # Estimates only fall when a slice expires; refresh the pool and drop tags that left the window
+        for tag, candidate in list(self.candidates.items()):
+            candidate[1] = self.total.estimate(candidate[0])
+            if not candidate[1]:
+                del self.candidates[tag]
+        self._floor = None
+
+    def _floor_tag(self):
+        if self._floor is None or self._floor not in self.candidates:
+            self._floor = min(self.candidates, key=lambda tag: self.candidates[tag][1])
+        return self._floor
+
+    def add(self, tag, hashes, now):
+        self._advance(now)
+        cells = self.total.cells(hashes)
+        self.slices[self._slice % len(self.slices)].add(cells)
+        self.total.add(cells)
+        estimate = self.total.estimate(cells)
+
+        candidate = self.candidates.get(tag)
+        if candidate is not None:
+            candidate[1] = estimate
+            if tag == self._floor:
+                self._floor = None
+        elif len(self.candidates) < self.capacity:
+            self.candidates[tag] = [cells, estimate]
+            self._floor = None
+        else:
+            floor = self._floor_tag()
+            if estimate > self.candidates[floor][1]:
+                del self.candidates[floor]
+                self.candidates[tag] = [cells, estimate]
+                self._floor = None
+
+    def top(self, k, now):
+        self._advance(now)
+        ranked = sorted(self.candidates.items(), key=lambda item: (-item[1][1], item[0]))
+        return [(tag, estimate) for tag, (_, estimate) in ranked[:k]]
+
+
+class TrendingTags:
+    """Top hashtags for each of ``windows``, served from a result cached for ``refresh_interval`` seconds."""
+
+    def __init__(self, windows=WINDOWS, slices=12, width=2048, depth=4, capacity=200, refresh_interval=1.0,
+                 clock=time.time):
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._windows = {name: SlidingTopK(seconds, slices, width, depth, capacity)
+                         for name, seconds in windows.items()}
+        self._cache = {}  # window -> (computed at, ranked tags)
+
+    def record(self, tags):
+        if not tags:
+            return
+        now = self.clock()
+        with self._lock:
+            for tag in tags:
+                hashes = tag_hashes(tag)
+                for window in self._windows.values():
+                    window.add(tag, hashes, now)
+
+    def top(self, window, k=10):
+        """Up to ``k`` (tag, estimated count) pairs for ``window``, heaviest first."""
+        now = self.clock()
+        cached = self._cache.get(window)
+        if cached is None or now - cached[0] >= self.refresh_interval:
+            with self._lock:
+                ranked = self._windows[window].top(self.capacity, now)
+            cached = self._cache[window] = (now, ranked)
+        return cached[1][:k]
@@ -3,13 +3,19 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import mysql.connector
 from mysql.connector import Error
 import logging
-from db.config import config
-import pika
+from db.pool import get_pool
+from microservices.common.publisher import get_publisher
+from microservices.common.profiling import Profiler
+from microservices.common.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, TRACEPARENT, start_trace
+from microservices.common.cache import TwoTierCache
+from microservices.common.singleflight import SingleFlight, RedisLease, EarlyRefresh
 import json
+import random
+import time
 from consul import Consul
 from pybreaker import CircuitBreaker
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
@@ -24,94 +30,226 @@ app.config['JWT_SECRET_KEY'] = 'secret-key'
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Database configuration
-db_config = {
-    'user': config['user'],
-    'password': config['password'],
-    'host': config['host'],
-    'database': config['database']
-}
+# Stage latency metrics, served at /metrics
+metrics = Metrics('user_service')
+
+# Opt-in request profiling, read back from /admin/profiles. Set PROFILING_TOKEN to
+# allow profiling by header, or PROFILING_SAMPLE_RATE to profile a share of requests.
+app.config['PROFILING_TOKEN'] = None
+app.config['PROFILING_SAMPLE_RATE'] = 0.0
+SLOW_QUERY_THRESHOLD = 0.1  # seconds; slower statements are explained
+profiler = Profiler('user_service', slow_query_threshold=SLOW_QUERY_THRESHOLD, buffer_size=100)
+
+# Database connection pool shared with the other services in this process
+db_pool = get_pool()
 
 # RabbitMQ configuration
 RABBITMQ_HOST = 'localhost'
 RABBITMQ_QUEUE = 'service_queue'
+event_publisher = get_publisher(RABBITMQ_HOST, RABBITMQ_QUEUE)
 
 # Consul configuration
 consul_client = Consul(host="localhost", port=8500)
 
 # Redis configuration
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+redis_client = metrics.instrument_redis(redis.Redis(host='localhost', port=6379, db=0))
+user_cache = TwoTierCache(redis_client, channel='cache-invalidate:user', local_ttl=5)
+
+# User cache configuration
+USER_CACHE_TTL = 3600  # 1 hour
+USER_CACHE_TTL_JITTER = 0.1  # spread expiries over +/-10% so keys cached together do not expire together
+USER_CACHE_LEASE_TIMEOUT = 5  # seconds one worker may hold a key's rebuild lease
+USER_CACHE_LEASE_WAIT = 1  # seconds other workers wait for that rebuild before querying MySQL themselves
+USER_CACHE_POLL_INTERVAL = 0.02
+MAX_MULTI_GET = 1000
+user_flight = SingleFlight()
+user_refresh = EarlyRefresh(beta=1.0)
 
 # Circuit breaker configuration
 breaker = CircuitBreaker(fail_max=5, reset_timeout=30)
 
+@metrics.timed('get_db_connection')
 @breaker
 def get_db_connection():
     try:
-        connection = mysql.connector.connect(**db_config)
-        return connection
+        connection = db_pool.get_connection()
+        return metrics.instrument_connection(profiler.instrument_connection(connection))
     except mysql.connector.Error as err:
         logger.error(f"Database error: {err}")
         return None
 
+@metrics.timed('publish_message')
 def publish_message(message):
+    # Only buffers the message; the shared publisher sends it from a background thread
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-        channel = connection.channel()
-        channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key=RABBITMQ_QUEUE,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        connection.close()
-        logger.info(f"Message published to queue: {message}")
+        if not event_publisher.publish(message):
+            logger.warning(f"Dropped message for queue {RABBITMQ_QUEUE}: {message}")
     except Exception as e:
         logger.error(f"Error publishing message to RabbitMQ: {str(e)}")
 
-@app.route('/api/v1/user/<int:user_id>', methods=['GET'])
-@jwt_required()
-def get_user(user_id):
-    # Try to get user from cache
-    cached_user = redis_client.get(f"user:{user_id}")
-    if cached_user:
-        return jsonify(json.loads(cached_user)), 200
+def user_cache_ttl():
+    return int(USER_CACHE_TTL * random.uniform(1 - USER_CACHE_TTL_JITTER, 1 + USER_CACHE_TTL_JITTER))
 
+def serialize_user(user):
+    return json.dumps({
+        "id": user['id'],
+        "username": user['username'],
+        "email": user['email']
+    }).encode()
+
+def json_response(payload, status=200):
+    # Payloads are cached already encoded, so they are sent as-is instead of through jsonify
+    return Response(payload, status=status, mimetype='application/json')
+
+def wait_for_cached_user(user_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(USER_CACHE_POLL_INTERVAL)
+        cached_user = user_cache.get(f"user:{user_id}")
+        if cached_user:
+            return cached_user
+    return None
+
+def load_user(user_id):
     cnx = get_db_connection()
     if cnx is None:
-        return jsonify({"error": "Database connection failed"}), 500
+        raise mysql.connector.errors.OperationalError("Database connection failed")
 
+    started = time.monotonic()
     try:
         cursor = cnx.cursor(dictionary=True)
         query = "SELECT * FROM User WHERE id = %s"
         cursor.execute(query, (user_id,))
         user = cursor.fetchone()
         cursor.close()
+    finally:
         cnx.close()
 
-        if user:
-            result = {
-                "id": user['id'],
-                "username": user['username'],
-                "email": user['email']
-            }
-            # Cache the user for future requests
-            redis_client.setex(f"user:{user_id}", 3600, json.dumps(result))  # Cache for 1 hour
+    if not user:
+        return None
+    payload = serialize_user(user)
+    # Cache the user for future requests
+    user_cache.set(f"user:{user_id}", payload, user_cache_ttl())
+    user_refresh.record(time.monotonic() - started)
+    return payload
+
+def rebuild_user(user_id, stale_user):
+    # Only the worker holding the lease queries MySQL; the rest reuse its result
+    lease = RedisLease(redis_client, f"lock:user:{user_id}", USER_CACHE_LEASE_TIMEOUT)
+    if not lease.acquire():
+        if stale_user:
+            return stale_user, False
+        cached_user = wait_for_cached_user(user_id, USER_CACHE_LEASE_WAIT)
+        if cached_user:
+            return cached_user, False
+    try:
+        return load_user(user_id), True
+    finally:
+        lease.release()
+
+@app.route('/api/v1/user/<int:user_id>', methods=['GET'])
+@jwt_required()
+def get_user(user_id):
+    # Try to get user from cache, refreshing it early now and then while it is hot
+    cached_user, ttl = user_cache.get_with_ttl(f"user:{user_id}")
+    if cached_user and not user_refresh.should_refresh(ttl):
+        return json_response(cached_user)
+
+    try:
+        (payload, from_db), shared = user_flight.do(user_id, lambda: rebuild_user(user_id, cached_user))
+    except mysql.connector.errors.OperationalError as e:
+        logger.error(f"Database error: {e}")
+        return jsonify({"error": "Database connection failed"}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        publish_message({"action": "get_user", "user_id": user_id, "status": "error", "message": str(e)})
+        return jsonify({"error": "Internal Server Error"}), 500
+
+    if payload:
+        if from_db and not shared:
             publish_message({"action": "get_user", "user_id": user_id, "status": "success"})
-            return jsonify(result), 200
+        return json_response(payload)
+    else:
+        publish_message({"action": "get_user", "user_id": user_id, "status": "not_found"})
+        return jsonify({"error": "User not found"}), 404
+
+def parse_user_ids(raw_ids):
+    if isinstance(raw_ids, str):
+        raw_ids = [part for part in raw_ids.split(',') if part.strip()]
+    if not isinstance(raw_ids, list) or not raw_ids:
+        raise ValueError("Expected a non-empty list of user ids")
+    if len(raw_ids) > MAX_MULTI_GET:
+        raise ValueError(f"At most {MAX_MULTI_GET} user ids can be requested at once")
+    user_ids = []
+    for user_id in raw_ids:
+        # int() would turn true into 1 and 1.7 into 1
+        if isinstance(user_id, bool) or (isinstance(user_id, float) and not user_id.is_integer()):
+            raise ValueError("User ids must be integers")
+        try:
+            user_ids.append(int(user_id))
+        except (TypeError, ValueError):
+            raise ValueError("User ids must be integers")
+    return user_ids
+
+def get_user_payloads(user_ids):
+    unique_ids = list(dict.fromkeys(user_ids))
+    cached_users = user_cache.get_many([f"user:{user_id}" for user_id in unique_ids])
+    payloads = {}
+    missing_ids = []
+    for user_id, cached_user in zip(unique_ids, cached_users):
+        if cached_user:
+            payloads[user_id] = cached_user if isinstance(cached_user, bytes) else cached_user.encode()
         else:
-            publish_message({"action": "get_user", "user_id": user_id, "status": "not_found"})
-            return jsonify({"error": "User not found"}), 404
+            missing_ids.append(user_id)
+
+    if missing_ids:
+        cnx = get_db_connection()
+        if cnx is None:
+            raise mysql.connector.errors.OperationalError("Database connection failed")
+        try:
+            cursor = cnx.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(missing_ids))
+            cursor.execute(f"SELECT id, username, email FROM User WHERE id IN ({placeholders})", tuple(missing_ids))
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            cnx.close()
+
+        items = []
+        for user in rows:
+            payloads[user['id']] = serialize_user(user)
+            items.append((f"user:{user['id']}", payloads[user['id']], user_cache_ttl()))
+        user_cache.set_many(items)
+
+    return [payloads.get(user_id) or json.dumps({"id": user_id, "error": "User not found"}).encode()
+            for user_id in user_ids]
+
+@app.route('/api/v1/users', methods=['GET', 'POST'])
+@jwt_required()
+def get_users():
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({"error": "Expected a JSON object with an 'ids' list"}), 400
+        raw_ids = body.get('ids')
+    else:
+        raw_ids = request.args.get('ids', '')
+    try:
+        user_ids = parse_user_ids(raw_ids)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return json_response(b'{"users": [' + b', '.join(get_user_payloads(user_ids)) + b']}')
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        publish_message({"action": "get_user", "user_id": user_id, "status": "error", "message": str(e)})
         return jsonify({"error": "Internal Server Error"}), 500
 
 @app.route('/api/v1/user', methods=['POST'])
 @jwt_required()
 def add_user():
     user_data = request.json
+    cnx = None
     try:
         cnx = get_db_connection()
         if cnx is None:
@@ -123,7 +261,6 @@ def add_user():
         cursor.execute(add_user_query, (user_data['username'], user_data['email'], user_data['password']))
         cnx.commit()
         cursor.close()
-        cnx.close()
         
         publish_message({"action": "add_user", "user_id": cursor.lastrowid, "status": "success"})
         return jsonify({"message": "User created successfully"}), 201
@@ -131,11 +268,30 @@ def add_user():
         return jsonify({"error": "User already exists"}), 409
     except Exception as e:
         return jsonify({"error": "An error occurred while creating the user"}), 500
+    finally:
+        if cnx:
+            cnx.close()
+
+@app.before_request
+def begin_trace():
+    # Continues the trace the gateway passed on
+    start_trace(request.headers.get(TRACEPARENT))
+
+# Registered after begin_trace so profiles carry the trace id
+profiler.install(app)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/health')
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/health/db')
+def db_pool_stats():
+    return jsonify({"pool": db_pool.stats()}), 200
+
 def register_service():
     consul_client.agent.service.register(
         "user-service",
@@ -1,5 +1,5 @@
 import pytest
-from app import app, get_db_connection
+from app import app, get_db_connection, user_cache
 from flask_jwt_extended import create_access_token
 import json
 import mysql.connector
@@ -51,3 +51,83 @@ def test_add_user_success(client, mock_db):
     response = client.post('/api/v1/user', headers=headers, json=user_data)
     assert response.status_code == 201
     assert response.json == {'message': 'User created successfully'}
+
+@pytest.fixture
+def mock_redis(mocker):
+    mock = mocker.patch('app.redis_client')
+    mocker.patch.object(user_cache, 'redis', mock)
+    user_cache.clear_local()
+    return mock
+
+@pytest.fixture
+def auth_headers():
+    with app.app_context():
+        access_token = create_access_token(identity="test")
+    return {"Authorization": f"Bearer {access_token}"}
+
+def test_get_users_mixes_cache_hits_and_db_rows_in_request_order(client, mock_db, mock_redis, auth_headers):
+    mock_redis.mget.return_value = [None, json.dumps({"id": 1, "username": "cached", "email": "c@example.com"}), None]
+    mock_db.fetchall.return_value = [{"id": 3, "username": "fromdb", "email": "d@example.com"}]
+
+    response = client.get('/api/v1/users?ids=3,1,7', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json == {"users": [
+        {"id": 3, "username": "fromdb", "email": "d@example.com"},
+        {"id": 1, "username": "cached", "email": "c@example.com"},
+        {"id": 7, "error": "User not found"},
+    ]}
+    mock_redis.mget.assert_called_once_with(["user:3", "user:1", "user:7"])
+    query, params = mock_db.execute.call_args.args
+    assert "IN (%s, %s)" in query and params == (3, 7)
+    mock_redis.pipeline.return_value.setex.assert_called_once()
+
+def test_get_users_post_body_all_cached_skips_db(client, mock_db, mock_redis, auth_headers):
+    mock_redis.mget.return_value = [json.dumps({"id": 2, "username": "u2", "email": "u2@example.com"})]
+
+    response = client.post('/api/v1/users', headers=auth_headers, json={"ids": [2]})
+    assert response.status_code == 200
+    assert response.json == {"users": [{"id": 2, "username": "u2", "email": "u2@example.com"}]}
+    mock_db.execute.assert_not_called()
+
+def test_get_users_rejects_bad_ids(client, auth_headers):
+    response = client.get('/api/v1/users?ids=1,abc', headers=auth_headers)
+    assert response.status_code == 400
+    for body in ([1, 2], {"ids": [True, 1.7]}, {"ids": [1.5]}):
+        response = client.post('/api/v1/users', headers=auth_headers, json=body)
+        assert response.status_code == 400
+        assert 'error' in response.json
+
+def test_get_user_waits_for_rebuild_when_another_worker_holds_lease(client, mock_db, mock_redis, auth_headers):
+    mock_redis.pipeline.return_value.execute.return_value = [None, -2]
+    mock_redis.set.return_value = None  # lease already taken
+    mock_redis.get.side_effect = [None, json.dumps({"id": 5, "username": "u5", "email": "u5@example.com"})]
+
+    response = client.get('/api/v1/user/5', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json == {"id": 5, "username": "u5", "email": "u5@example.com"}
+    mock_db.execute.assert_not_called()
+
+def test_get_user_serves_stale_value_while_another_worker_refreshes(client, mock_db, mock_redis, auth_headers, mocker):
+    stale = json.dumps({"id": 6, "username": "old", "email": "u6@example.com"})
+    mock_redis.pipeline.return_value.execute.return_value = [stale, 10]
+    mock_redis.set.return_value = None
+    mocker.patch('app.user_refresh.should_refresh', return_value=True)
+
+    response = client.get('/api/v1/user/6', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json["username"] == "old"
+    mock_db.execute.assert_not_called()
+
+def test_get_user_early_refresh_reloads_from_db_under_lease(client, mock_db, mock_redis, auth_headers, mocker):
+    stale = json.dumps({"id": 7, "username": "old", "email": "u7@example.com"})
+    mock_redis.pipeline.return_value.execute.return_value = [stale, 10]
+    mock_redis.set.return_value = True
+    mocker.patch('app.user_refresh.should_refresh', return_value=True)
+    mock_db.fetchone.return_value = {"id": 7, "username": "new", "email": "u7@example.com"}
+
+    response = client.get('/api/v1/user/7', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json["username"] == "new"
+    key, ttl, _ = mock_redis.pipeline.return_value.setex.call_args.args
+    assert key == "user:7" and 3240 <= ttl <= 3960
+    assert mock_redis.set.call_args.kwargs['nx'] is True